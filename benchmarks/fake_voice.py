@@ -0,0 +1,128 @@
+import time
+import threading
+
+FRAME_SECONDS = 0.02  # discord.py's AudioPlayer reads one 20 ms frame per iteration
+
+class FakePlayer:
+    """One play() call: a thread pulling frames from the source the way discord.py's AudioPlayer does."""
+    def __init__(self, client, source, after):
+        self.client = client
+        self.source = source
+        self.after = after
+        self.end = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        error = None
+        next_at = time.perf_counter()
+        try:
+            while not self.end.is_set():
+                if not self.resumed.is_set():
+                    self.resumed.wait()
+                    next_at = time.perf_counter()
+                    continue
+                started = time.perf_counter()
+                data = self.source.read()
+                finished = time.perf_counter()
+                if not data:
+                    break
+                if self.end.is_set():
+                    break  # Stopped while reading; the frame would never be sent
+                self.client.record(finished, finished - started, self.source.is_opus())
+                if self.client.realtime:
+                    next_at += FRAME_SECONDS
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            self.end.set()
+            self.source.cleanup()
+            if self.after:
+                self.after(error)
+
+    def is_playing(self):
+        return self.resumed.is_set() and not self.end.is_set()
+
+    def is_paused(self):
+        return not self.end.is_set() and not self.resumed.is_set()
+
+class FakeVoiceClient:
+    """
+    In-process stand-in for discord.VoiceClient. Sources are consumed at real-time pace
+    (or as fast as possible with realtime=False) and every delivered frame is timestamped.
+    Nothing is sent anywhere and PCM frames are not Opus-encoded.
+    """
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.player = None
+        self.encoder = None
+        self.frames = []  # (perf_counter when delivered, seconds spent in read(), is_opus)
+        self.condition = threading.Condition()
+
+    @property
+    def source(self):
+        return self.player.source if self.player else None
+
+    def record(self, delivered, read_seconds, is_opus):
+        with self.condition:
+            self.frames.append((delivered, read_seconds, is_opus))
+            self.condition.notify_all()
+
+    def play(self, source, after=None):
+        if self.is_playing():
+            raise RuntimeError("Already playing audio.")
+        self.player = FakePlayer(self, source, after)
+        self.player.thread.start()
+
+    def is_playing(self):
+        return self.player is not None and self.player.is_playing()
+
+    def is_paused(self):
+        return self.player is not None and self.player.is_paused()
+
+    def pause(self):
+        if self.player:
+            self.player.resumed.clear()
+
+    def resume(self):
+        if self.player:
+            self.player.resumed.set()
+
+    def stop(self):
+        if self.player:
+            self.player.end.set()
+            self.player.resumed.set()
+
+    def wait_stopped(self, timeout=5.0):
+        """Blocks until the current player thread has exited."""
+        if self.player:
+            self.player.thread.join(timeout)
+
+    def clear_frames(self):
+        with self.condition:
+            self.frames = []
+
+    def wait_for_frame(self, after, timeout=30.0):
+        """Returns the delivery time of the first frame delivered at or after `after`, or None on timeout."""
+        deadline = time.perf_counter() + timeout
+        with self.condition:
+            while True:
+                first = None
+                for delivered, _, _ in reversed(self.frames):
+                    if delivered < after:
+                        break
+                    first = delivered
+                if first is not None:
+                    return first
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def frame_count(self):
+        with self.condition:
+            return len(self.frames)
@@ -0,0 +1,438 @@
+"""
+Phonograph benchmark suite.
+
+Generates synthetic audio fixtures with ffmpeg in a temporary folder, points the engine's cache and
+metadata index there, and drives playback through an in-process FakeVoiceClient. Results are written
+as JSON (one file per commit by default) so runs can be compared across commits:
+
+    python -m benchmarks.run_benchmarks [--quick] [--repeat N] [--output FILE] [--compare BASELINE] [--strict]
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+from src import audio_engine as engine
+from src.metadata_index import MetadataIndex
+from src.library import LibraryScanner
+from src.transcoder import TranscodeScheduler
+from src.ogg_opus import get_index_path
+from src.cache_store import remove_cache_file
+from .fake_voice import FakeVoiceClient, FRAME_SECONDS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+SCHEMA_VERSION = 1
+LAG_TICK_SECONDS = 0.001  # Period of the ticker that measures event loop stalls
+SEEK_BURST = 8  # Seeks fired at once, as a dragged slider does
+LEAD_IN_SECONDS = 2.0  # Leading silence of the time-to-sound fixture
+REGRESSION_THRESHOLD = 0.10  # Median change that counts as a regression when comparing runs
+
+FULL = {'track_seconds': 60, 'transcode_files': 6, 'library_files': 3000, 'loop_seconds': 3, 'loops': 3}
+QUICK = {'track_seconds': 10, 'transcode_files': 2, 'library_files': 300, 'loop_seconds': 2, 'loops': 2}
+
+def log(message):
+    print(f"[Bench] {message}", file=sys.stderr)
+
+@contextlib.contextmanager
+def quiet(enabled):
+    """Swallows the engine's print() output while a case runs."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def make_fixture(path, seconds, frequency=440, lead_in=0.0):
+    """
+    Writes a stereo test tone with a little pink noise, so loudness analysis has real work to do.
+    lead_in adds that many seconds of digital silence in front of it, as many rips have.
+    """
+    delay = f",adelay={int(lead_in * 1000)}|{int(lead_in * 1000)}" if lead_in else ""
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f"sine=frequency={frequency}:sample_rate=44100:duration={seconds}",
+        '-f', 'lavfi', '-i', f"anoisesrc=color=pink:amplitude=0.05:sample_rate=44100:duration={seconds}",
+        '-filter_complex', f"amix=inputs=2,aformat=channel_layouts=stereo{delay}", path
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return path
+
+def drop_cache(filepath):
+    """Removes every cache file and the index row of a track, so the next run starts cold."""
+    for variant in (None, "norm"):
+        cached = engine.get_cache_path(filepath, variant)
+        for path in (cached, get_index_path(cached)):
+            try:
+                remove_cache_file(path)
+            except FileNotFoundError:
+                pass
+    engine.shared.index.forget(filepath)
+    engine.shared.optimized_files.pop(filepath, None)
+
+class Results:
+    """Collected metrics: name -> samples with their unit and which direction is better."""
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, samples, unit, better="lower"):
+        valid = [s for s in samples if s is not None]
+        self.metrics[name] = {
+            'unit': unit,
+            'better': better,
+            'median': round(statistics.median(valid), 4) if valid else None,
+            'min': round(min(valid), 4) if valid else None,
+            'max': round(max(valid), 4) if valid else None,
+            'samples': [round(s, 4) for s in valid],
+            'failures': len(samples) - len(valid),
+        }
+        entry = self.metrics[name]
+        shown = f"{entry['median']:.2f} {unit}" if valid else "failed"
+        log(f"  {name}: {shown}")
+
+class Bench:
+    """Runs every benchmark case against fixtures in `workdir`."""
+    def __init__(self, workdir, config, repeat):
+        self.workdir = workdir
+        self.config = config
+        self.repeat = repeat
+        self.results = Results()
+        self.loop = asyncio.new_event_loop()
+        self.random = random.Random(1234)  # Same seek targets on every run
+        self.fixtures_dir = os.path.join(workdir, "fixtures")
+        os.makedirs(self.fixtures_dir)
+
+        # Keep the real cache and index out of it
+        engine.shared.cache_dir = os.path.join(workdir, "cache")
+        engine.shared.index = MetadataIndex(os.path.join(workdir, "index.db"))
+        engine.shared.optimized_files.clear()
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def fixture(self, name, seconds, frequency=440, lead_in=0.0):
+        return make_fixture(os.path.join(self.fixtures_dir, name), seconds, frequency, lead_in)
+
+    def new_session(self, realtime=True):
+        session = engine.get_session("benchmark", "Benchmark")
+        session.current_voice_client = FakeVoiceClient(realtime)
+        return session
+
+    def end_session(self, session):
+        vc = session.current_voice_client
+        session.new_player()
+        vc.stop()
+        vc.wait_stopped()
+        engine.remove_session(session.guild_id)
+
+    def run_all(self):
+        cfg = self.config
+        log("Generating fixtures...")
+        batch = [self.fixture(f"batch_{i}.flac", cfg['track_seconds'], 220 + 40 * i)
+                 for i in range(cfg['transcode_files'])]
+        cached = self.fixture("cached.flac", cfg['track_seconds'])
+        uncached = self.fixture("uncached.wav", cfg['track_seconds'], 330)
+        loop_cached = self.fixture("loop_cached.flac", cfg['loop_seconds'], 550)
+        loop_uncached = self.fixture("loop_uncached.wav", cfg['loop_seconds'], 660)
+        lead_in = self.fixture("lead_in.flac", cfg['track_seconds'], 770, lead_in=LEAD_IN_SECONDS)
+
+        log("Transcode throughput")
+        self.transcode_throughput(batch)
+        for path in (cached, loop_cached, lead_in):
+            engine.transcode_to_opus(path)
+            engine.get_audio_duration(path)  # As the optimization worker's backfill does
+
+        log("Time to first frame")
+        self.results.add("ttff_cached_ms", self.time_to_first_frame(cached, False), "ms")
+        self.results.add("ttff_cached_norm_ms", self.time_to_first_frame(cached, True), "ms")
+        self.results.add("ttff_uncached_ms", self.time_to_first_frame(uncached, False, cold=True), "ms")
+        self.results.add("ttff_uncached_norm_ms", self.time_to_first_frame(uncached, True, cold=True), "ms")
+        self.results.add("time_to_sound_lead_in_ms", self.time_to_sound(lead_in, LEAD_IN_SECONDS), "ms")
+
+        log("Event loop lag")
+        self.results.add("play_loop_lag_cold_ms", self.play_loop_lag(uncached), "ms")
+
+        log("Seek latency")
+        self.seek_latency("cached", cached)
+        self.seek_latency("uncached", uncached)
+        self.results.add("seek_burst_restarts", [self.seek_burst(uncached)], "restarts")
+
+        log("Loop gap")
+        self.results.add("loop_gap_cached_ms", [self.loop_gap(loop_cached)], "ms")
+        self.results.add("loop_gap_uncached_ms", [self.loop_gap(loop_uncached)], "ms")
+
+        log("Directory open")
+        self.directory_open(cfg['library_files'])
+        return self.results
+
+    def transcode_throughput(self, batch):
+        scheduler = TranscodeScheduler()
+        files_per_second = []
+        realtime_factor = []
+        try:
+            for _ in range(self.repeat):
+                for path in batch:
+                    drop_cache(path)
+                stats = scheduler.run_batch(batch)
+                files_per_second.append(stats.files_per_second if not stats.files_failed else None)
+                realtime_factor.append(stats.audio_seconds_per_second if not stats.files_failed else None)
+        finally:
+            scheduler.shutdown()
+        self.results.add("transcode_files_per_s", files_per_second, "files/s", better="higher")
+        self.results.add("transcode_audio_x_realtime", realtime_factor, "x", better="higher")
+
+    def time_to_first_frame(self, filepath, normalized, cold=False):
+        """Milliseconds from play_audio_logic() being called until the voice client gets its first frame."""
+        samples = []
+        for _ in range(self.repeat):
+            if cold:
+                # A never-played file: no index row, so the duration probe is part of the cost
+                engine.shared.index.forget(filepath)
+            session = self.new_session()
+            session.is_normalized = normalized
+            started = time.perf_counter()
+            self.run(engine.play_audio_logic(None, session, filepath))
+            first = session.current_voice_client.wait_for_frame(started)
+            samples.append((first - started) * 1000 if first else None)
+            self.end_session(session)
+        return samples
+
+    def time_to_sound(self, filepath, lead_in):
+        """
+        Milliseconds from play_audio_logic() being called until the first audible frame is delivered:
+        the time to the first frame plus the part of the track's leading silence that was played.
+        """
+        samples = []
+        for _ in range(self.repeat):
+            session = self.new_session()
+            started = time.perf_counter()
+            self.run(engine.play_audio_logic(None, session, filepath))
+            first = session.current_voice_client.wait_for_frame(started)
+            if first:
+                silence_played = max(lead_in - session.clock.base / engine.OPUS_SAMPLE_RATE, 0.0)
+                samples.append((first - started + silence_played) * 1000)
+            else:
+                samples.append(None)
+            self.end_session(session)
+        return samples
+
+    def seek_latency(self, name, filepath):
+        """
+        Records how long seek_logic() takes to return and how long until the first frame after it is delivered.
+        The second figure includes waiting for the next 20 ms tick, as a listener would.
+        """
+        session = self.new_session()
+        vc = session.current_voice_client
+        self.run(engine.play_audio_logic(None, session, filepath))
+        vc.wait_for_frame(0)
+        call_ms = []
+        audio_ms = []
+        for _ in range(self.repeat * 4):
+            target = self.random.uniform(0, max(session.total_duration - 5, 0))
+            started = time.perf_counter()
+            self.run(engine.seek_logic(None, session, target))
+            returned = time.perf_counter()
+            delivered = vc.wait_for_frame(returned)
+            call_ms.append((returned - started) * 1000)
+            audio_ms.append((delivered - started) * 1000 if delivered else None)
+        self.end_session(session)
+        self.results.add(f"seek_{name}_call_ms", call_ms, "ms")
+        self.results.add(f"seek_{name}_to_audio_ms", audio_ms, "ms")
+
+    async def measure_loop_lag(self, coro):
+        """Awaits coro while a ticker runs beside it; returns the longest the event loop was blocked, in milliseconds."""
+        loop = asyncio.get_running_loop()
+        worst = 0.0
+        running = True
+
+        async def ticker():
+            nonlocal worst
+            while running:
+                scheduled = loop.time() + LAG_TICK_SECONDS
+                await asyncio.sleep(LAG_TICK_SECONDS)
+                worst = max(worst, loop.time() - scheduled)
+
+        task = loop.create_task(ticker())
+        await asyncio.sleep(0)  # Let the ticker start first
+        try:
+            await coro
+        finally:
+            running = False
+            await task
+        return worst * 1000
+
+    def play_loop_lag(self, filepath):
+        """Longest event loop stall while play_audio_logic() starts a never-probed track (probe, open and spawn)."""
+        samples = []
+        for _ in range(self.repeat):
+            engine.shared.index.forget(filepath)
+            session = self.new_session()
+            samples.append(self.run(self.measure_loop_lag(engine.play_audio_logic(None, session, filepath))))
+            self.end_session(session)
+        return samples
+
+    def seek_burst(self, filepath):
+        """
+        Fires a burst of seeks at a track that can only seek by restarting (live normalisation) and returns
+        how many restarts actually started. Coalescing should start only the last one.
+        """
+        session = self.new_session()
+        session.is_normalized = True
+        vc = session.current_voice_client
+        self.run(engine.play_audio_logic(None, session, filepath))
+        vc.wait_for_frame(0)
+        before = engine.metrics.value('phonograph_play_requests_total', result='started')
+
+        async def burst():
+            targets = [self.random.uniform(0, max(session.total_duration - 5, 0)) for _ in range(SEEK_BURST)]
+            await asyncio.gather(*(engine.seek_logic(None, session, target) for target in targets))
+
+        self.run(burst())
+        restarts = engine.metrics.value('phonograph_play_requests_total', result='started') - before
+        self.end_session(session)
+        return restarts
+
+    def loop_gap(self, filepath):
+        """
+        Plays a short track on loop in real time and returns the longest stall between two frames
+        beyond the 20 ms frame period, in milliseconds. A gapless loop scores close to 0.
+        """
+        session = self.new_session()
+        session.is_looping = True
+        vc = session.current_voice_client
+        self.run(engine.play_audio_logic(None, session, filepath))
+        if vc.wait_for_frame(0) is None:
+            self.end_session(session)
+            return None
+        time.sleep(self.config['loop_seconds'] * self.config['loops'] + 0.5)
+        self.end_session(session)
+        times = [delivered for delivered, _, _ in vc.frames]
+        intervals = [b - a for a, b in zip(times, times[1:])]
+        if not intervals:
+            return None
+        return max(0.0, max(intervals) - FRAME_SECONDS) * 1000
+
+    def directory_open(self, count):
+        """Times what opening a folder costs: the recursive scan, then the cache status pass (cold and warm index)."""
+        root = os.path.join(self.workdir, "library")
+        for i in range(count):
+            folder = os.path.join(root, f"album_{i % 50:02d}")
+            os.makedirs(folder, exist_ok=True)
+            # The scanner and the status pass only stat files, so empty ones are enough
+            open(os.path.join(folder, f"track_{i:05d}.flac"), 'wb').close()
+
+        main_index = engine.shared.index
+        scan_ms = []
+        cold_ms = []
+        warm_ms = []
+        try:
+            for run in range(self.repeat):
+                started = time.perf_counter()
+                added, _, _ = LibraryScanner(root, lambda *changes: None).scan()
+                scan_ms.append((time.perf_counter() - started) * 1000)
+
+                engine.shared.index = MetadataIndex(os.path.join(self.workdir, f"library-{run}.db"))
+                for samples in (cold_ms, warm_ms):
+                    started = time.perf_counter()
+                    for path in added:
+                        engine.is_file_optimized(path)
+                    samples.append((time.perf_counter() - started) * 1000)
+        finally:
+            engine.shared.index = main_index
+        self.results.add("dir_scan_ms", scan_ms, "ms")
+        self.results.add("dir_status_cold_ms", cold_ms, "ms")
+        self.results.add("dir_status_warm_ms", warm_ms, "ms")
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return result.stdout.splitlines()[0] if result.stdout else None
+    except OSError:
+        return None
+
+def compare(report, baseline):
+    """Prints every metric's median against a baseline run. Returns the names of the metrics that regressed."""
+    regressions = []
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'}:")
+    for name, entry in report['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or not old.get('median') or entry['median'] is None:
+            print(f"  {name:<28} (no baseline)")
+            continue
+        change = (entry['median'] - old['median']) / old['median']
+        worse = change > REGRESSION_THRESHOLD if entry['better'] == "lower" else change < -REGRESSION_THRESHOLD
+        if worse:
+            regressions.append(name)
+        marker = "  REGRESSED" if worse else ""
+        print(f"  {name:<28} {old['median']:>10.2f} -> {entry['median']:>10.2f} {entry['unit']:<8} {change:+.1%}{marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Phonograph's transcode, playback start, seek and loop paths.")
+    parser.add_argument('--quick', action='store_true', help="Shorter fixtures and fewer files")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case (default 3)")
+    parser.add_argument('--output', help="Results file (default benchmarks/results/<revision>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--strict', action='store_true', help="Exit with status 1 if a metric regressed")
+    parser.add_argument('--verbose', action='store_true', help="Show the engine's own output")
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        log("ffmpeg and ffprobe must be on PATH to generate fixtures.")
+        return 2
+
+    config = QUICK if args.quick else FULL
+    revision = git_revision()
+    workdir = tempfile.mkdtemp(prefix="phonograph-bench-")
+    try:
+        with quiet(not args.verbose):
+            results = Bench(workdir, config, max(args.repeat, 1)).run_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'schema': SCHEMA_VERSION,
+        'revision': revision,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': ffmpeg_version(),
+        },
+        'settings': dict(config, quick=args.quick, repeat=args.repeat),
+        'results': results.metrics,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    log(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f))
+        if regressions and args.strict:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,46 +4,352 @@ import time
 import discord
 import asyncio
 import hashlib
+import json
+import re
+import threading
+from .metadata_index import MetadataIndex
+from .ogg_opus import OggOpusReader, OggOpusSource, TeeOpusSource, OPUS_SAMPLE_RATE, write_page_index
+from .playlist import TrackQueue, QueueSource
+from .mixer import LayerMixer, MixerSource, WavePCMSource
+from .playback_clock import FrameClock, ClockedSource, unwrap_source
+from .waveform import WAVEFORM_ARGS, WaveformBuilder, waveform_supported, get_waveform_path, write_waveform
+from .cache_store import cache_file_exists, get_cache_file_mtime, store_cache_file, get_ffmpeg_input
+from .metrics import metrics, watch_process
+from .events import (bus, TRACK_STARTED, PAUSED, RESUMED, SEEKED, ENDED, SETTINGS_CHANGED,
+                     QUEUE_CHANGED, SESSIONS_CHANGED, CACHE_STATUS_CHANGED, LAYERS_CHANGED, WAVEFORM_READY)
 
-# Shared State Object
-class PlaybackState:
+# Process-wide State Object, shared by every guild session
+class SharedState:
     def __init__(self):
+        self.optimized_files = {}  # absolute path -> is_optimized (bool), as last reported
+        self.optimized_lock = threading.Lock()
+        # Use absolute path for central cache in bot root
+        self.bot_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.cache_dir = os.path.join(self.bot_root, ".phonograph_cache")
+        # Persistent per-track metadata (durations, mtimes, cache status) kept next to the cache
+        self.index = MetadataIndex(os.path.join(self.bot_root, ".phonograph_index.db"))
+        # Plain cache paths of the entries being written right now (first-play tees and transcodes)
+        self.cache_writes = set()
+        self.cache_writes_lock = threading.Condition()  # Notified whenever a write finishes
+        # Cache files whose waveform overview is being built from the cached Opus (see start_waveform_build)
+        self.waveform_builds = set()
+        # Tracks whose cached Opus is being scanned for silence (see start_silence_scan)
+        self.silence_scans = set()
+
+shared = SharedState()
+
+# Per-guild Playback Session
+class PlaybackState:
+    """
+    Playback state of one guild. The discord event loop, the audio player thread and the GUI all
+    touch it, so playback state is only changed through the mark_* methods, which hold a lock
+    and publish the change on the event bus. The position comes from the frames actually
+    delivered to the voice client (see playback_clock).
+    """
+    def __init__(self, guild_id=None, guild_name=None):
+        self.guild_id = guild_id
+        self.guild_name = guild_name
         self.current_voice_client = None
         self.is_looping = False
         self.current_track_path = None
         self.total_duration = 0.0
-        self.start_playback_time = 0.0
-        self.elapsed_offset = 0.0
-        self.is_seeking = False
-        self.suppress_after_callback = False
+        self.clock = FrameClock()
+        self.is_playing = False
+        self.is_paused = False
+        self.player_generation = 0  # Bumped for every play() handed to the voice client (see new_player)
+        self.play_task = None  # Start of a track still being prepared (see play_audio_logic)
+        self.play_target = None  # Track that start is for
         self.is_normalized = False
-        self.optimized_files = {}  # filename -> is_optimized (bool)
-        # Use absolute path for central cache in bot root
-        self.bot_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.cache_dir = os.path.join(self.bot_root, ".phonograph_cache")
+        self.queue = TrackQueue(on_change=lambda: bus.publish(QUEUE_CHANGED, session=self))
+        self.crossfade_seconds = 0.0  # 0 = hard (gapless) cut between queued tracks
+        # Ambience and sound effects mixed on top of the music (see mixer)
+        self.mixer = LayerMixer(on_change=lambda: bus.publish(LAYERS_CHANGED, session=self))
+        self.lock = threading.Lock()
+
+    def new_player(self):
+        """
+        Called right before the voice client's player is stopped or replaced. Returns the generation of the
+        player about to start; after-callbacks of earlier players see it changed and do nothing.
+        """
+        with self.lock:
+            self.player_generation += 1
+            return self.player_generation
+
+    def is_current_player(self, generation):
+        with self.lock:
+            return generation == self.player_generation
+
+    def channel_bitrate(self):
+        """Bitrate of the connected voice channel in kbps, or None when it is unknown."""
+        vc = self.current_voice_client
+        bitrate = getattr(getattr(vc, 'channel', None), 'bitrate', None)
+        return bitrate // 1000 if bitrate else None
+
+    def tune_encoder(self):
+        """Matches the voice client's Opus encoder (used for mixed and live-filtered frames) to the channel."""
+        encoder = getattr(self.current_voice_client, 'encoder', None)
+        kbps = self.channel_bitrate()
+        if encoder is not None and kbps:
+            try:
+                encoder.set_bitrate(min(kbps, MASTER_BITRATE))
+            except Exception as e:
+                print(f"[AudioEngine] Could not set the encoder bitrate: {e}")
+
+    def pending_track(self):
+        """The track a play or seek request is still preparing, or None."""
+        if self.play_task is not None and not self.play_task.done():
+            return self.play_target
+        return None
+
+    def progress(self):
+        """Returns a consistent (position, duration, is_playing, is_paused) snapshot."""
+        with self.lock:
+            position = self.clock.position()
+            if self.total_duration > 0:
+                position = min(position, self.total_duration)
+            return position, self.total_duration, self.is_playing, self.is_paused
+
+    def position(self):
+        return self.progress()[0]
+
+    def configure(self, **settings):
+        """Changes session settings (is_looping, is_normalized, crossfade_seconds) and notifies listeners."""
+        with self.lock:
+            for name, value in settings.items():
+                setattr(self, name, value)
+        bus.publish(SETTINGS_CHANGED, session=self)
+
+    def mark_started(self, filepath, duration, position=0.0):
+        with self.lock:
+            self.current_track_path = filepath
+            self.total_duration = duration
+            self.clock.reset(position)
+            self.is_playing = True
+            self.is_paused = False
+        bus.publish(TRACK_STARTED, session=self, filepath=filepath)
+
+    def mark_seeked(self, position):
+        with self.lock:
+            self.clock.reset(position)
+        bus.publish(SEEKED, session=self, position=position)
+
+    def mark_paused(self):
+        with self.lock:
+            if not self.is_playing or self.is_paused:
+                return
+            # The clock stands still by itself while no frames are delivered
+            self.is_paused = True
+            self.clock.interrupt()
+        bus.publish(PAUSED, session=self)
+
+    def mark_resumed(self):
+        with self.lock:
+            if not self.is_paused:
+                return
+            self.is_paused = False
+            self.clock.interrupt()
+        bus.publish(RESUMED, session=self)
+
+    def mark_ended(self, forget_track=False):
+        """Stops the clock. forget_track also clears the current track, as an explicit stop does."""
+        with self.lock:
+            if not self.is_playing and not (forget_track and self.current_track_path):
+                return
+            self.is_playing = False
+            self.is_paused = False
+            self.clock.reset(0.0)
+            if forget_track:
+                self.current_track_path = None
+                self.total_duration = 0.0
+        bus.publish(ENDED, session=self)
+
+sessions = {}  # guild_id -> PlaybackState
+sessions_lock = threading.Lock()
+
+def get_session(guild_id, guild_name=None):
+    """Returns the playback session of a guild, creating it on first use."""
+    with sessions_lock:
+        session = sessions.get(guild_id)
+        changed = session is None or (guild_name and session.guild_name != guild_name)
+        if session is None:
+            session = sessions[guild_id] = PlaybackState(guild_id, guild_name)
+        elif guild_name:
+            session.guild_name = guild_name
+    if changed:
+        bus.publish(SESSIONS_CHANGED)
+    return session
+
+def remove_session(guild_id):
+    """Drops a guild's session once the bot has left its voice channel."""
+    with sessions_lock:
+        session = sessions.pop(guild_id, None)
+    if session is not None:
+        session.mixer.clear()
+        bus.publish(SESSIONS_CHANGED)
+    return session
+
+def list_sessions():
+    """Returns a snapshot of all active sessions, safe to iterate from any thread."""
+    with sessions_lock:
+        return list(sessions.values())
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a')
+
+# Broadcast standard normalization target (EBU R128)
+LOUDNORM_TARGET = "I=-16:TP=-1.5:LRA=11"
+# Leading and trailing silence is found with silencedetect while loudness is measured
+SILENCE_THRESHOLD_DB = -50  # Quieter than this counts as silence
+SILENCE_MIN_SECONDS = 0.2  # Shorter gaps are part of the music
+SILENCE_PAD_SECONDS = 0.05  # Kept before the first and after the last audible frame, so no attack or decay is cut
+SILENCE_FILTER = f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:d={SILENCE_MIN_SECONDS}"
 
-state = PlaybackState()
+# Encoder settings of every Opus master in the central cache
+MASTER_BITRATE = 128
+OPUS_ENCODE_ARGS = ['-c:a', 'libopus', '-b:a', f'{MASTER_BITRATE}k', '-ar', '48000', '-ac', '2']
+# Lower-bitrate variants (kbps) for voice channels that cannot carry the master (64k is Discord's default)
+PROFILE_BITRATES = (32, 64, 96)
+TEE_CHUNK_BYTES = 64 * 1024
+PIPE_CHUNK_BYTES = 64 * 1024  # Reads of ffmpeg output streamed back into the process
 
 def get_audio_files(directory):
     """Returns a list of audio files in the given directory."""
-    extensions = ('.mp3', '.wav', '.flac', '.m4a')
     try:
-        return [f for f in os.listdir(directory) if f.lower().endswith(extensions)]
+        return [f for f in os.listdir(directory) if f.lower().endswith(AUDIO_EXTENSIONS)]
     except Exception:
         return []
 
-def get_audio_duration(filepath):
-    """Uses ffprobe to get the duration of an audio file in seconds."""
-    try:
-        cmd = [
-            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1', filepath
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return float(result.stdout.strip())
+def get_probe_command(filepath):
+    return [
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'format=duration:stream=codec_name,channels', '-of', 'json', filepath
+    ]
+
+def parse_probe_output(output):
+    """Returns (duration, codec, channels) from ffprobe's JSON output."""
+    info = json.loads(output or "{}")
+    duration = float(info.get('format', {}).get('duration') or 0)
+    streams = info.get('streams') or []
+    codec = streams[0].get('codec_name') if streams else None
+    channels = streams[0].get('channels') if streams else None
+    return duration, codec, channels
+
+def probe_audio_file(filepath):
+    """Uses ffprobe to get the duration (seconds), audio codec and channel count of a file in a single call."""
+    try:
+        result = subprocess.run(get_probe_command(filepath), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return parse_probe_output(result.stdout)
+    except Exception as e:
+        print(f"Error getting duration: {e}")
+        return 0, None, None
+
+async def probe_audio_file_async(filepath):
+    """probe_audio_file() as an asyncio subprocess; cancelling it kills ffprobe."""
+    try:
+        process = await asyncio.create_subprocess_exec(*get_probe_command(filepath), stdout=subprocess.PIPE,
+                                                       stderr=subprocess.DEVNULL)
+    except Exception as e:
+        print(f"Error getting duration: {e}")
+        return 0, None, None
+    try:
+        output, _ = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+        raise
+    try:
+        return parse_probe_output(output.decode('utf-8', 'replace'))
     except Exception as e:
         print(f"Error getting duration: {e}")
-        return 0
+        return 0, None, None
+
+def get_known_duration(filepath):
+    """Returns a duration that needs no ffprobe run (metadata index or cached copy), or None."""
+    entry = shared.index.lookup(filepath)
+    if entry and entry['duration']:
+        return entry['duration']
+
+    # A cached copy knows its own length; no subprocess needed
+    cached_file = get_cache_path(filepath)
+    if cache_file_exists(cached_file):
+        try:
+            reader = OggOpusReader(cached_file)
+            try:
+                duration = reader.duration()
+            finally:
+                reader.close()
+            if duration:
+                shared.index.update(filepath, duration=duration)
+                return duration
+        except Exception as e:
+            print(f"[AudioEngine] Could not read cached duration: {e}")
+    return None
+
+def get_audio_duration(filepath):
+    """
+    Returns the duration of an audio file in seconds.
+    Served from the metadata index when possible; ffprobe only runs for unseen or changed files.
+    """
+    duration = get_known_duration(filepath)
+    if duration is not None:
+        return duration
+    duration, codec, channels = probe_audio_file(filepath)
+    if duration:
+        shared.index.update(filepath, duration=duration, codec=codec, channels=channels)
+    return duration
+
+async def get_audio_duration_async(filepath):
+    """get_audio_duration() for the event loop: file lookups run in a worker thread, ffprobe as an asyncio subprocess."""
+    duration = await asyncio.get_running_loop().run_in_executor(None, get_known_duration, filepath)
+    if duration is not None:
+        return duration
+    duration, codec, channels = await probe_audio_file_async(filepath)
+    if duration:
+        shared.index.update(filepath, duration=duration, codec=codec, channels=channels)
+    return duration
+
+def get_source_channels(filepath):
+    """Returns the channel count of a source file, from the metadata index or one ffprobe run."""
+    entry = shared.index.lookup(filepath)
+    if entry and entry['channels']:
+        return entry['channels']
+    duration, codec, channels = probe_audio_file(filepath)
+    if channels:
+        shared.index.update(filepath, duration=duration or None, codec=codec, channels=channels)
+    return channels
+
+def bitrate_variants_enabled():
+    """Whether lower-bitrate cache variants are built for channels below the master bitrate (PHONOGRAPH_BITRATE_VARIANTS)."""
+    return os.getenv('PHONOGRAPH_BITRATE_VARIANTS', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+def choose_profile(channel_kbps):
+    """
+    Returns the variant bitrate (kbps) that fits a voice channel: the highest profile it can carry.
+    None means the master itself fits (or the channel bitrate is unknown).
+    """
+    if not channel_kbps or channel_kbps >= MASTER_BITRATE or not bitrate_variants_enabled():
+        return None
+    fitting = [kbps for kbps in PROFILE_BITRATES if kbps <= channel_kbps]
+    return max(fitting) if fitting else min(PROFILE_BITRATES)
+
+def get_profile_variant(normalized, profile):
+    """Cache variant name of a rendering: None (plain master), "norm", "64k" or "norm.64k"."""
+    parts = (["norm"] if normalized else []) + ([f"{profile}k"] if profile else [])
+    return ".".join(parts) or None
+
+def get_cached_candidates(filepath, normalized, profile):
+    """Cache files that can serve a rendering, best first: the exact-fit variant, then its master."""
+    master = get_cache_path(filepath, variant="norm" if normalized else None)
+    if not profile:
+        return [master]
+    return [get_cache_path(filepath, variant=get_profile_variant(normalized, profile)), master]
+
+def find_cached_file(filepath, normalized, profile):
+    """Returns (cache file, is exact fit) for the best cached rendering of a track, or (None, False)."""
+    candidates = get_cached_candidates(filepath, normalized, profile)
+    for path in candidates:
+        if cache_file_exists(path):
+            return path, path == candidates[0]
+    return None, False
 
 def format_time(seconds):
     """Formats seconds into MM:SS."""
@@ -52,152 +358,987 @@ def format_time(seconds):
     secs = seconds % 60
     return f"{mins:02d}:{secs:02d}"
 
-async def play_audio_logic(bot, filepath, seek_to=0):
-    """Core playback logic with support for seeking and duration tracking."""
-    vc = state.current_voice_client
-    if not vc:
-        return
+def skip_silence_enabled():
+    """Whether cached tracks start at their first audible frame and loop without their silent ends (PHONOGRAPH_SKIP_SILENCE)."""
+    return os.getenv('PHONOGRAPH_SKIP_SILENCE', '1').strip().lower() not in ('0', 'false', 'no', 'off')
 
-    state.current_track_path = filepath
-    state.total_duration = get_audio_duration(filepath)
-    state.elapsed_offset = seek_to
+def get_audible_range(filepath, entry=None):
+    """
+    Returns the (start, end) of a track's audible part in 48 kHz samples, padded by SILENCE_PAD_SECONDS,
+    from the silence analysis stored with its cache entry. End is None for end of track.
+    """
+    entry = entry or shared.index.lookup(filepath)
+    if not entry or entry['audio_start'] is None or not skip_silence_enabled():
+        return 0, None
+    pad = int(SILENCE_PAD_SECONDS * OPUS_SAMPLE_RATE)
+    end = entry['audio_end'] + pad if entry['audio_end'] is not None else None
+    return max(entry['audio_start'] - pad, 0), end
+
+def get_play_start(filepath):
+    """Seconds a cached track starts playing at when played from the top: its first audible frame."""
+    return get_audible_range(filepath)[0] / OPUS_SAMPLE_RATE
+
+def get_loop_points(filepath):
+    """
+    Returns the (loop start, loop end) of a track in 48 kHz samples. Loop end is None for end of track.
+    Points not set by hand default to the audible part, so loops skip leading and trailing silence.
+    """
+    entry = shared.index.lookup(filepath)
+    if not entry:
+        return 0, None
+    audible_start, audible_end = get_audible_range(filepath, entry)
+    loop_start = entry['loop_start'] if entry['loop_start'] is not None else audible_start
+    loop_end = entry['loop_end'] if entry['loop_end'] is not None else audible_end
+    return loop_start, loop_end
+
+def set_loop_points(filepath, start_seconds=None, end_seconds=None):
+    """
+    Stores sample-accurate loop points for a track. Passing None clears a point, so it follows the audible
+    part of the track again; an explicit 0 start loops from the very beginning, silence included.
+    """
+    loop_start = int(round(start_seconds * OPUS_SAMPLE_RATE)) if start_seconds is not None else None
+    loop_end = int(round(end_seconds * OPUS_SAMPLE_RATE)) if end_seconds is not None else None
+    shared.index.update(filepath, loop_start=loop_start, loop_end=loop_end)
+
+def open_cached_source(session, filepath, cached_file, seek_to=0, before_args=None):
+    """
+    Opens a cached Opus file as an in-process packet source that loops gaplessly while looping is on.
+    Falls back to an ffmpeg passthrough if the file cannot be demuxed natively.
+    """
+    loop_start, loop_end = get_loop_points(filepath)
+
+    try:
+        # The source wraps around without a restart, so the clock is rewound with it
+        return OggOpusSource(cached_file, start_seconds=seek_to, should_loop=lambda: session.is_looping,
+                             loop_start=loop_start, loop_end=loop_end, on_loop=session.mark_seeked)
+    except Exception as e:
+        print(f"[AudioEngine] Native Opus reader failed ({e}), using ffmpeg")
+        return open_cached_ffmpeg_source(discord.FFmpegOpusAudio, cached_file, before_options=before_args)
+
+def open_tee_source(session, filepath, cached_file):
+    """
+    Starts caching an uncached track while it plays (see CacheTee).
+    Returns None if the track's cache entry is already being written by someone else.
+    """
+    claim = claim_cache_write(filepath)
+    if not claim:
+        return None
+    try:
+        tee = CacheTee(filepath, cached_file, claim).start()
+    except Exception:
+        release_cache_write(claim)
+        raise
+    loop_start, loop_end = get_loop_points(filepath)
+    return TeeOpusSource(tee, should_loop=lambda: session.is_looping,
+                         loop_start=loop_start, loop_end=loop_end, on_loop=session.mark_seeked)
+
+def parse_time(text):
+    """Parses seconds given as SS, MM:SS or HH:MM:SS (fractions allowed) into a float."""
+    seconds = 0.0
+    for part in text.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def is_normalization_skipped(filepath, entry=None):
+    """True if a track's loudness could not be measured, so its plain cache entry also serves normalized playback."""
+    entry = entry or shared.index.lookup(filepath)
+    return bool(entry) and entry['normalizable'] == 0
+
+def wants_normalized(session, filepath):
+    return session.is_normalized and not is_normalization_skipped(filepath)
+
+def build_source(session, filepath, seek_to=0):
+    """Opens the best available audio source for a track, honouring the session's normalization setting."""
+    # Check if a cached Opus version exists in the central directory
+    cached_file = get_cache_path(filepath)
+    normalized = wants_normalized(session, filepath)
+    
+    # Audio transformation options
+    # We need stereo and optional normalization
+    filters = []
+    if normalized:
+        # Broadcast standard normalization (EBU R128)
+        filters.append(f"loudnorm={LOUDNORM_TARGET}")
     
+    filter_str = f"-af {','.join(filters)}" if filters else ""
+    ffmpeg_options = f"-ac 2 {filter_str}" 
+    before_args = f"-ss {seek_to}" if seek_to > 0 else None
+
+    # The rendering that fits the voice channel's bitrate, falling back to the 128k master until it is built
+    profile = choose_profile(session.channel_bitrate())
+    best_file, exact = find_cached_file(filepath, normalized, profile)
+    plain_exists = cache_file_exists(cached_file)
+    cache_hit = best_file is not None
+    metrics.inc('phonograph_cache_lookups_total', result="hit" if cache_hit else "miss")
+    if seek_to <= 0:
+        # Playback history drives cache eviction (restarts for a seek are not new plays)
+        shared.index.record_play(filepath, cache_hit)
+
+    if best_file:
+        if not exact:
+            start_variant_build(filepath, normalized, profile)
+        start_silence_scan(filepath, best_file)
+        # Played from the top, the native reader starts at the first audible frame (the ffmpeg fallback does not)
+        start = seek_to if seek_to > 0 else get_play_start(filepath)
+        # Pre-baked variants (normalized, lower bitrate) take the same fast path as the plain cache
+        label = get_profile_variant(normalized, profile if exact else None) or "plain"
+        print(f"[AudioEngine] Playing cached ({label}): {os.path.basename(best_file)}")
+        return open_cached_source(session, filepath, best_file, start, before_args)
+    elif plain_exists and normalized:
+        # If we have cache but no normalized variant yet, we have to run it through opus decoder + filters
+        print(f"[AudioEngine] Playing cached (Live normalization): {os.path.basename(cached_file)}")
+        return open_cached_ffmpeg_source(discord.FFmpegPCMAudio, cached_file, options=ffmpeg_options,
+                                         before_options=before_args)
+    else:
+        # No cache or normalization needed on raw file
+        shared.index.set_cache_status(filepath, False)
+        if not normalized and seek_to <= 0:
+            # Encode once: the same Opus stream is played and committed to the cache
+            source = open_tee_source(session, filepath, cached_file)
+            if source:
+                print(f"[AudioEngine] Transcoding and caching: {os.path.basename(filepath)}")
+                return source
+        print(f"[AudioEngine] Transcoding: {os.path.basename(filepath)}")
+        return open_ffmpeg_source(discord.FFmpegPCMAudio, filepath, options=ffmpeg_options, before_options=before_args)
+
+def open_ffmpeg_source(source_class, path, **kwargs):
+    """Starts an ffmpeg-backed discord.py source and has its process sampled by the metrics."""
+    source = source_class(path, **kwargs)
+    watch_process(getattr(source, '_process', None), "playback")
+    return source
+
+def open_cached_ffmpeg_source(source_class, cache_file, **kwargs):
+    """open_ffmpeg_source() for a cache file, which is piped into ffmpeg when it is stored in the pack."""
+    path, packed = get_ffmpeg_input(cache_file)
+    if packed is not None:
+        return open_ffmpeg_source(source_class, packed, pipe=True, **kwargs)
+    return open_ffmpeg_source(source_class, path, **kwargs)
+
+def get_voice_source(session):
+    """Returns the source the voice client is playing (a QueueSource or MixerSource), or None when idle."""
+    vc = session.current_voice_client
+    if not vc or not (vc.is_playing() or vc.is_paused()):
+        return None
+    return unwrap_source(vc.source)
+
+def run_between_frames(session, action):
+    """Runs action() between two frames of the session's player (see ClockedSource) and returns its result."""
+    vc = session.current_voice_client
+    source = vc.source if vc else None
+    if isinstance(source, ClockedSource):
+        return source.between_frames(action)
+    return action()
+
+def get_playing_source(session):
+    """Returns the source of the track currently playing in a session, unwrapped from its queue."""
+    source = get_voice_source(session)
+    if isinstance(source, MixerSource):
+        return None  # Only sound layers are playing
+    return source.current.source if isinstance(source, QueueSource) else source
+
+SEEK_SETTLE_SECONDS = 0.05  # A seek that restarts playback waits this long, so a burst of seeks restarts once
+# Outcomes of play_audio_logic(), as counted in phonograph_play_requests_total
+PLAY_STARTED = "started"
+PLAY_FAILED = "failed"
+PLAY_SUPERSEDED = "superseded"
+
+async def play_audio_logic(bot, session, filepath, seek_to=0, settle=0.0):
+    """
+    Starts a track in a guild session, optionally at seek_to seconds. A newer play or seek cancels a start
+    that is still being prepared, so in a burst of requests only the newest one plays. The duration probe
+    runs as an asyncio subprocess and the source is opened in a worker thread: the event loop never blocks.
+    Returns PLAY_STARTED, PLAY_FAILED, or PLAY_SUPERSEDED when a newer request replaced this one.
+    """
+    previous = session.play_task
+    if previous is not None and not previous.done():
+        previous.cancel()
+        metrics.inc('phonograph_play_requests_total', result=PLAY_SUPERSEDED)
+    task = asyncio.ensure_future(start_playback(session, filepath, seek_to, settle))
+    session.play_task = task
+    session.play_target = filepath
+    try:
+        # Shielded: a caller that gives up waiting does not cancel the start itself
+        return PLAY_STARTED if await asyncio.shield(task) else PLAY_FAILED
+    except asyncio.CancelledError:
+        if task.cancelled():
+            return PLAY_SUPERSEDED
+        raise
+
+def discard_opened_source(future):
+    """Closes a source whose start was cancelled while it was being opened."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().cleanup()
+
+async def open_source_async(session, filepath, seek_to):
+    future = asyncio.get_running_loop().run_in_executor(None, build_source, session, filepath, seek_to)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # The worker thread cannot be interrupted: close whatever it opens
+        future.add_done_callback(discard_opened_source)
+        raise
+
+async def start_playback(session, filepath, seek_to, settle):
+    if not session.current_voice_client:
+        return False
+    if settle:
+        await asyncio.sleep(settle)  # Cancelled here when another seek follows straight away
+
+    started = time.perf_counter()
+    duration = await get_audio_duration_async(filepath)
+    probed = time.perf_counter()
+    try:
+        source = await open_source_async(session, filepath, seek_to)
+    except Exception as e:
+        print(f"Playback error: {e}")
+        metrics.inc('phonograph_play_requests_total', result=PLAY_FAILED)
+        return False
+    opened = time.perf_counter()
+    if isinstance(source, OggOpusSource) and source.position > seek_to:
+        # Leading silence skipped: the track starts at its first audible frame
+        metrics.observe('phonograph_lead_in_skipped_seconds', source.position - seek_to)
+        seek_to = source.position
+
+    # From here on nothing awaits, so no other request can interleave with the switch
+    vc = session.current_voice_client
+    if not vc:
+        source.cleanup()  # Left the voice channel meanwhile
+        return False
+    generation = session.new_player()
     if vc.is_playing() or vc.is_paused():
-        state.suppress_after_callback = True
         vc.stop()
 
     def after_playing(error):
         if error:
             print(f'Player error: {error}')
-        
-        # If we are manually switching tracks or stopping, don't trigger the loop
-        if state.suppress_after_callback:
-            state.suppress_after_callback = False # Reset the flag
+        # A newer player replaced this one (a track change, seek restart or stop): nothing to do
+        if not session.is_current_player(generation):
             return
+        # Looping and queued tracks are chained inside the QueueSource, so reaching here means playback is over
+        session.mark_ended()
+        play_layers_only(session)
 
-        # If looping is enabled AND we didn't manually stop it
-        if state.is_looping and state.current_track_path:
-            bot.loop.call_soon_threadsafe(
-                lambda: asyncio.run_coroutine_threadsafe(
-                    play_audio_logic(bot, state.current_track_path), bot.loop
-                )
-            )
+    def open_track(path):
+        return build_source(session, path), get_audio_duration(path)
 
     try:
-        # Check if a cached Opus version exists in the central directory
-        cached_file = get_cache_path(filepath)
-        
-        # Audio transformation options
-        # We need stereo and optional normalization
-        filters = []
-        if state.is_normalized:
-            # Broadcast standard normalization (EBU R128)
-            filters.append("loudnorm=I=-16:TP=-1.5:LRA=11")
-        
-        filter_str = f"-af {','.join(filters)}" if filters else ""
-        ffmpeg_options = f"-ac 2 {filter_str}" 
-        before_args = f"-ss {seek_to}" if seek_to > 0 else None
-
-        if os.path.exists(cached_file) and not state.is_normalized:
-            # If we have a cache and DON'T need normalization, use the fast path
-            print(f"[AudioEngine] Playing cached: {os.path.basename(cached_file)}")
-            source = discord.FFmpegOpusAudio(cached_file, before_options=before_args)
-        elif os.path.exists(cached_file) and state.is_normalized:
-            # If we have cache but NEED normalization, we have to run it through opus decoder + filters
-            print(f"[AudioEngine] Playing cached (Normalized): {os.path.basename(cached_file)}")
-            source = discord.FFmpegPCMAudio(cached_file, options=ffmpeg_options, before_options=before_args)
-        else:
-            # No cache or normalization needed on raw file
-            print(f"[AudioEngine] Transcoding: {os.path.basename(filepath)}")
-            source = discord.FFmpegPCMAudio(filepath, options=ffmpeg_options, before_options=before_args)
-        
-        vc.play(source, after=after_playing)
-        state.start_playback_time = time.time()
+        metrics.observe('phonograph_play_probe_seconds', probed - started)
+        metrics.observe('phonograph_play_open_seconds', opened - probed)
+        metrics.set_gauge('phonograph_last_play_seconds', probed - started, stage="probe")
+        metrics.set_gauge('phonograph_last_play_seconds', opened - probed, stage="open")
+        queue_source = QueueSource(session, filepath, source, duration,
+                                   open_track, session.mark_started, start_seconds=seek_to)
+        clocked = ClockedSource(queue_source, session.clock)
+        # Anchor the clock before the first frame can be delivered
+        session.mark_started(filepath, duration, seek_to)
+        vc.play(clocked, after=after_playing)
+        session.tune_encoder()
     except Exception as e:
         print(f"Playback error: {e}")
+        metrics.inc('phonograph_play_requests_total', result=PLAY_FAILED)
+        source.cleanup()
+        session.mark_ended()
+        return False
+    metrics.inc('phonograph_play_requests_total', result=PLAY_STARTED)
+    return True
+
+def play_layers_only(session):
+    """Keeps a session's sound layers playing while no track is. Returns True if it started them."""
+    vc = session.current_voice_client
+    if not vc or not session.mixer.active() or vc.is_playing() or vc.is_paused():
+        return False
 
-async def pause_logic():
-    vc = state.current_voice_client
+    def after_layers(error):
+        if error:
+            print(f'Player error: {error}')
+
+    session.new_player()
+    try:
+        vc.play(MixerSource(session.mixer), after=after_layers)
+        session.tune_encoder()
+    except Exception as e:
+        print(f"Layer playback error: {e}")
+        return False
+    return True
+
+def open_layer_source(filepath):
+    """
+    Returns the factory a sound layer opens its audio with: the cached Opus file when there is one
+    (decoded in-process, looping without a restart), a 48 kHz WAV read directly, or ffmpeg otherwise.
+    """
+    cached_file = get_cache_path(filepath)
+    loop_start, loop_end = get_loop_points(filepath)
+
+    def open_source(layer):
+        if cache_file_exists(cached_file):
+            try:
+                return OggOpusSource(cached_file, should_loop=lambda: layer.loop,
+                                     loop_start=loop_start, loop_end=loop_end)
+            except Exception as e:
+                print(f"[AudioEngine] Native Opus reader failed for layer ({e}), using ffmpeg")
+        elif filepath.lower().endswith('.wav'):
+            try:
+                return WavePCMSource(filepath)
+            except Exception:
+                pass  # Another sample format: ffmpeg converts it
+        return open_ffmpeg_source(discord.FFmpegPCMAudio, filepath, options="-ac 2")
+    return open_source
+
+async def add_layer_logic(session, filepath, name=None, volume=1.0, loop=True, duck=False, fade_in=0.0):
+    """
+    Starts a sound layer in a session, on top of the music or on its own when nothing plays.
+    Returns the layer. Raises MixerUnavailable without NumPy.
+    """
+    name = name or os.path.splitext(os.path.basename(filepath))[0]
+    layer = session.mixer.add(name, filepath, open_layer_source(filepath), volume, loop, duck, fade_in)
+    play_layers_only(session)
+    # Sound effects are played again and again: have them cached like any other track
+    start_optimization_worker([filepath])
+    return layer
+
+async def play_next_logic(bot, session):
+    """Starts the next queued track. Returns False if the queue is empty."""
+    filepath = session.queue.pop_next(session.current_track_path)
+    if not filepath:
+        return False
+    await play_audio_logic(bot, session, filepath)
+    return True
+
+async def skip_logic(bot, session):
+    """Skips to the next queued track, in-place when possible. Returns False if nothing is queued."""
+    vc = session.current_voice_client
+    if not vc:
+        return False
+    source = get_voice_source(session)
+    if isinstance(source, QueueSource):
+        return run_between_frames(session, source.skip)
+    return await play_next_logic(bot, session)
+
+async def seek_logic(bot, session, seconds):
+    """
+    Seeks the current track. Cached tracks playing through the native Opus reader jump in-place
+    via their seek index; everything else restarts playback at the new position.
+    """
+    vc = session.current_voice_client
+    if not vc or not session.current_track_path:
+        return
+
+    pending = session.pending_track()
+    if pending:
+        # A start is still being prepared: seek within the track it is for instead
+        await play_audio_logic(bot, session, pending, seek_to=seconds, settle=SEEK_SETTLE_SECONDS)
+        return
+
+    playing = get_playing_source(session)
+    # Any cached rendering of the current setting (exact-fit variant or its master) can seek in place
+    wanted_files = get_cached_candidates(session.current_track_path,
+                                         wants_normalized(session, session.current_track_path),
+                                         choose_profile(session.channel_bitrate()))
+    if isinstance(playing, OggOpusSource) and playing.reader is not None and playing.reader.path in wanted_files:
+        queue_source = get_voice_source(session)
+
+        def seek_in_place():
+            if not queue_source.seek(seconds):
+                return False
+            session.mark_seeked(seconds)  # Re-anchors the clock before the next frame is counted
+            return True
+
+        if run_between_frames(session, seek_in_place):
+            return
+
+    await play_audio_logic(bot, session, session.current_track_path, seek_to=seconds, settle=SEEK_SETTLE_SECONDS)
+
+async def pause_logic(session):
+    vc = session.current_voice_client
     if vc and vc.is_playing():
-        state.elapsed_offset += (time.time() - state.start_playback_time)
         vc.pause()
+        session.mark_paused()
 
-async def resume_logic():
-    vc = state.current_voice_client
+async def resume_logic(session):
+    vc = session.current_voice_client
     if vc and vc.is_paused():
-        state.start_playback_time = time.time()
         vc.resume()
+        session.mark_resumed()
+
+async def stop_logic(session):
+    """Stops playback and forgets the current track. Returns False if nothing was playing."""
+    # A start still being prepared would override the stop
+    cancelled = session.play_task is not None and session.play_task.cancel()
+    vc = session.current_voice_client
+    if not vc or not (vc.is_playing() or vc.is_paused()):
+        return cancelled
+    if isinstance(get_voice_source(session), MixerSource):
+        # Only layers are left: stopping silences them too
+        session.mixer.clear()
+    session.mark_ended(forget_track=True)
+    vc.stop()
+    return True
 
-def get_cache_path(filepath):
+CONTENT_SAMPLE_BYTES = 16 * 1024  # Per sampled block of the fast content key
+
+def wants_full_hash():
+    return os.getenv('PHONOGRAPH_CACHE_FULL_HASH', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def compute_content_key(filepath, full_hash=False):
     """
-    Returns a unique path in the central cache for the given audio file.
-    Uses MD5 hash of the absolute path to prevent collisions.
+    Content-based cache key of a file. The fast key ("s" prefix) hashes the size, mtime and three sampled
+    blocks (start, middle, end). The full key ("f" prefix) hashes every byte, so identical files share
+    one entry whatever their mtime.
     """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        if full_hash:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+            return "f" + digest.hexdigest()
+        st = os.fstat(f.fileno())
+        digest.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        middle = max(st.st_size // 2 - CONTENT_SAMPLE_BYTES // 2, 0)
+        for offset in (0, middle, max(st.st_size - CONTENT_SAMPLE_BYTES, 0)):
+            f.seek(offset)
+            digest.update(f.read(CONTENT_SAMPLE_BYTES))
+    return "s" + digest.hexdigest()
+
+def get_content_key(filepath):
+    """Returns the cache key of a file, remembered in the metadata index while the file is unchanged."""
+    full_hash = wants_full_hash()
+    entry = shared.index.lookup(filepath)
+    if entry and entry['content_key'] and entry['content_key'][0] == ("f" if full_hash else "s"):
+        return entry['content_key']
+    try:
+        key = compute_content_key(filepath, full_hash)
+    except OSError:
+        # Unreadable (e.g. deleted) file: a key that can never collide with a real entry
+        return "p" + hashlib.md5(os.path.abspath(filepath).encode('utf-8')).hexdigest()
+    shared.index.update(filepath, content_key=key)
+    if shared.index.adopt_moved(filepath, key):
+        print(f"[Cache] Picked up the history of {os.path.basename(filepath)} from its old location")
+    return key
+
+def get_legacy_cache_path(filepath, variant=None):
+    """Where older versions cached a file: keyed on the MD5 of its absolute path (see cache_manager migration)."""
     abs_path = os.path.abspath(filepath)
     path_hash = hashlib.md5(abs_path.encode('utf-8')).hexdigest()
-    # Keep original filename for easier identification in the cache folder
-    filename = os.path.basename(filepath)
-    return os.path.join(state.cache_dir, f"{path_hash}_{filename}.opus")
+    suffix = f".{variant}.opus" if variant else ".opus"
+    return os.path.join(shared.cache_dir, f"{path_hash}_{os.path.basename(filepath)}{suffix}")
+
+def get_cache_path(filepath, variant=None):
+    """
+    Returns the path in the central cache for the given audio file.
+    Entries are content-addressed, so moved, renamed or duplicated files share one entry.
+    An optional variant name (e.g. "norm") selects an alternative rendering of the same track.
+    """
+    suffix = f".{variant}.opus" if variant else ".opus"
+    return os.path.join(shared.cache_dir, f"{get_content_key(filepath)}{suffix}")
 
 def ensure_cache_dir():
     """Creates the central hidden cache directory if it doesn't exist."""
-    if not os.path.exists(state.cache_dir):
-        os.makedirs(state.cache_dir)
-    return state.cache_dir
+    if not os.path.exists(shared.cache_dir):
+        os.makedirs(shared.cache_dir)
+    return shared.cache_dir
+
+def get_partial_path(cache_file):
+    """Temporary name a cache file is written under until it is complete; it is never played as a cache entry."""
+    return cache_file + ".part"
+
+def claim_cache_write(filepath):
+    """
+    Marks a file's cache entry as being written and returns it, for release_cache_write().
+    Returns None if another writer already holds it, which includes a different file with the same content.
+    """
+    entry = get_cache_path(filepath)
+    with shared.cache_writes_lock:
+        if entry in shared.cache_writes:
+            return None
+        shared.cache_writes.add(entry)
+        return entry
+
+def release_cache_write(entry):
+    with shared.cache_writes_lock:
+        shared.cache_writes.discard(entry)
+        shared.cache_writes_lock.notify_all()
+
+def wait_for_cache_write(filepath, timeout):
+    """Waits until no write of the file's cache entry is in flight. Returns False if one still is after timeout."""
+    entry = get_cache_path(filepath)
+    with shared.cache_writes_lock:
+        return shared.cache_writes_lock.wait_for(lambda: entry not in shared.cache_writes, timeout)
+
+def is_cache_write_in_flight(filepath):
+    with shared.cache_writes_lock:
+        return get_cache_path(filepath) in shared.cache_writes
+
+def commit_cache_file(partial_file, cache_file):
+    """Atomically moves a completely written cache file into the cache store and builds its seek index."""
+    store_cache_file(partial_file, cache_file)
+    write_page_index(cache_file)
+
+def discard_partial(partial_file):
+    try:
+        os.remove(partial_file)
+    except OSError:
+        pass
+
+class CacheTee:
+    """
+    First playback of an uncached track: one ffmpeg encode to Ogg/Opus is written to a temporary cache
+    file while a TeeOpusSource plays it as it grows, so the track is decoded once instead of once for
+    playback and again by the optimization worker. The encode runs to the end even if playback stops;
+    the finished file is then renamed into the cache, while failed encodes are deleted.
+    """
+    def __init__(self, filepath, cache_file, claim):
+        self.filepath = filepath
+        self.cache_file = cache_file
+        self.claim = claim  # From claim_cache_write()
+        self.temp_path = get_partial_path(cache_file)
+        self.read_path = self.temp_path  # Where readers find the data: the cache file once committed, None if discarded
+        self.condition = threading.Condition()
+        self.written = 0
+        self.finished = False
+        self.process = None
+        self.output = None
+
+    def start(self):
+        ensure_cache_dir()
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', self.filepath,
+               '-map', '0:a:0'] + OPUS_ENCODE_ARGS + ['-f', 'ogg', 'pipe:1']
+        self.output = open(self.temp_path, 'wb')
+        try:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL)
+        except Exception:
+            self.output.close()
+            discard_partial(self.temp_path)
+            raise
+        watch_process(self.process, "tee")
+        threading.Thread(target=self.pump, daemon=True).start()
+        return self
+
+    def pump(self):
+        """Copies the encoder output to the temporary file, waking readers as data arrives."""
+        try:
+            while True:
+                chunk = self.process.stdout.read1(TEE_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.output.write(chunk)
+                self.output.flush()
+                with self.condition:
+                    self.written += len(chunk)
+                    self.condition.notify_all()
+            complete = self.process.wait() == 0 and self.written > 0
+        except Exception as e:
+            print(f"[AudioEngine] Caching {os.path.basename(self.filepath)} failed: {e}")
+            self.process.kill()
+            complete = False
+        self.output.close()
+        self.finish(complete)
+
+    def finish(self, complete):
+        committed = False
+        with self.condition:
+            # Readers hold the condition while they touch the file, so the rename never races a read
+            if complete:
+                try:
+                    store_cache_file(self.temp_path, self.cache_file)
+                    self.read_path = self.cache_file
+                    committed = True
+                except OSError as e:
+                    print(f"[AudioEngine] Could not commit {os.path.basename(self.cache_file)}: {e}")
+            if not committed:
+                discard_partial(self.temp_path)
+                self.read_path = None
+            self.finished = True
+            self.condition.notify_all()
+        release_cache_write(self.claim)
+        metrics.inc('phonograph_cache_tees_total', result="committed" if committed else "discarded")
+        if not committed:
+            return
+
+        print(f"[AudioEngine] Cached while playing: {os.path.basename(self.filepath)}")
+        write_page_index(self.cache_file)
+        # Still pending: the normalized variant and the loudness and silence analysis, which the worker now
+        # builds from this cache entry. A job for the file that gave up while the tee held the entry is gone.
+        shared.index.set_cache_status(self.filepath, False, self.cache_file)
+        report_cache_status(self.filepath, False)
+        from .transcoder import get_scheduler, PRIORITY_NOW
+        get_scheduler().submit([self.filepath], PRIORITY_NOW)
 
 def is_file_optimized(filepath):
     """Checks if a file has a valid, up-to-date cached version in the central cache."""
+    # Fast path: a fresh index row already knows the answer
+    entry = shared.index.lookup(filepath)
+    if entry and entry['optimized'] is not None:
+        optimized = bool(entry['optimized'])
+    else:
+        cached_file = get_cache_path(filepath)
+
+        # Answered by the pack's index without touching the disk when the packed backend is used
+        cached_mtime = get_cache_file_mtime(cached_file)
+        normalized_ready = (cache_file_exists(get_cache_path(filepath, variant="norm"))
+                            or is_normalization_skipped(filepath, entry))
+        if cached_mtime is None or not normalized_ready:
+            optimized = False
+        # Check if original is newer than cache
+        elif os.path.getmtime(filepath) > cached_mtime:
+            optimized = False
+        else:
+            optimized = True
+
+        shared.index.set_cache_status(filepath, optimized, cached_file if optimized else None)
+    metrics.inc('phonograph_cache_status_checks_total', result="optimized" if optimized else "pending")
+    return optimized
+
+BACKGROUND_NICENESS = 10  # Added to the bot's own niceness for background ffmpeg children (POSIX)
+
+def background_process_kwargs(low_priority=True):
+    """
+    Returns subprocess keyword arguments that start a child process below normal priority on Windows,
+    so background transcodes never compete with the live playback ffmpeg (see lower_process_priority).
+    """
+    if low_priority and os.name == 'nt':
+        return {'creationflags': getattr(subprocess, 'BELOW_NORMAL_PRIORITY_CLASS', 0)}
+    return {}
+
+def lower_process_priority(process):
+    """
+    Renices a background child from the parent on POSIX. A preexec_fn would do it before exec,
+    but that may deadlock in a process already running threads and the event loop.
+    """
+    if os.name == 'nt' or not hasattr(os, 'setpriority'):
+        return
+    try:
+        niceness = os.getpriority(os.PRIO_PROCESS, 0) + BACKGROUND_NICENESS
+        os.setpriority(os.PRIO_PROCESS, process.pid, niceness)
+    except OSError:
+        pass  # Already exited
+
+def feed_stdin(process, file):
+    """Writes a file object to a child's stdin on a helper thread (the input given as pipe:0), then closes it."""
+    def feed():
+        try:
+            for chunk in iter(lambda: file.read(PIPE_CHUNK_BYTES), b''):
+                process.stdin.write(chunk)
+        except (BrokenPipeError, OSError, ValueError):
+            pass  # ffmpeg exited (or was killed) before reading everything
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+    threading.Thread(target=feed, daemon=True).start()
+
+def run_ffmpeg(cmd, role, low_priority=False, capture_stderr=False, on_process=None, on_output=None, stdin_file=None):
+    """
+    Runs an ffmpeg child to completion while the metrics sample its CPU time and memory.
+    on_process(process) is called once it started, so a scheduler can kill it to cancel the job.
+    on_output(chunk) receives what it writes to pipe:1 as it arrives (not together with capture_stderr).
+    stdin_file is written to its stdin, for an input given as pipe:0 (see get_ffmpeg_input).
+    Returns its stderr when captured; raises CalledProcessError if it fails.
+    """
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE if stdin_file else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE if on_output else subprocess.DEVNULL,
+                               stderr=subprocess.PIPE if capture_stderr else subprocess.DEVNULL,
+                               **background_process_kwargs(low_priority))
+    if low_priority:
+        lower_process_priority(process)
+    watch_process(process, role)
+    if on_process:
+        on_process(process)
+    if stdin_file:
+        feed_stdin(process, stdin_file)
+    if on_output:
+        try:
+            for chunk in iter(lambda: process.stdout.read(PIPE_CHUNK_BYTES), b''):
+                on_output(chunk)
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+    _, stderr = process.communicate()
+    if stderr is not None:
+        stderr = stderr.decode('utf-8', 'replace')
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+    return stderr
+
+def parse_silence(stderr, duration=0.0):
+    """
+    Returns the audible part of a track as (start, end) seconds from silencedetect output, end None when
+    it is audible up to the end. A track that is silent throughout is left untrimmed.
+    """
+    starts = [float(value) for value in re.findall(r'silence_start: (-?[\d.]+)', stderr)]
+    ends = [float(value) for value in re.findall(r'silence_end: ([\d.]+)', stderr)]
+    start, end = 0.0, None
+    if starts and starts[0] <= SILENCE_PAD_SECONDS:
+        if not ends or (duration and ends[0] >= duration - SILENCE_PAD_SECONDS):
+            return 0.0, None
+        start = ends[0]
+    if len(starts) > len(ends):
+        end = starts[-1]  # Silence that never ended: the track fades out into it
+    elif starts and duration and ends[-1] >= duration - SILENCE_PAD_SECONDS and starts[-1] > start:
+        end = starts[-1]  # Newer ffmpeg reports the silence at the end of the stream as ended
+    return start, end
+
+def analyze_audio(filepath, threads=None, low_priority=False, on_process=None, stdin_file=None, duration=0.0):
+    """
+    First loudnorm pass: measures the EBU R128 loudness of a file (or of stdin_file, with filepath "pipe:0"),
+    and in the same decode finds its leading and trailing silence. Returns (loudness, audible): a dict of the
+    measured input_i, input_tp, input_lra, input_thresh and target_offset, and the (start, end) seconds
+    from parse_silence(). Either is None when it could not be measured.
+    """
+    cmd = ['ffmpeg', '-hide_banner', '-nostats']
+    if threads:
+        cmd += ['-threads', str(threads)]
+    cmd += ['-i', filepath, '-map', '0:a:0', '-af', f"{SILENCE_FILTER},loudnorm={LOUDNORM_TARGET}:print_format=json",
+            '-f', 'null', '-']
+    try:
+        stderr = run_ffmpeg(cmd, "loudness", low_priority, capture_stderr=True, on_process=on_process,
+                            stdin_file=stdin_file)
+    except Exception as e:
+        print(f"Loudness analysis error for {os.path.basename(filepath)}: {e}")
+        return None, None
+    audible = parse_silence(stderr, duration)
+    try:
+        # loudnorm prints its JSON summary as the last block on stderr
+        measured = json.loads(stderr[stderr.rindex('{'):stderr.rindex('}') + 1])
+        keys = ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')
+        loudness = {key: float(measured[key]) for key in keys}
+    except Exception as e:
+        print(f"Loudness analysis error for {os.path.basename(filepath)}: {e}")
+        return None, audible
+    # Digital silence measures as -inf and cannot be normalized
+    if any(value in (float('inf'), float('-inf')) for value in loudness.values()):
+        return None, audible
+    return loudness, audible
+
+def store_audible_range(filepath, audible):
+    """Records the result of a silence analysis in the index, in 48 kHz samples."""
+    if audible is None:
+        return
+    start, end = audible
+    shared.index.update(filepath, audio_start=int(round(start * OPUS_SAMPLE_RATE)),
+                        audio_end=int(round(end * OPUS_SAMPLE_RATE)) if end is not None else None)
+
+def build_loudnorm_filter(loudness):
+    """Second loudnorm pass: a linear gain filter built from the measured loudness."""
+    return (f"loudnorm={LOUDNORM_TARGET}"
+            f":measured_I={loudness['input_i']}:measured_TP={loudness['input_tp']}"
+            f":measured_LRA={loudness['input_lra']}:measured_thresh={loudness['input_thresh']}"
+            f":offset={loudness['target_offset']}:linear=true")
+
+def transcode_to_opus(filepath, threads=None, low_priority=False, on_process=None):
+    """
+    Transcodes a single file to Opus format in the central cache.
+    The file is measured for loudness first, then a single decode feeds the plain cache entry,
+    a pre-baked, two-pass normalized variant and the waveform overview. A fresh plain entry (cached
+    while the track played) is kept, and the other two are built from it instead.
+    Files are written under temporary names and only renamed into the cache once complete.
+    Returns None without doing anything while another cache write for the file is in flight.
+    """
+    claim = claim_cache_write(filepath)
+    if not claim:
+        return None
+    try:
+        ensure_cache_dir()
+        output_file = get_cache_path(filepath)
+        normalized_file = get_cache_path(filepath, variant="norm")
+        # Decoding the cached Opus is much cheaper than decoding the source again
+        plain_mtime = get_cache_file_mtime(output_file)
+        plain_ready = plain_mtime is not None and plain_mtime >= os.path.getmtime(filepath)
+
+        def open_input():
+            # Packed cache entries are piped in; every ffmpeg run needs its own reader
+            return get_ffmpeg_input(output_file) if plain_ready else (filepath, None)
+
+        source, stdin_file = open_input()
+        loudness, audible = analyze_audio(source, threads, low_priority, on_process, stdin_file,
+                                          duration=get_audio_duration(filepath))
+        source, stdin_file = open_input()
+
+        # ffprobe/ffmpeg command to convert to Opus
+        cmd = ['ffmpeg', '-y']
+        if threads:
+            cmd += ['-threads', str(threads)]
+        cmd += ['-i', source]
+        outputs = []
+        if not plain_ready:
+            outputs.append(output_file)
+            cmd += ['-map', '0:a:0'] + OPUS_ENCODE_ARGS + ['-f', 'ogg', get_partial_path(output_file)]
+        if loudness:
+            outputs.append(normalized_file)
+            cmd += (['-map', '0:a:0', '-af', build_loudnorm_filter(loudness)] + OPUS_ENCODE_ARGS
+                    + ['-f', 'ogg', get_partial_path(normalized_file)])
+        waveform = None
+        if waveform_supported() and not cache_file_exists(get_waveform_path(output_file)):
+            # A mono PCM copy of the same decode is reduced to the overview as ffmpeg writes it
+            waveform = WaveformBuilder()
+            cmd += ['-map', '0:a:0'] + WAVEFORM_ARGS + ['pipe:1']
+        try:
+            if outputs or waveform:
+                run_ffmpeg(cmd, "transcode", low_priority, on_process=on_process,
+                           on_output=waveform.feed if waveform else None, stdin_file=stdin_file)
+            # Seek indexes make seeks on cached tracks a lookup instead of a scan
+            for path in outputs:
+                commit_cache_file(get_partial_path(path), path)
+            if waveform and write_waveform(get_waveform_path(output_file), waveform.finish()):
+                bus.publish(WAVEFORM_READY, filepath=filepath)
+            shared.index.set_cache_status(filepath, True, output_file)
+            store_audible_range(filepath, audible)
+            if audible is not None and not loudness:
+                # The analysis ran but found nothing to normalize: the plain entry is complete as it is
+                shared.index.update(filepath, normalizable=0)
+            if loudness:
+                shared.index.update(filepath,
+                                   loudness_i=loudness['input_i'], loudness_tp=loudness['input_tp'],
+                                   loudness_lra=loudness['input_lra'], loudness_thresh=loudness['input_thresh'],
+                                   loudness_offset=loudness['target_offset'], normalized_path=normalized_file,
+                                   normalizable=1)
+            return True
+        except Exception as e:
+            for path in outputs:
+                discard_partial(get_partial_path(path))
+            filename = os.path.basename(filepath)
+            print(f"Transcoding error for {filename}: {e}")
+            return False
+    finally:
+        release_cache_write(claim)
+
+def start_waveform_build(filepath):
+    """
+    Builds the missing waveform overview of a cached track from its cached Opus on a background thread,
+    for entries cached before overviews existed. Returns False if there is nothing to build.
+    """
     cached_file = get_cache_path(filepath)
-    
-    if not os.path.exists(cached_file):
+    waveform_file = get_waveform_path(cached_file)
+    if not waveform_supported() or cache_file_exists(waveform_file) or not cache_file_exists(cached_file):
         return False
-        
-    # Check if original is newer than cache
-    if os.path.getmtime(filepath) > os.path.getmtime(cached_file):
+    with shared.cache_writes_lock:
+        if cached_file in shared.waveform_builds or cached_file in shared.cache_writes:
+            return False  # A transcode in flight writes it anyway
+        shared.waveform_builds.add(cached_file)
+
+    def build():
+        try:
+            waveform = WaveformBuilder()
+            source, stdin_file = get_ffmpeg_input(cached_file)
+            cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', source,
+                   '-map', '0:a:0'] + WAVEFORM_ARGS + ['pipe:1']
+            run_ffmpeg(cmd, "waveform", low_priority=True, on_output=waveform.feed, stdin_file=stdin_file)
+            if write_waveform(waveform_file, waveform.finish()):
+                bus.publish(WAVEFORM_READY, filepath=filepath)
+        except Exception as e:
+            print(f"[AudioEngine] Waveform overview failed for {os.path.basename(filepath)}: {e}")
+        finally:
+            with shared.cache_writes_lock:
+                shared.waveform_builds.discard(cached_file)
+
+    threading.Thread(target=build, daemon=True).start()
+    return True
+
+def start_silence_scan(filepath, cached_file):
+    """
+    Finds the leading and trailing silence of a track cached before silence analysis existed, from its cached
+    Opus on a background thread, so its next start skips the lead-in. Returns False if there is nothing to do.
+    """
+    entry = shared.index.lookup(filepath)
+    if not skip_silence_enabled() or (entry and entry['audio_start'] is not None):
         return False
-        
+    path = os.path.abspath(filepath)
+    with shared.cache_writes_lock:
+        if path in shared.silence_scans:
+            return False
+        shared.silence_scans.add(path)
+
+    def scan():
+        try:
+            source, stdin_file = get_ffmpeg_input(cached_file)
+            cmd = ['ffmpeg', '-hide_banner', '-nostats', '-i', source, '-map', '0:a:0', '-af', SILENCE_FILTER,
+                   '-f', 'null', '-']
+            stderr = run_ffmpeg(cmd, "silence", low_priority=True, capture_stderr=True, stdin_file=stdin_file)
+            store_audible_range(filepath, parse_silence(stderr, get_audio_duration(filepath)))
+        except Exception as e:
+            print(f"[AudioEngine] Silence analysis failed for {os.path.basename(filepath)}: {e}")
+        finally:
+            with shared.cache_writes_lock:
+                shared.silence_scans.discard(path)
+
+    threading.Thread(target=scan, daemon=True).start()
     return True
 
-def transcode_to_opus(filepath):
-    """Transcodes a single file to Opus format in the central cache."""
-    ensure_cache_dir()
-    output_file = get_cache_path(filepath)
-    
-    # ffprobe/ffmpeg command to convert to Opus
-    cmd = [
-        'ffmpeg', '-y', '-i', filepath,
-        '-c:a', 'libopus', '-b:a', '128k', '-ar', '48000', '-ac', '2',
-        output_file
-    ]
-    try:
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        return True
-    except Exception as e:
-        filename = os.path.basename(filepath)
-        print(f"Transcoding error for {filename}: {e}")
+def get_variant_encode_args(profile, mono=False):
+    """Encoder settings of a lower-bitrate variant; mono sources are kept mono at half the bitrate."""
+    if mono:
+        return ['-c:a', 'libopus', '-b:a', f'{profile // 2}k', '-ar', '48000', '-ac', '1']
+    return ['-c:a', 'libopus', '-b:a', f'{profile}k', '-ar', '48000', '-ac', '2']
+
+def start_variant_build(filepath, normalized, profile):
+    """
+    Builds the lower-bitrate variant of a cached track on a background thread, the first time a channel
+    needs it. It is encoded from the cached master (plain or normalized), so the source is not decoded
+    again, and shared by every session. Returns False if there is nothing to build.
+    """
+    variant_file = get_cache_path(filepath, variant=get_profile_variant(normalized, profile))
+    master_file = get_cache_path(filepath, variant="norm" if normalized else None)
+    if cache_file_exists(variant_file) or not cache_file_exists(master_file):
         return False
+    with shared.cache_writes_lock:
+        if variant_file in shared.cache_writes:
+            return False
+        # Also keeps the entry safe from eviction and cleanup while it is written
+        shared.cache_writes.add(variant_file)
+
+    def build():
+        partial_file = get_partial_path(variant_file)
+        try:
+            mono = get_source_channels(filepath) == 1
+            source, stdin_file = get_ffmpeg_input(master_file)
+            cmd = (['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', source, '-map', '0:a:0']
+                   + get_variant_encode_args(profile, mono) + ['-f', 'ogg', partial_file])
+            run_ffmpeg(cmd, "transcode", low_priority=True, stdin_file=stdin_file)
+            commit_cache_file(partial_file, variant_file)
+            metrics.inc('phonograph_bitrate_variants_total', result="built")
+            print(f"[AudioEngine] Cached {profile}k{' mono' if mono else ''} variant: {os.path.basename(filepath)}")
+        except Exception as e:
+            discard_partial(partial_file)
+            metrics.inc('phonograph_bitrate_variants_total', result="failed")
+            print(f"[AudioEngine] {profile}k variant failed for {os.path.basename(filepath)}: {e}")
+        finally:
+            release_cache_write(variant_file)
+
+    threading.Thread(target=build, daemon=True).start()
+    return True
+
+def report_cache_status(filepath, optimized):
+    """Records a file's cache status and publishes CACHE_STATUS_CHANGED, only when it actually changed."""
+    path = os.path.abspath(filepath)
+    with shared.optimized_lock:
+        changed = shared.optimized_files.get(path) != optimized
+        shared.optimized_files[path] = optimized
+    if changed:
+        bus.publish(CACHE_STATUS_CHANGED, filepath=path, optimized=optimized)
+
+def start_optimization_worker(filepaths, priority=None, owner=None):
+    """
+    Checks the cache status of the given files on a background thread, reports it, and queues
+    the pending ones on the transcode scheduler with the given priority and owner (see transcoder).
+    """
+    from .transcoder import get_scheduler, PRIORITY_BACKGROUND
+    filepaths = list(filepaths)
 
-def start_optimization_worker(directory, on_file_completed):
-    """Starts a background thread to transcode all files in a directory."""
-    import threading
-    
     def worker():
-        files = get_audio_files(directory)
-        for filename in files:
-            filepath = os.path.join(directory, filename)
-            state.optimized_files[filename] = is_file_optimized(filepath)
-            # Notify GUI of initial status
-            on_file_completed(filename, state.optimized_files[filename])
-
-        for filename in files:
-            if not state.optimized_files[filename]:
-                filepath = os.path.join(directory, filename)
-                print(f"Optimizing: {filename}")
-                success = transcode_to_opus(filepath)
-                if success:
-                    state.optimized_files[filename] = True
-                    on_file_completed(filename, True)
-        print("Optimization complete.")
+        pending = []
+        for filepath in filepaths:
+            optimized = is_file_optimized(filepath)
+            report_cache_status(filepath, optimized)
+            if not optimized:
+                pending.append(filepath)
+        get_scheduler().submit(pending, PRIORITY_BACKGROUND if priority is None else priority, owner)
+
+        # Backfill durations so later plays never need ffprobe (transcoded files get theirs when done)
+        for filepath in filepaths:
+            if filepath not in pending:
+                get_audio_duration(filepath)
 
     thread = threading.Thread(target=worker, daemon=True)
     thread.start()
@@ -1,9 +1,57 @@
 import os
-import tkinter as tk
-from tkinter import filedialog
-from .audio_engine import state, play_audio_logic, pause_logic, resume_logic
+from .library import resolve_library_path
+from .audio_engine import (get_session, remove_session, play_audio_logic, play_next_logic, skip_logic,
+                           pause_logic, resume_logic, stop_logic, get_playing_source, add_layer_logic,
+                           set_loop_points, get_loop_points, parse_time, format_time, PLAY_FAILED, PLAY_SUPERSEDED)
+from .ogg_opus import OggOpusSource, OPUS_SAMPLE_RATE
+from .mixer import MixerUnavailable, MAX_VOLUME
+from .metrics import metrics
+from .cache_manager import cache_summary_lines, collect_garbage
+
+def register_commands(bot, headless=False):
+    """Registers the bot commands. In headless mode tracks are given as paths instead of picked in a file dialog."""
+    @bot.check
+    async def guild_only(ctx):
+        """Playback sessions are per guild, so commands only work inside a server."""
+        return ctx.guild is not None
+
+    def session_for(ctx):
+        """Returns the playback session of the guild the command was sent from."""
+        return get_session(ctx.guild.id, ctx.guild.name)
+
+    async def ask_for_files(multiple=False):
+        """Opens a file dialog on the host machine and returns the chosen paths (empty if cancelled)."""
+        def select_files():
+            # Imported here so headless servers never load Tk
+            import tkinter as tk
+            from tkinter import filedialog
+            root = tk.Tk()
+            root.withdraw()
+            paths = filedialog.askopenfilenames() if multiple else [filedialog.askopenfilename()]
+            root.destroy()
+            return [path for path in paths if path]
+
+        return await bot.loop.run_in_executor(None, select_files)
+
+    async def tracks_from(ctx, path, multiple=False):
+        """Resolves the track given in a command, or asks for one with a file dialog when none was given."""
+        if path:
+            track = resolve_library_path(path)
+            if not track or not os.path.isfile(track):
+                await ctx.send("That file does not exist in the music library.")
+                return []
+            return [track]
+        if headless:
+            await ctx.send("Give a path relative to the music library, e.g. `!play album/track.mp3`.")
+            return []
+        return await ask_for_files(multiple)
+
+    @bot.listen('on_voice_state_update')
+    async def on_voice_state_update(member, before, after):
+        # Drop the session if the bot was disconnected or kicked from voice
+        if member.id == bot.user.id and before.channel and not after.channel:
+            remove_session(member.guild.id)
 
-def register_commands(bot):
     @bot.command()
     async def join(ctx):
         """Joins the user's voice channel."""
@@ -13,47 +61,246 @@ def register_commands(bot):
                 await ctx.voice_client.move_to(channel)
             else:
                 await channel.connect()
-            state.current_voice_client = ctx.voice_client
+            session_for(ctx).current_voice_client = ctx.voice_client
             await ctx.send(f"Joined {channel}. Phonograph Controller is ready!")
         else:
             await ctx.send("You need to be in a voice channel first!")
 
     @bot.command()
-    async def play(ctx):
-        """Opens a one-time file dialog and plays."""
+    async def play(ctx, *, path: str = None):
+        """Plays a track from the music library, or opens a one-time file dialog if no path is given."""
+        session = session_for(ctx)
         if not ctx.voice_client:
             if ctx.author.voice:
                 await ctx.author.voice.channel.connect()
-                state.current_voice_client = ctx.voice_client
             else:
                 return await ctx.send("You need to be in a voice channel first!")
+        session.current_voice_client = ctx.voice_client
 
-        def select_file():
-            root = tk.Tk()
-            root.withdraw()
-            path = filedialog.askopenfilename()
-            root.destroy()
-            return path
-
-        file_path = await bot.loop.run_in_executor(None, select_file)
-        if not file_path:
+        file_paths = await tracks_from(ctx, path)
+        if not file_paths:
             return
+        file_path = file_paths[0]
 
-        await play_audio_logic(bot, file_path)
-        await ctx.send(f"Now playing (Stereo): {os.path.basename(file_path)}")
+        result = await play_audio_logic(bot, session, file_path)
+        name = os.path.basename(file_path)
+        if result == PLAY_SUPERSEDED:
+            await ctx.send(f"Skipped {name}: another track was requested right after it.")
+        elif result == PLAY_FAILED:
+            await ctx.send(f"Could not play {name}.")
+        else:
+            await ctx.send(f"Now playing (Stereo): {name}")
 
     @bot.command()
     async def loop(ctx):
         """Toggles audio looping."""
-        state.is_looping = not state.is_looping
-        status = "enabled" if state.is_looping else "disabled"
+        session = session_for(ctx)
+        session.configure(is_looping=not session.is_looping)
+        status = "enabled" if session.is_looping else "disabled"
         await ctx.send(f"Looping is now **{status}**.")
 
+    @bot.command()
+    async def looppoints(ctx, start: str = None, end: str = None):
+        """Sets loop start/end (SS or MM:SS) for the current track. No arguments clears them."""
+        session = session_for(ctx)
+        if not session.current_track_path:
+            return await ctx.send("Nothing is playing.")
+        try:
+            start_seconds = parse_time(start) if start else None
+            end_seconds = parse_time(end) if end else None
+        except ValueError:
+            return await ctx.send("Loop points must look like `SS` or `MM:SS`.")
+        if end_seconds is not None and end_seconds <= (start_seconds or 0):
+            return await ctx.send("The loop end must come after the loop start.")
+
+        set_loop_points(session.current_track_path, start_seconds, end_seconds)
+        loop_start, loop_end = get_loop_points(session.current_track_path)
+        # Apply to the running source straight away when it loops in-process
+        playing = get_playing_source(session)
+        if isinstance(playing, OggOpusSource):
+            playing.loop_start = loop_start
+            playing.loop_end = loop_end
+
+        end_text = format_time(loop_end / OPUS_SAMPLE_RATE) if loop_end else "end"
+        await ctx.send(f"Loop points set: {format_time(loop_start / OPUS_SAMPLE_RATE)} -> {end_text}.")
+
+    @bot.group(invoke_without_command=True)
+    async def queue(ctx):
+        """Shows the play queue. Subcommands: add, remove, move, shuffle, clear, repeat."""
+        session = session_for(ctx)
+        tracks = session.queue.snapshot()
+        lines = [f"**Now playing:** {os.path.basename(session.current_track_path)}"] if session.current_track_path else []
+        lines += [f"`{i}.` {os.path.basename(path)}" for i, path in enumerate(tracks[:20], start=1)]
+        if len(tracks) > 20:
+            lines.append(f"... and {len(tracks) - 20} more")
+        if not tracks:
+            lines.append("The queue is empty. Use `!queue add` to add tracks.")
+        flags = []
+        if session.queue.repeat_all:
+            flags.append("repeat all")
+        if session.crossfade_seconds:
+            flags.append(f"crossfade {session.crossfade_seconds:g}s")
+        if flags:
+            lines.append(f"*({', '.join(flags)})*")
+        await ctx.send("\n".join(lines))
+
+    @queue.command(name='add')
+    async def queue_add(ctx, *, path: str = None):
+        """Queues a track from the music library, or opens a file dialog on the host to add several."""
+        session = session_for(ctx)
+        file_paths = await tracks_from(ctx, path, multiple=True)
+        if not file_paths:
+            return
+        for path in file_paths:
+            session.queue.add(path)
+        await ctx.send(f"Queued {len(file_paths)} track(s).")
+
+        # Start straight away if the bot is idle in voice
+        vc = ctx.voice_client
+        if vc and get_playing_source(session) is None:
+            session.current_voice_client = vc
+            await play_next_logic(bot, session)
+
+    @queue.command(name='remove')
+    async def queue_remove(ctx, position: int):
+        """Removes the track at a queue position."""
+        try:
+            path = session_for(ctx).queue.remove(position - 1)
+        except IndexError:
+            return await ctx.send("There is no track at that position.")
+        await ctx.send(f"Removed {os.path.basename(path)} from the queue.")
+
+    @queue.command(name='move')
+    async def queue_move(ctx, old_position: int, new_position: int):
+        """Moves a queued track to a new position."""
+        try:
+            session_for(ctx).queue.move(old_position - 1, max(new_position - 1, 0))
+        except IndexError:
+            return await ctx.send("There is no track at that position.")
+        await ctx.send("Queue reordered.")
+
+    @queue.command(name='shuffle')
+    async def queue_shuffle(ctx):
+        """Shuffles the queue."""
+        session_for(ctx).queue.shuffle()
+        await ctx.send("Queue shuffled.")
+
+    @queue.command(name='clear')
+    async def queue_clear(ctx):
+        """Empties the queue."""
+        session_for(ctx).queue.clear()
+        await ctx.send("Queue cleared.")
+
+    @queue.command(name='repeat')
+    async def queue_repeat(ctx):
+        """Toggles repeat-all: finished tracks go back to the end of the queue."""
+        track_queue = session_for(ctx).queue
+        track_queue.set_repeat_all(not track_queue.repeat_all)
+        status = "enabled" if track_queue.repeat_all else "disabled"
+        await ctx.send(f"Repeat all is now **{status}**.")
+
+    @bot.group(invoke_without_command=True)
+    async def layer(ctx):
+        """Shows the sound layers playing over the music. Subcommands: add, sfx, volume, loop, stop, clear."""
+        layers = session_for(ctx).mixer.snapshot()
+        if not layers:
+            return await ctx.send("No sound layers. Use `!layer add <name>` for ambience or `!layer sfx` for an effect.")
+        lines = [f"**{name}**: {os.path.basename(path)}, volume {volume * 100:.0f}%"
+                 f"{', looping' if loop else ''}{', ducking' if duck else ''}"
+                 for name, path, volume, loop, duck in layers]
+        await ctx.send("\n".join(lines))
+
+    async def start_layer(ctx, path, name=None, loop=True, duck=False, fade_in=0.0):
+        """Starts a layer from a library path (or a file dialog), joining the user's voice channel if needed."""
+        session = session_for(ctx)
+        if not ctx.voice_client:
+            if ctx.author.voice:
+                await ctx.author.voice.channel.connect()
+            else:
+                await ctx.send("You need to be in a voice channel first!")
+                return None
+        session.current_voice_client = ctx.voice_client
+
+        file_paths = await tracks_from(ctx, path)
+        if not file_paths:
+            return None
+        try:
+            return await add_layer_logic(session, file_paths[0], name, loop=loop, duck=duck, fade_in=fade_in)
+        except MixerUnavailable:
+            await ctx.send("Sound layers need NumPy on the bot's host: `pip install numpy`.")
+        except Exception as e:
+            await ctx.send(f"Could not open that file: {e}")
+        return None
+
+    @layer.command(name='add')
+    async def layer_add(ctx, name: str, *, path: str = None):
+        """Starts a looping ambience layer under a name (an existing layer with that name is replaced)."""
+        started = await start_layer(ctx, path, name, loop=True, fade_in=1.0)
+        if started:
+            await ctx.send(f"Layer **{started.name}** playing: {os.path.basename(started.filepath)}")
+
+    @layer.command(name='sfx')
+    async def layer_sfx(ctx, *, path: str = None):
+        """Plays a one-shot sound effect over everything, ducking the music while it plays."""
+        started = await start_layer(ctx, path, loop=False, duck=True)
+        if started:
+            await ctx.send(f"Playing effect: {os.path.basename(started.filepath)}")
+
+    @layer.command(name='volume')
+    async def layer_volume(ctx, name: str, percent: float):
+        """Sets a layer's volume in percent (0-200)."""
+        volume = min(max(percent / 100.0, 0.0), MAX_VOLUME)
+        if not session_for(ctx).mixer.set_volume(name, volume):
+            return await ctx.send("There is no layer with that name.")
+        await ctx.send(f"Layer **{name}** volume set to {volume * 100:.0f}%.")
+
+    @layer.command(name='loop')
+    async def layer_loop(ctx, name: str):
+        """Toggles looping of a layer."""
+        looping = session_for(ctx).mixer.set_loop(name)
+        if looping is None:
+            return await ctx.send("There is no layer with that name.")
+        status = "enabled" if looping else "disabled"
+        await ctx.send(f"Looping of layer **{name}** is now **{status}**.")
+
+    @layer.command(name='stop')
+    async def layer_stop(ctx, name: str, fade: float = 0.0):
+        """Stops a layer, optionally fading it out over some seconds."""
+        if not session_for(ctx).mixer.remove(name, max(fade, 0.0)):
+            return await ctx.send("There is no layer with that name.")
+        await ctx.send(f"Layer **{name}** stopped.")
+
+    @layer.command(name='clear')
+    async def layer_clear(ctx):
+        """Stops all layers."""
+        session_for(ctx).mixer.clear(fade_out=0.5)
+        await ctx.send("All layers stopped.")
+
+    @bot.command()
+    async def skip(ctx):
+        """Skips to the next track in the queue."""
+        if not ctx.voice_client:
+            return await ctx.send("I'm not in a voice channel.")
+        if await skip_logic(bot, session_for(ctx)):
+            await ctx.send("Skipped.")
+        else:
+            await ctx.send("The queue is empty.")
+
+    @bot.command()
+    async def crossfade(ctx, seconds: float = 0.0):
+        """Sets the crossfade between queued tracks in seconds (0 turns it off)."""
+        session = session_for(ctx)
+        session.configure(crossfade_seconds=min(max(seconds, 0.0), 12.0))
+        if session.crossfade_seconds:
+            await ctx.send(f"Crossfade set to {session.crossfade_seconds:g}s.")
+        else:
+            await ctx.send("Crossfade off.")
+
     @bot.command()
     async def pause(ctx):
         """Pauses the current audio."""
         if ctx.voice_client and ctx.voice_client.is_playing():
-            await pause_logic()
+            await pause_logic(session_for(ctx))
             await ctx.send("Paused.")
         else:
             await ctx.send("Nothing is playing.")
@@ -62,7 +309,7 @@ def register_commands(bot):
     async def resume(ctx):
         """Resumes the current audio."""
         if ctx.voice_client and ctx.voice_client.is_paused():
-            await resume_logic()
+            await resume_logic(session_for(ctx))
             await ctx.send("Resumed.")
         else:
             await ctx.send("Audio is not paused.")
@@ -70,21 +317,34 @@ def register_commands(bot):
     @bot.command()
     async def stop(ctx):
         """Stops the current audio."""
-        if ctx.voice_client and (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()):
-            state.current_track_path = None
-            state.total_duration = 0
-            state.elapsed_offset = 0
-            ctx.voice_client.stop()
+        if ctx.voice_client and await stop_logic(session_for(ctx)):
             await ctx.send("Stopped playback.")
         else:
             await ctx.send("Nothing is playing.")
 
+    @bot.command()
+    async def stats(ctx):
+        """Shows playback latency, frame timing, cache and transcode statistics."""
+        await ctx.send("```\n" + "\n".join(metrics.summary_lines()) + "\n```")
+
+    @bot.command()
+    async def cache(ctx, action: str = None):
+        """Shows the cache size and hit rate. `!cache clean` removes orphaned entries and enforces the size budget."""
+        if action == "clean":
+            report = await bot.loop.run_in_executor(None, collect_garbage)
+            await ctx.send(f"Cache cleaned: {report}.")
+        elif action:
+            await ctx.send("Usage: `!cache` or `!cache clean`")
+            return
+        lines = await bot.loop.run_in_executor(None, cache_summary_lines)
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
     @bot.command(aliases=['disconnect'])
     async def leave(ctx):
         """Leaves the voice channel."""
         if ctx.voice_client:
             await ctx.voice_client.disconnect()
-            state.current_voice_client = None
+            remove_session(ctx.guild.id)
             await ctx.send("Disconnected.")
         else:
             await ctx.send("I'm not in a voice channel.")
@@ -0,0 +1,294 @@
+import os
+import time
+import threading
+from .audio_engine import (shared, list_sessions, get_cache_path, get_legacy_cache_path, get_partial_path,
+                           ensure_cache_dir, report_cache_status, get_voice_source, get_content_key)
+from .playlist import QueueSource
+from .ogg_opus import get_index_path
+from .cache_store import (list_cache_files, remove_cache_file, cache_file_exists, store_cache_file, get_pack,
+                          packed_cache_enabled)
+from .metrics import metrics
+
+DEFAULT_CACHE_MAX_MB = 10240  # 0 = unlimited
+CACHE_POLICIES = ('lru', 'lfu')
+LOW_WATER_MARK = 0.9  # Evict down to this share of the budget, so not every new entry triggers an eviction
+ORPHAN_GRACE_DAYS = 7  # Missing files and unused entries are kept this long: a moved folder picks them up again
+PARTIAL_MAX_AGE = 3600  # Seconds before an abandoned .part file is deleted
+
+maintenance_lock = threading.Lock()
+
+def megabytes(size):
+    return f"{size / (1024 * 1024):.0f} MB"
+
+def read_cache_settings():
+    """
+    Reads the cache settings from the environment (.env): the size budget in bytes
+    (PHONOGRAPH_CACHE_MAX_MB, 0 = unlimited) and the eviction policy (PHONOGRAPH_CACHE_POLICY).
+    """
+    try:
+        max_mb = float(os.getenv('PHONOGRAPH_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB))
+    except ValueError:
+        max_mb = DEFAULT_CACHE_MAX_MB
+    policy = os.getenv('PHONOGRAPH_CACHE_POLICY', 'lru').strip().lower()
+    if policy not in CACHE_POLICIES:
+        policy = 'lru'
+    return int(max(max_mb, 0) * 1024 * 1024), policy
+
+class CacheEntry:
+    """All files of one cache key: the Opus variants, their seek indexes and the waveform overview."""
+    def __init__(self, key):
+        self.key = key
+        self.files = []
+        self.size = 0
+        self.mtime = 0.0
+        self.last_played = 0.0
+        self.plays = 0
+        self.sources = []  # Files in the index whose current content maps to this entry
+
+    @property
+    def last_used(self):
+        return max(self.last_played, self.mtime)
+
+def scan_cache():
+    """Returns the cache entries by key (loose files and pack members alike), and the leftover .part files."""
+    entries = {}
+    partials = []
+    for name, path, size, mtime in list_cache_files(shared.cache_dir):
+        if name.endswith(".part"):
+            partials.append(path)
+            continue
+        key = name.split('.', 1)[0]
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = CacheEntry(key)
+        entry.files.append(path)
+        entry.size += size
+        entry.mtime = max(entry.mtime, mtime)
+    return entries, partials
+
+def attach_history(entries, rows):
+    """
+    Adds the playback history of the index rows whose source still matches them to the entries.
+    Rows of files found missing still count (the file may have moved), but are not sources.
+    """
+    for row in rows:
+        entry = entries.get(row['content_key'])
+        if entry is None:
+            continue
+        if is_row_fresh(row):
+            entry.sources.append(row['path'])
+        elif row['missing_since'] is None:
+            continue  # Changed since it was keyed
+        entry.plays += row['play_count'] or 0
+        entry.last_played = max(entry.last_played, row['last_played'] or 0.0)
+
+def is_row_fresh(row):
+    try:
+        st = os.stat(row['path'])
+    except OSError:
+        return False
+    return row['size'] == st.st_size and row['mtime'] == st.st_mtime
+
+def tracks_in_use(session):
+    """Files a session reads or is about to read: its current and starting track, the next queued one and its sound layers."""
+    paths = [session.current_track_path, session.pending_track()]
+    source = get_voice_source(session)
+    if isinstance(source, QueueSource):
+        following = source.next
+        paths += [following.filepath if following is not None else None, source.prepared_for]
+    paths += [filepath for _, filepath, _, _, _ in session.mixer.snapshot()]
+    return {path for path in paths if path}
+
+def protected_keys():
+    """Keys that must not be deleted: tracks and sound layers in use in any session and entries being written."""
+    keys = set()
+    for session in list_sessions():
+        keys.update(get_content_key(path) for path in tracks_in_use(session))
+    with shared.cache_writes_lock:
+        keys.update(os.path.basename(path).split('.', 1)[0] for path in shared.cache_writes)
+    return keys
+
+def remove_entry(entry):
+    """Deletes an entry's files and marks the files that used it as pending again. Returns False if it is in use."""
+    removed = True
+    for path in entry.files:
+        try:
+            remove_cache_file(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            removed = False  # Open elsewhere (Windows); try again next time
+    shared.index.invalidate_cache_key(entry.key)
+    for source in entry.sources:
+        report_cache_status(source, False)
+    return removed
+
+def enforce_budget():
+    """
+    Evicts cache entries until the cache fits its budget again, least recently played first
+    ("lru") or least often played first ("lfu"). Returns the number of bytes freed.
+    """
+    max_bytes, policy = read_cache_settings()
+    if max_bytes <= 0:
+        return 0
+    with maintenance_lock:
+        entries, _ = scan_cache()
+        total = sum(entry.size for entry in entries.values())
+        metrics.set_gauge('phonograph_cache_bytes', total)
+        if total <= max_bytes:
+            return 0
+
+        attach_history(entries, shared.index.rows())
+        protected = protected_keys()
+        if policy == 'lfu':
+            order = sorted(entries.values(), key=lambda e: (e.plays, e.last_used))
+        else:
+            order = sorted(entries.values(), key=lambda e: e.last_used)
+
+        freed = 0
+        evicted = 0
+        target = max_bytes * LOW_WATER_MARK
+        for entry in order:
+            if total - freed <= target:
+                break
+            if entry.key in protected or not remove_entry(entry):
+                continue
+            freed += entry.size
+            evicted += 1
+        metrics.inc('phonograph_cache_evictions_total', evicted)
+        metrics.set_gauge('phonograph_cache_bytes', total - freed)
+    if evicted:
+        print(f"[Cache] Evicted {evicted} entries ({megabytes(freed)}) to stay under {megabytes(max_bytes)} ({policy})")
+    return freed
+
+def migrate_legacy_entries(rows):
+    """Renames entries cached under the old path-hash names to their content keys. Returns how many moved."""
+    moved = 0
+    for row in rows:
+        path = row['path']
+        if not cache_file_exists(get_legacy_cache_path(path)) or not is_row_fresh(row):
+            continue
+        for variant in (None, "norm"):
+            old = get_legacy_cache_path(path, variant)
+            new = get_cache_path(path, variant)
+            if not cache_file_exists(old):
+                continue
+            try:
+                if cache_file_exists(new):
+                    # A duplicate of this file was already migrated
+                    remove_cache_file(old)
+                    if cache_file_exists(get_index_path(old)):
+                        remove_cache_file(get_index_path(old))
+                    continue
+                store_cache_file(old, new)
+                moved += 1
+                if cache_file_exists(get_index_path(old)):
+                    store_cache_file(get_index_path(old), get_index_path(new))
+            except OSError as e:
+                print(f"[Cache] Could not migrate {os.path.basename(old)}: {e}")
+    return moved
+
+def collect_garbage():
+    """
+    Cleans the cache: migrates old path-keyed entries, forgets index rows of files missing for
+    ORPHAN_GRACE_DAYS, deletes entries no current or recently missing file maps to once they have not
+    been used for ORPHAN_GRACE_DAYS, deletes abandoned .part files, then enforces the size budget.
+    A moved folder thus finds its entries, loop points and play history again. Returns a short report.
+    """
+    ensure_cache_dir()
+    grace = ORPHAN_GRACE_DAYS * 86400
+    with maintenance_lock:
+        rows = shared.index.rows()
+        migrated = migrate_legacy_entries(rows)
+
+        now = time.time()
+        forgotten = 0
+        for row in rows:
+            if os.path.exists(row['path']):
+                continue
+            if row['missing_since'] is None:
+                shared.index.mark_missing(row['path'], now)
+            elif now - row['missing_since'] >= grace:
+                shared.index.forget(row['path'])
+                forgotten += 1
+        rows = shared.index.rows()  # Migration stored content keys, missing files were marked
+
+        referenced = {row['content_key'] for row in rows
+                      if row['content_key'] and (row['missing_since'] is not None or is_row_fresh(row))}
+        entries, partials = scan_cache()
+        attach_history(entries, rows)
+        protected = protected_keys()
+        orphans = 0
+        freed = 0
+        for entry in entries.values():
+            if entry.key in referenced or entry.key in protected:
+                continue
+            if now - entry.last_used < grace:
+                continue
+            if remove_entry(entry):
+                orphans += 1
+                freed += entry.size
+
+        with shared.cache_writes_lock:
+            in_flight = {get_partial_path(path) for path in shared.cache_writes}
+        stale_partials = 0
+        for path in partials:
+            try:
+                if path not in in_flight and now - os.path.getmtime(path) > PARTIAL_MAX_AGE:
+                    os.remove(path)
+                    stale_partials += 1
+            except OSError:
+                pass
+    freed += enforce_budget()
+    report = (f"migrated {migrated} old entries, removed {orphans} orphaned entries and "
+              f"{stale_partials} partial files, forgot {forgotten} missing tracks, freed {megabytes(freed)}")
+    print(f"[Cache] Cleanup: {report}")
+    return report
+
+def cache_summary_lines():
+    """Human-readable cache size, budget and hit rate, for !cache, --cache-stats and the GUI."""
+    max_bytes, policy = read_cache_settings()
+    entries, partials = scan_cache()
+    total = sum(entry.size for entry in entries.values())
+    metrics.set_gauge('phonograph_cache_bytes', total)
+    rows = shared.index.rows()
+    plays = sum(row['play_count'] or 0 for row in rows)
+    cached_plays = sum(row['cached_plays'] or 0 for row in rows)
+
+    budget = f"{megabytes(max_bytes)} ({policy} eviction)" if max_bytes else "unlimited"
+    lines = [f"Cache: {megabytes(total)} in {len(entries)} entries, budget {budget}"]
+    if partials:
+        lines[0] += f", {len(partials)} partial files"
+    pack = get_pack(shared.cache_dir)
+    if pack is not None:
+        lines.append(f"Pack: {megabytes(pack.data_size())} on disk, {megabytes(pack.garbage)} reclaimable "
+                     f"by --cache-compact")
+    if plays:
+        lines.append(f"Hit rate: {100.0 * cached_plays / plays:.0f}% of {plays} plays")
+    else:
+        lines.append("Hit rate: no plays recorded yet")
+    hits = metrics.value('phonograph_cache_lookups_total', result="hit")
+    misses = metrics.value('phonograph_cache_lookups_total', result="miss")
+    if hits + misses:
+        lines[-1] += f" ({100.0 * hits / (hits + misses):.0f}% since start)"
+    return lines
+
+def compact_cache():
+    """
+    Offline compaction of the packed cache: rewrites the pack without evicted or replaced members and moves
+    loose cache files into it. Only run it while the bot is not running. Returns a short report.
+    """
+    ensure_cache_dir()
+    if not packed_cache_enabled():
+        return "The packed cache backend is off (PHONOGRAPH_CACHE_BACKEND=packed turns it on)"
+    with maintenance_lock:
+        members, freed = get_pack(shared.cache_dir).compact()
+    report = f"compacted the pack to {members} files, freed {megabytes(freed)}"
+    print(f"[Cache] Compaction: {report}")
+    return report
+
+def start_cache_maintenance():
+    """Cleans the cache once in the background, e.g. at startup."""
+    thread = threading.Thread(target=collect_garbage, daemon=True)
+    thread.start()
+    return thread
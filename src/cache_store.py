@@ -0,0 +1,443 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+import threading
+
+# Packed backend: every cache file is a member of one append-only data file, found through a small
+# journal of fixed-size records. Both live in a subfolder, so scans of the cache folder never see them.
+PACK_DIR = "pack"
+PACK_INDEX_NAME = "index"
+INDEX_HEADER = struct.Struct('<4sHH32s')  # magic, version, reserved, name of the data file in use
+INDEX_MAGIC = b'PHPK'
+INDEX_VERSION = 1
+# crc32 of the rest, kind, offset, length, mtime, name length; the member name follows
+RECORD = struct.Struct('<IB3xQQdI')
+RECORD_PUT = 1
+RECORD_DELETE = 2
+COPY_CHUNK_BYTES = 1024 * 1024
+
+def packed_cache_enabled():
+    """PHONOGRAPH_CACHE_BACKEND=packed stores new cache files in the pack instead of as loose files."""
+    return os.getenv('PHONOGRAPH_CACHE_BACKEND', 'files').strip().lower() == 'packed'
+
+def data_file_name(generation):
+    return f"data-{generation:06d}.bin"
+
+class PackedFile:
+    """
+    Read-only file object over one pack member: reads return memoryview slices of the shared mapping,
+    with no system call and no copy. Callers that keep the data around copy just the part they keep.
+    """
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.pos + size, len(self.view))
+        data = self.view[self.pos:end]
+        self.pos = max(end, self.pos)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += len(self.view)
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CachePack:
+    """
+    The packed store of one cache folder. Members are appended to the data file and only become visible
+    once their journal record is written after them, so a crash mid-commit leaves nothing half-written
+    behind: a torn record at the end of the journal is ignored. Readers get memoryview slices of a
+    read-only mapping that is widened when the file grows, so any number of threads read concurrently.
+    Writers copy and sync under append_lock; `lock` is only held to publish a record and to look members
+    up, so readers on the audio thread never wait for a disk sync.
+    Removing a member only writes a tombstone; compact() reclaims the space (with the bot stopped).
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.pack_dir = os.path.join(directory, PACK_DIR)
+        self.index_path = os.path.join(self.pack_dir, PACK_INDEX_NAME)
+        self.members = {}  # name -> (offset, length, mtime)
+        self.loose = set()  # Names of loose files in the cache folder, so lookups need no stat
+        self.lock = threading.Lock()  # Guards members, loose and the mapping
+        self.append_lock = threading.Lock()  # Serialises writes to the data file and the journal
+        self.data_name = data_file_name(1)
+        self.data_file = None
+        self.index_file = None
+        self.mapping = None
+        self.mapped_size = 0
+        self.garbage = 0  # Bytes taken by replaced and removed members
+        self.load()
+
+    @property
+    def data_path(self):
+        return os.path.join(self.pack_dir, self.data_name)
+
+    def load(self):
+        os.makedirs(self.pack_dir, exist_ok=True)
+        try:
+            with open(self.index_path, 'rb') as f:
+                journal = f.read()
+        except FileNotFoundError:
+            journal = b''
+        if len(journal) >= INDEX_HEADER.size:
+            magic, version, _, data_name = INDEX_HEADER.unpack_from(journal)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError(f"{self.index_path} is not a cache pack index")
+            self.data_name = data_name.rstrip(b'\0').decode('ascii')
+        else:
+            self.write_index_header()
+            journal = b''
+
+        try:
+            data_size = os.path.getsize(self.data_path)
+        except OSError:
+            data_size = 0
+        pos = INDEX_HEADER.size
+        while len(journal) >= pos + RECORD.size:
+            crc, kind, offset, length, mtime, name_length = RECORD.unpack_from(journal, pos)
+            end = pos + RECORD.size + name_length
+            if end > len(journal) or zlib.crc32(journal[pos + 4:end]) != crc or offset + length > data_size:
+                break  # Torn by a crash: everything before it is intact
+            self.apply(kind, journal[pos + RECORD.size:end].decode('utf-8'), offset, length, mtime)
+            pos = end
+
+        self.index_file = open(self.index_path, 'r+b')
+        self.index_file.seek(pos)
+        self.index_file.truncate()
+        self.data_file = open(self.data_path, 'a+b')  # Readable too: the mapping is made from it
+        try:
+            self.loose = {item.name for item in os.scandir(self.directory) if item.is_file()}
+        except OSError:
+            self.loose = set()
+
+    def write_index_header(self):
+        temp_path = self.index_path + ".part"
+        with open(temp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, self.data_name.encode('ascii')))
+        os.replace(temp_path, self.index_path)
+
+    def apply(self, kind, name, offset, length, mtime):
+        old = self.members.pop(name, None)
+        if old is not None:
+            self.garbage += old[1]
+        if kind == RECORD_PUT:
+            self.members[name] = (offset, length, mtime)
+
+    def append_record(self, kind, name, offset=0, length=0, mtime=0.0):
+        encoded = name.encode('utf-8')
+        record = RECORD.pack(0, kind, offset, length, mtime, len(encoded))[4:] + encoded
+        self.index_file.write(struct.pack('<I', zlib.crc32(record)) + record)
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        with self.lock:
+            self.apply(kind, name, offset, length, mtime)
+
+    def lookup(self, name):
+        """Returns (offset, length, mtime) of a member, or None."""
+        with self.lock:
+            return self.members.get(name)
+
+    def view(self, name):
+        """Returns a zero-copy memoryview of a member's bytes, or None if there is no such member."""
+        with self.lock:
+            member = self.members.get(name)
+            if member is None:
+                return None
+            offset, length, _ = member
+            if not length:
+                return memoryview(b'')
+            if offset + length > self.mapped_size:
+                # The file grew since it was mapped; views of the old mapping stay valid
+                self.mapping = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mapped_size = len(self.mapping)
+            return memoryview(self.mapping)[offset:offset + length]
+
+    def put_file(self, name, source_path):
+        """Appends the contents of a completely written file as a member (replacing any older one)."""
+        with open(source_path, 'rb') as source:
+            with self.append_lock:
+                offset = self.data_file.seek(0, os.SEEK_END)
+                for chunk in iter(lambda: source.read(COPY_CHUNK_BYTES), b''):
+                    self.data_file.write(chunk)
+                self.commit(name, offset)
+
+    def put_bytes(self, name, data):
+        with self.append_lock:
+            offset = self.data_file.seek(0, os.SEEK_END)
+            self.data_file.write(data)
+            self.commit(name, offset)
+
+    def commit(self, name, offset):
+        # The data must be on disk before the record that points at it
+        self.data_file.flush()
+        os.fsync(self.data_file.fileno())
+        length = self.data_file.tell() - offset
+        self.append_record(RECORD_PUT, name, offset, length, time.time())
+
+    def remove(self, name):
+        with self.append_lock:
+            if self.lookup(name) is None:
+                return False
+            self.append_record(RECORD_DELETE, name)
+            return True
+
+    def entries(self):
+        """Returns [(name, size, mtime)] of every member."""
+        with self.lock:
+            return [(name, length, mtime) for name, (_, length, mtime) in self.members.items()]
+
+    def data_size(self):
+        with self.lock:
+            return os.fstat(self.data_file.fileno()).st_size
+
+    def close(self):
+        with self.append_lock, self.lock:
+            self.mapping = None
+            self.mapped_size = 0
+            for f in (self.data_file, self.index_file):
+                if f is not None:
+                    f.close()
+            self.data_file = self.index_file = None
+
+    def compact(self, absorb_loose=True):
+        """
+        Rewrites the pack without removed or replaced members and, with absorb_loose, moves the loose
+        cache files of the folder into it. The new data file only takes over once its index has been
+        renamed into place. Only run it while no other process uses the cache. Returns (members, bytes freed).
+        """
+        with self.append_lock:
+            with self.lock:
+                before = self.data_file.seek(0, os.SEEK_END)
+                generation = int(self.data_name.split('-')[1].split('.')[0]) + 1
+                new_name = data_file_name(generation)
+                new_path = os.path.join(self.pack_dir, new_name)
+                members = sorted(self.members.items(), key=lambda item: item[1][0])
+                loose = []
+                if absorb_loose:
+                    for item in os.scandir(self.directory):
+                        if item.is_file() and not item.name.endswith(".part") and item.name not in self.members:
+                            loose.append(item)
+
+                records = []
+                mapping = None
+                if before:
+                    mapping = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+                with open(new_path, 'wb') as out:
+                    for name, (offset, length, mtime) in members:
+                        records.append((name, out.tell(), length, mtime))
+                        out.write(mapping[offset:offset + length])
+                    for item in loose:
+                        start = out.tell()
+                        with open(item.path, 'rb') as source:
+                            for chunk in iter(lambda: source.read(COPY_CHUNK_BYTES), b''):
+                                out.write(chunk)
+                        records.append((item.name, start, out.tell() - start, item.stat().st_mtime))
+                    out.flush()
+                    os.fsync(out.fileno())
+                    after = out.tell()
+                if mapping is not None:
+                    mapping.close()
+
+                temp_path = self.index_path + ".part"
+                with open(temp_path, 'wb') as f:
+                    f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, new_name.encode('ascii')))
+                    for name, offset, length, mtime in records:
+                        encoded = name.encode('utf-8')
+                        record = RECORD.pack(0, RECORD_PUT, offset, length, mtime, len(encoded))[4:] + encoded
+                        f.write(struct.pack('<I', zlib.crc32(record)) + record)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                old_path = self.data_path
+                self.mapping = None
+                self.mapped_size = 0
+                self.data_file.close()
+                self.index_file.close()
+                os.replace(temp_path, self.index_path)
+                for item in loose:
+                    try:
+                        os.remove(item.path)
+                    except OSError:
+                        pass  # Also in the pack now, which wins on lookup
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+                # Data files left behind by an interrupted compaction
+                for item in os.scandir(self.pack_dir):
+                    if item.name.startswith("data-") and item.name != new_name:
+                        try:
+                            os.remove(item.path)
+                        except OSError:
+                            pass
+
+                self.members = {}
+                self.garbage = 0
+                self.data_name = new_name
+            self.load()
+        absorbed = sum(length for _, _, length, _ in records[len(members):])
+        return len(records), max(before + absorbed - after, 0)
+
+_packs = {}  # cache folder -> CachePack, or None when it has no pack and the backend is "files"
+_packs_lock = threading.Lock()
+
+def get_pack(directory):
+    """Returns the pack of a cache folder: created in packed mode, opened in any mode when one exists."""
+    with _packs_lock:
+        if directory not in _packs:
+            pack = None
+            if packed_cache_enabled() or os.path.exists(os.path.join(directory, PACK_DIR, PACK_INDEX_NAME)):
+                try:
+                    pack = CachePack(directory)
+                except (OSError, ValueError) as e:
+                    print(f"[CacheStore] Could not open the cache pack in {directory}: {e}")
+            _packs[directory] = pack
+        return _packs[directory]
+
+def close_packs():
+    with _packs_lock:
+        for pack in _packs.values():
+            if pack is not None:
+                pack.close()
+        _packs.clear()
+
+def locate(path):
+    """Returns (pack or None, member name) for a cache path."""
+    directory, name = os.path.split(path)
+    return get_pack(directory), name
+
+def cache_file_exists(path):
+    pack, name = locate(path)
+    if pack is None:
+        return os.path.exists(path)
+    return pack.lookup(name) is not None or name in pack.loose
+
+def get_cache_file_mtime(path):
+    """Returns the modification time of a cache file, or None if it does not exist."""
+    pack, name = locate(path)
+    if pack is not None:
+        member = pack.lookup(name)
+        if member is not None:
+            return member[2]
+        if name not in pack.loose:
+            return None
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def open_cache_file(path):
+    """Opens a cache file for reading, from the pack or the folder. Raises FileNotFoundError if it does not exist."""
+    pack, name = locate(path)
+    if pack is not None:
+        view = pack.view(name)
+        if view is not None:
+            return PackedFile(view)
+    return open(path, 'rb')
+
+def read_cache_file(path):
+    """Returns the contents of a cache file; pack members are returned as a zero-copy memoryview."""
+    pack, name = locate(path)
+    if pack is not None:
+        view = pack.view(name)
+        if view is not None:
+            return view
+    with open(path, 'rb') as f:
+        return f.read()
+
+def map_cache_file(path):
+    """Returns the pack member at a path as a zero-copy memoryview, or None for a loose file (memory-map that instead)."""
+    pack, name = locate(path)
+    return pack.view(name) if pack is not None else None
+
+def store_cache_file(source_path, path):
+    """
+    Moves a completely written file into the cache under `path`: renamed into place with the "files" backend,
+    appended to the pack (and the source deleted) with the packed one. Either way it appears atomically.
+    """
+    pack, name = locate(path)
+    if pack is None or not packed_cache_enabled():
+        os.replace(source_path, path)
+        if pack is not None:
+            pack.loose.add(name)
+            pack.remove(name)  # An older packed copy would shadow the new file
+        return
+    pack.put_file(name, source_path)
+    os.remove(source_path)
+    pack.loose.discard(os.path.basename(source_path))
+    if name in pack.loose:
+        # A loose copy from before the switch to the pack is stale now
+        pack.loose.discard(name)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def write_cache_file(path, data):
+    """Stores small derived data (seek indexes) in the cache atomically."""
+    pack, name = locate(path)
+    if pack is not None and packed_cache_enabled():
+        pack.put_bytes(name, data)
+        return
+    temp_path = path + ".part"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    store_cache_file(temp_path, path)
+
+def remove_cache_file(path):
+    """Deletes a cache file wherever it is stored. Raises FileNotFoundError if it does not exist, OSError if in use."""
+    pack, name = locate(path)
+    removed = pack is not None and pack.remove(name)
+    try:
+        os.remove(path)
+        if pack is not None:
+            pack.loose.discard(name)
+    except FileNotFoundError:
+        if not removed:
+            raise
+
+def list_cache_files(directory):
+    """Returns [(name, path, size, mtime)] of every file in a cache folder, packed or loose (including .part files)."""
+    files = {}
+    try:
+        for item in os.scandir(directory):
+            if item.is_file():
+                st = item.stat()
+                files[item.name] = (item.name, item.path, st.st_size, st.st_mtime)
+    except OSError:
+        return []
+    pack = get_pack(directory)
+    if pack is not None:
+        for name, size, mtime in pack.entries():
+            files[name] = (name, os.path.join(directory, name), size, mtime)
+    return list(files.values())
+
+def get_ffmpeg_input(path):
+    """
+    Returns (input argument, file to pipe in) for handing a cache file to ffmpeg: the path itself for
+    loose files, or "pipe:0" and the member's contents to be written to ffmpeg's stdin for pack members.
+    """
+    pack, name = locate(path)
+    if pack is not None:
+        view = pack.view(name)
+        if view is not None:
+            return 'pipe:0', PackedFile(view)
+    return path, None
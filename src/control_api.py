@@ -0,0 +1,243 @@
+import os
+import hmac
+import json
+import secrets
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from .library import get_library_dir, resolve_library_path
+from .audio_engine import (shared, AUDIO_EXTENSIONS, list_sessions, play_audio_logic, seek_logic, pause_logic,
+                           resume_logic, skip_logic, stop_logic, is_file_optimized, parse_time, PLAY_FAILED)
+
+DEFAULT_CONTROL_PORT = 8765
+COMMAND_TIMEOUT = 30  # Seconds to wait for a command to finish on the bot's event loop
+TOKEN_FILE_NAME = ".phonograph_control_token"  # Generated token, used when PHONOGRAPH_CONTROL_TOKEN is not set
+
+class ControlError(Exception):
+    """A request the control API rejects, with the HTTP status to answer with."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def session_info(session):
+    position, duration, playing, paused = session.progress()
+    return {
+        'guild_id': session.guild_id,
+        'guild_name': session.guild_name,
+        'track': session.current_track_path,
+        'position': round(position, 2),
+        'duration': round(duration, 2),
+        'playing': playing,
+        'paused': paused,
+        'looping': session.is_looping,
+        'normalized': session.is_normalized,
+        'queue': len(session.queue.snapshot()),
+    }
+
+class ControlAPI:
+    """
+    Local HTTP control of the bot for headless servers: browse the library and drive a guild session.
+    Listens on 127.0.0.1 only, and every request needs "Authorization: Bearer <token>" (see get_control_token).
+    Requests must name 127.0.0.1 or localhost in their Host header and POST bodies must be sent as
+    application/json, so web pages opened on the host can neither drive the bot nor read it via DNS rebinding.
+
+        GET  /status                        sessions and what they are playing
+        GET  /browse?path=<dir>             folders and audio files under the library folder
+        POST /play      {"path": ...}       POST /seek {"position": seconds or "MM:SS"}
+        POST /loop      {"enabled": bool}   POST /normalize {"enabled": bool}
+        POST /pause, /resume, /skip, /stop
+
+    POST bodies may name the guild with "guild"; it can be left out while the bot is in a single guild.
+    """
+    def __init__(self, bot, port, token, host="127.0.0.1"):
+        self.bot = bot
+        self.token = token
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api.handle(self, "GET")
+
+            def do_POST(self):
+                api.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass  # Keep the console for the bot's own output
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.routes = {
+            ("GET", "/status"): self.status,
+            ("GET", "/browse"): self.browse,
+            ("POST", "/play"): self.play,
+            ("POST", "/seek"): self.seek,
+            ("POST", "/loop"): self.loop,
+            ("POST", "/normalize"): self.normalize,
+            ("POST", "/pause"): lambda body: self.run_logic(pause_logic(self.session_for(body))),
+            ("POST", "/resume"): lambda body: self.run_logic(resume_logic(self.session_for(body))),
+            ("POST", "/skip"): self.skip,
+            ("POST", "/stop"): self.stop,
+        }
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        host, port = self.server.server_address[:2]
+        print(f"[Control] Listening on http://{host}:{port}")
+        return self
+
+    def handle(self, request, method):
+        url = urlparse(request.path)
+        try:
+            port = self.server.server_address[1]
+            if request.headers.get('Host') not in (f"127.0.0.1:{port}", f"localhost:{port}"):
+                raise ControlError("Unexpected Host header", 403)
+            authorization = request.headers.get('Authorization', '').encode('utf-8', 'replace')
+            if not hmac.compare_digest(authorization, f"Bearer {self.token}".encode('utf-8')):
+                raise ControlError("Missing or wrong token", 401)
+            route = self.routes.get((method, url.path.rstrip('/') or '/'))
+            if route is None:
+                raise ControlError("Unknown endpoint", 404)
+            if method == "GET":
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                result = route(params)
+            else:
+                content_type = request.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if content_type != 'application/json':
+                    raise ControlError("Body must be sent as application/json", 415)
+                length = int(request.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(request.rfile.read(length) or b"{}")
+                except ValueError:
+                    raise ControlError("Body must be JSON")
+                if not isinstance(body, dict):
+                    raise ControlError("Body must be a JSON object")
+                result = route(body)
+            status, payload = 200, result if result is not None else {'ok': True}
+        except ControlError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            print(f"[Control] {method} {url.path} failed: {e}")
+            status, payload = 500, {'error': str(e)}
+
+        data = json.dumps(payload).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def session_for(self, body):
+        """The session a request targets: the "guild" it names, or the only one there is."""
+        sessions = list_sessions()
+        guild = body.get('guild')
+        if guild is not None:
+            for session in sessions:
+                if str(session.guild_id) == str(guild) or session.guild_name == guild:
+                    return session
+            raise ControlError("The bot is not in that guild's voice channel", 404)
+        if len(sessions) != 1:
+            raise ControlError("Name the guild with \"guild\"" if sessions else "The bot is not in a voice channel", 409)
+        return sessions[0]
+
+    def run_logic(self, coro):
+        """Runs one of the audio engine coroutines on the bot's event loop and returns its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.bot.loop).result(COMMAND_TIMEOUT)
+
+    def status(self, params):
+        return {'library': get_library_dir(), 'sessions': [session_info(s) for s in list_sessions()]}
+
+    def browse(self, params):
+        root = get_library_dir()
+        directory = resolve_library_path(params.get('path', ''), root)
+        if not directory or not os.path.isdir(directory):
+            raise ControlError("No such folder in the music library", 404)
+        dirs = []
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in sorted(entries, key=lambda e: e.name.lower()):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    files.append({'name': entry.name, 'optimized': is_file_optimized(entry.path)})
+        return {'path': os.path.relpath(directory, os.path.realpath(root)), 'dirs': dirs, 'files': files}
+
+    def play(self, body):
+        session = self.session_for(body)
+        track = resolve_library_path(body.get('path') or '')
+        if not track or not os.path.isfile(track):
+            raise ControlError("No such file in the music library", 404)
+        if self.run_logic(play_audio_logic(self.bot, session, track)) == PLAY_FAILED:
+            raise ControlError("The track could not be played", 500)
+        return session_info(session)
+
+    def seek(self, body):
+        session = self.session_for(body)
+        if not session.current_track_path:
+            raise ControlError("Nothing is playing", 409)
+        position = body.get('position')
+        try:
+            seconds = parse_time(position) if isinstance(position, str) else float(position)
+        except (TypeError, ValueError):
+            raise ControlError("\"position\" must be seconds or MM:SS")
+        self.run_logic(seek_logic(self.bot, session, max(seconds, 0.0)))
+        return session_info(session)
+
+    def loop(self, body):
+        session = self.session_for(body)
+        session.configure(is_looping=bool(body.get('enabled', not session.is_looping)))
+        return session_info(session)
+
+    def normalize(self, body):
+        session = self.session_for(body)
+        session.configure(is_normalized=bool(body.get('enabled', not session.is_normalized)))
+        return session_info(session)
+
+    def skip(self, body):
+        if not self.run_logic(skip_logic(self.bot, self.session_for(body))):
+            raise ControlError("The queue is empty", 409)
+
+    def stop(self, body):
+        if not self.run_logic(stop_logic(self.session_for(body))):
+            raise ControlError("Nothing is playing", 409)
+
+def get_control_token():
+    """
+    Returns the token requests must carry: PHONOGRAPH_CONTROL_TOKEN, or else a random one
+    generated once and kept in TOKEN_FILE_NAME next to the bot, readable only by its user.
+    """
+    token = os.getenv('PHONOGRAPH_CONTROL_TOKEN', '').strip()
+    if token:
+        return token
+    path = os.path.join(shared.bot_root, TOKEN_FILE_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            token = f.read().strip()
+    except OSError:
+        token = ''
+    if not token:
+        token = secrets.token_urlsafe(32)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(token + "\n")
+    print(f"[Control] No PHONOGRAPH_CONTROL_TOKEN set; requests need the token in {path}")
+    return token
+
+def start_control_api(bot, headless=False):
+    """
+    Starts the control API if a port is configured (PHONOGRAPH_CONTROL_PORT).
+    Headless servers get it on DEFAULT_CONTROL_PORT unless the port is set to 0.
+    """
+    try:
+        port = int(os.getenv('PHONOGRAPH_CONTROL_PORT', DEFAULT_CONTROL_PORT if headless else 0))
+    except ValueError:
+        port = DEFAULT_CONTROL_PORT if headless else 0
+    if port <= 0:
+        return None
+    try:
+        return ControlAPI(bot, port, get_control_token()).start()
+    except OSError as e:
+        print(f"[Control] Could not listen on port {port}: {e}")
+        return None
@@ -0,0 +1,50 @@
+import threading
+
+# Events published on the bus. Session events carry the PlaybackState as `session`.
+TRACK_STARTED = "track_started"  # A track began playing, including the queue moving on to the next one
+PAUSED = "paused"
+RESUMED = "resumed"
+SEEKED = "seeked"  # Position jumped: a seek, or an in-process loop wrapping around
+ENDED = "ended"  # Playback finished or was stopped
+SETTINGS_CHANGED = "settings_changed"  # Looping, normalization or crossfade changed
+QUEUE_CHANGED = "queue_changed"  # Queue contents or repeat-all changed
+SESSIONS_CHANGED = "sessions_changed"  # A guild session was created or removed
+CACHE_STATUS_CHANGED = "cache_status_changed"  # A file's optimization status is known; carries filepath, optimized
+WAVEFORM_READY = "waveform_ready"  # A cached track's waveform overview was written; carries filepath
+LAYERS_CHANGED = "layers_changed"  # A sound layer was added, removed or changed, or ended by itself
+ALL_EVENTS = "*"
+
+class EventBus:
+    """
+    Thread-safe publish/subscribe hub for playback state changes.
+    Events are delivered synchronously on the thread that published them (the discord event loop,
+    the audio player thread or a transcode worker), so subscribers must stay cheap and hand the
+    work over to their own thread, e.g. Tk via root.after.
+    """
+    def __init__(self):
+        self.subscribers = {}  # event name -> callbacks, ALL_EVENTS receives everything
+        self.lock = threading.Lock()
+
+    def subscribe(self, event, callback):
+        """Registers callback(event, payload) for an event name, or ALL_EVENTS."""
+        with self.lock:
+            # Lists are replaced rather than mutated so publish() can iterate without holding the lock
+            self.subscribers[event] = self.subscribers.get(event, []) + [callback]
+        return callback
+
+    def unsubscribe(self, event, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(event, [])
+            if callback in callbacks:
+                self.subscribers[event] = [c for c in callbacks if c is not callback]
+
+    def publish(self, event, **payload):
+        with self.lock:
+            callbacks = self.subscribers.get(event, []) + self.subscribers.get(ALL_EVENTS, [])
+        for callback in callbacks:
+            try:
+                callback(event, payload)
+            except Exception as e:
+                print(f"[Events] Subscriber failed on {event}: {e}")
+
+bus = EventBus()
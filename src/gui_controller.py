@@ -2,9 +2,17 @@ import os
 import tkinter as tk
 from tkinter import filedialog
 import customtkinter as ctk
-import time
 import asyncio
-from .audio_engine import state, get_audio_files, play_audio_logic, pause_logic, resume_logic, format_time, start_optimization_worker
+import bisect
+import threading
+from .library import LibraryScanner, get_library_dir
+from .metrics import metrics
+from .events import bus, ALL_EVENTS, SESSIONS_CHANGED, CACHE_STATUS_CHANGED, QUEUE_CHANGED, SETTINGS_CHANGED, TRACK_STARTED, SEEKED, LAYERS_CHANGED, WAVEFORM_READY
+from .audio_engine import shared, list_sessions, play_audio_logic, play_next_logic, skip_logic, seek_logic, pause_logic, resume_logic, format_time, start_optimization_worker, get_playing_source, add_layer_logic, get_cache_path, start_waveform_build
+from .mixer import LayerMixer, MAX_VOLUME
+from .waveform import load_waveform, get_waveform_path
+from .transcoder import get_scheduler, PRIORITY_VISIBLE
+from .cache_manager import cache_summary_lines, collect_garbage
 
 # Set appearance mode
 ctk.set_appearance_mode("Dark")
@@ -27,6 +35,257 @@ FONT_MAIN = ("Segoe UI", 11)
 FONT_BOLD = ("Segoe UI", 11, "bold")
 FONT_STATUS = ("Segoe UI", 10)
 
+STATS_REFRESH_MS = 1000  # Stats panel refresh, only while it is shown
+PROGRESS_TICK_MS = 200  # Slider refresh while audio is playing; nothing ticks while idle or paused
+ROW_HEIGHT = 30
+WAVEFORM_HEIGHT = 40
+WAVEFORM_INSET = 8  # Horizontal inset of the slider's track, so the waveform lines up with it
+MIN_ZOOM_SECONDS = 2.0
+
+class VirtualTrackList(ctk.CTkFrame):
+    """
+    File list that only materializes buttons for the rows inside the viewport.
+    Row widgets are recycled while scrolling and single rows are updated in place,
+    so folders with tens of thousands of files open and filter without freezing the window.
+    """
+    def __init__(self, master, on_play, on_enqueue, on_hover=None):
+        super().__init__(master, fg_color=WIN_BG, corner_radius=0)
+        self.on_play = on_play
+        self.on_enqueue = on_enqueue
+        self.on_hover = on_hover
+        self.items = []      # Every audio file under the folder, relative to it
+        self.lowered = []    # Lowercased names for filtering
+        self.status = {}     # filename -> is_optimized (bool)
+        self.visible = []    # Indices into items that pass the filter
+        self.filter_text = ""
+        self.top = 0         # Index into visible of the first row on screen
+        self.rows = []       # Recycled row buttons
+        self.row_items = []  # Filename currently shown by each row
+
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar, fg_color=WIN_BG,
+                                          button_color=WIN_TOOLBAR, button_hover_color=WIN_SELECT)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.viewport = tk.Frame(self, bg=WIN_BG, highlightthickness=0)
+        self.viewport.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.viewport.bind("<Configure>", lambda event: self.render())
+        self.bind_wheel(self.viewport)
+
+    def bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self.scroll_rows(-1 if event.delta > 0 else 1) or "break")
+        widget.bind("<Button-4>", lambda event: self.scroll_rows(-1) or "break")  # X11
+        widget.bind("<Button-5>", lambda event: self.scroll_rows(1) or "break")
+
+    def row_text(self, filename):
+        status_text = "[Optimised]" if self.status.get(filename) is True else "[Pending]"
+        return f"   📄  {filename}   ({status_text})"
+
+    def set_items(self, filenames, status):
+        """Replaces the list contents (e.g. after a folder change) and scrolls back to the top."""
+        self.items = sorted(filenames, key=str.lower)
+        self.lowered = [f.lower() for f in self.items]
+        self.status = dict(status)
+        self.top = 0
+        self.apply_filter()
+
+    def add_items(self, filenames, status=None):
+        """Adds files to the list, keeping it sorted by name, with their already known status."""
+        if not filenames:
+            return
+        for filename, is_optimized in (status or {}).items():
+            if is_optimized is not None:
+                self.status.setdefault(filename, is_optimized)
+        known = set(self.items)
+        fresh = [f for f in filenames if f not in known]
+        if len(fresh) > 64:
+            self.items = sorted(self.items + fresh, key=str.lower)
+            self.lowered = [f.lower() for f in self.items]
+        else:
+            for filename in fresh:
+                i = bisect.bisect(self.lowered, filename.lower())
+                self.items.insert(i, filename)
+                self.lowered.insert(i, filename.lower())
+        self.apply_filter()
+
+    def remove_items(self, filenames):
+        """Removes files from the list."""
+        if not filenames:
+            return
+        gone = set(filenames)
+        keep = [i for i, f in enumerate(self.items) if f not in gone]
+        self.items = [self.items[i] for i in keep]
+        self.lowered = [self.lowered[i] for i in keep]
+        for filename in gone:
+            self.status.pop(filename, None)
+        self.apply_filter()
+
+    def set_filter(self, text):
+        """Shows only files whose name contains the text (case-insensitive)."""
+        self.filter_text = text.strip().lower()
+        self.top = 0
+        self.apply_filter()
+
+    def apply_filter(self):
+        needle = self.filter_text
+        if needle:
+            self.visible = [i for i, name in enumerate(self.lowered) if needle in name]
+        else:
+            self.visible = list(range(len(self.items)))
+        self.render()
+
+    def update_item(self, filename, is_optimized):
+        """Updates one file's status, redrawing only its row if it is on screen."""
+        self.status[filename] = is_optimized
+        for row, shown in zip(self.rows, self.row_items):
+            if shown == filename:
+                row.configure(text=self.row_text(filename))
+
+    def page_size(self):
+        return max(1, self.viewport.winfo_height() // ROW_HEIGHT)
+
+    def scroll_rows(self, delta):
+        self.scroll_to(self.top + delta * 3)
+
+    def scroll_to(self, top):
+        top = max(0, min(int(top), len(self.visible) - self.page_size()))
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(float(amount) * len(self.visible))
+        elif action == "scroll":
+            step = self.page_size() if unit == "pages" else 1
+            self.scroll_to(self.top + int(amount) * step)
+
+    def make_row(self, index):
+        row = ctk.CTkButton(self.viewport, text="", anchor="w", fg_color="transparent", text_color=WIN_TEXT,
+                            hover_color=WIN_HOVER, height=ROW_HEIGHT, font=FONT_MAIN, corner_radius=0,
+                            command=lambda: self.row_clicked(index, self.on_play))
+        row.bind("<Button-3>", lambda event: self.row_clicked(index, self.on_enqueue))
+        if self.on_hover:
+            row.bind("<Enter>", lambda event: self.row_clicked(index, self.on_hover))
+        self.bind_wheel(row)
+        return row
+
+    def row_clicked(self, index, callback):
+        if index < len(self.row_items) and self.row_items[index]:
+            callback(self.row_items[index])
+
+    def render(self):
+        """Points the recycled rows at the files in view; creates rows only when the viewport grows."""
+        needed = self.page_size() + 1
+        while len(self.rows) < needed:
+            self.rows.append(self.make_row(len(self.rows)))
+            self.row_items.append(None)
+
+        self.top = max(0, min(self.top, len(self.visible) - self.page_size()))
+        for i, row in enumerate(self.rows):
+            position = self.top + i
+            if i < needed and position < len(self.visible):
+                filename = self.items[self.visible[position]]
+                if self.row_items[i] != filename:
+                    self.row_items[i] = filename
+                    row.configure(text=self.row_text(filename))
+                row.place(x=0, y=i * ROW_HEIGHT, relwidth=1.0, height=ROW_HEIGHT)
+            elif self.row_items[i] is not None:
+                self.row_items[i] = None
+                row.place_forget()
+
+        total = len(self.visible)
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.page_size()) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+class WaveformView(tk.Canvas):
+    """
+    Peak/RMS overview of the playing track above the progress slider, drawn from the stored overview file:
+    no audio is decoded to draw it, at any zoom. The mouse wheel zooms around the pointer, a click seeks.
+    """
+    def __init__(self, master, on_seek):
+        super().__init__(master, height=WAVEFORM_HEIGHT, bg=WIN_BG, highlightthickness=0, borderwidth=0)
+        self.on_seek = on_seek
+        self.waveform = None
+        self.duration = 0.0
+        self.view_start = 0.0
+        self.view_span = 0.0  # Seconds on screen
+        self.position = 0.0
+        self.bars = []  # Canvas line ids per column: (peak, rms)
+        self.played = 0  # Columns drawn in the played colour
+        self.bind("<Configure>", lambda event: self.redraw())
+        self.bind("<Button-1>", self.on_click)
+        self.bind("<MouseWheel>", lambda event: self.zoom(event.x, 0.8 if event.delta > 0 else 1.25))
+        self.bind("<Button-4>", lambda event: self.zoom(event.x, 0.8))  # X11 wheel
+        self.bind("<Button-5>", lambda event: self.zoom(event.x, 1.25))
+
+    def set_waveform(self, waveform, duration):
+        self.waveform = waveform
+        self.duration = duration or (waveform.duration if waveform else 0.0)
+        self.view_start = 0.0
+        self.view_span = self.duration
+        self.redraw()
+
+    def columns(self):
+        return max(self.winfo_width() - 2 * WAVEFORM_INSET, 1)
+
+    def x_to_time(self, x):
+        return self.view_start + min(max(x - WAVEFORM_INSET, 0), self.columns()) / self.columns() * self.view_span
+
+    def redraw(self):
+        self.delete("all")
+        self.bars = []
+        self.played = 0
+        if not self.waveform or self.view_span <= 0:
+            return
+        width = self.columns()
+        peaks, rms = self.waveform.columns(self.view_start, self.view_start + self.view_span, width)
+        middle = WAVEFORM_HEIGHT / 2
+        for i in range(width):
+            x = WAVEFORM_INSET + i
+            peak = max(peaks[i] * middle, 0.5)
+            level = rms[i] * middle
+            self.bars.append((self.create_line(x, middle - peak, x, middle + peak, fill=WIN_BORDER),
+                              self.create_line(x, middle - level, x, middle + level, fill=WIN_MUTED)))
+        self.update_played()
+
+    def set_position(self, position):
+        self.position = position
+        if self.view_span < self.duration and not (self.view_start <= position < self.view_start + self.view_span):
+            # Zoomed in: page along with the playhead
+            self.view_start = min(max(position - self.view_span * 0.1, 0.0), self.duration - self.view_span)
+            self.redraw()
+        else:
+            self.update_played()
+
+    def update_played(self):
+        """Recolours only the columns the playhead moved across."""
+        if not self.bars:
+            return
+        played = int((self.position - self.view_start) / self.view_span * len(self.bars))
+        played = min(max(played, 0), len(self.bars))
+        low, high = sorted((self.played, played))
+        colours = (WIN_ACCENT, WIN_TEXT) if played > self.played else (WIN_BORDER, WIN_MUTED)
+        for peak_line, rms_line in self.bars[low:high]:
+            self.itemconfigure(peak_line, fill=colours[0])
+            self.itemconfigure(rms_line, fill=colours[1])
+        self.played = played
+
+    def zoom(self, x, factor):
+        if not self.waveform or self.duration <= 0:
+            return "break"
+        anchor = self.x_to_time(x)
+        span = min(max(self.view_span * factor, MIN_ZOOM_SECONDS), self.duration)
+        share = (anchor - self.view_start) / self.view_span if self.view_span else 0.0
+        self.view_start = min(max(anchor - share * span, 0.0), self.duration - span)
+        self.view_span = span
+        self.redraw()
+        return "break"
+
+    def on_click(self, event):
+        if self.waveform and self.duration > 0:
+            self.on_seek(self.x_to_time(event.x))
+
 class PhonographGUI:
     def __init__(self, root, bot):
         self.root = root
@@ -35,9 +294,12 @@ class PhonographGUI:
         self.root.geometry("900x650") 
         self.root.configure(fg_color=WIN_BG)
         
-        self.current_dir = os.getcwd()
-        self.file_list = [] # Store raw filenames
-        self.track_buttons = {} # filename -> ctk button
+        self.current_dir = get_library_dir()
+        self.scanner = None # Recursive watcher of the current folder
+        self.filter_job = None # Pending debounced search
+        self.progress_job = None # Pending slider tick, only scheduled while audio plays
+        self.is_seeking = False # Slider is being dragged
+        self.stats_job = None # Pending stats panel refresh
         
         # Toolbar Row (Mimics Explorer Ribbon/Address Bar)
         self.toolbar = ctk.CTkFrame(root, height=50, fg_color=WIN_TOOLBAR, corner_radius=0, border_width=1, border_color=WIN_BORDER)
@@ -46,6 +308,17 @@ class PhonographGUI:
         # Branding / "Logo"
         self.title_label = ctk.CTkLabel(self.toolbar, text="Phonograph", font=FONT_BOLD, text_color=WIN_TEXT)
         self.title_label.pack(side=tk.LEFT, padx=(20, 30), pady=12)
+
+        # Guild Session Picker (one playback session per server)
+        self.session_labels = {}  # menu label -> guild id
+        self.session_var = tk.StringVar(value="No session")
+        self.session_menu = ctk.CTkOptionMenu(self.toolbar, variable=self.session_var, values=["No session"],
+                                              width=150, height=26, font=FONT_MAIN, corner_radius=0,
+                                              fg_color=WIN_BG, button_color=WIN_BG, button_hover_color=WIN_HOVER,
+                                              text_color=WIN_TEXT, dropdown_fg_color=WIN_TOOLBAR,
+                                              dropdown_hover_color=WIN_HOVER, dropdown_text_color=WIN_TEXT,
+                                              command=self.on_session_selected)
+        self.session_menu.pack(side=tk.LEFT, padx=(0, 10), pady=12)
         
         # Address Bar Style Folder Info (Usable)
         self.address_frame = ctk.CTkFrame(self.toolbar, fg_color=WIN_BG, height=30, corner_radius=0, border_width=1, border_color=WIN_BORDER)
@@ -60,6 +333,13 @@ class PhonographGUI:
         self.address_entry.insert(0, self.current_dir)
         self.address_entry.bind("<Return>", self.on_address_enter)
         
+        # Search Box (Explorer Style, filters as you type)
+        self.search_entry = ctk.CTkEntry(self.toolbar, placeholder_text="🔍 Search", width=160, height=28,
+                                         fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER, font=FONT_MAIN,
+                                         text_color=WIN_TEXT, corner_radius=0)
+        self.search_entry.pack(side=tk.LEFT, padx=(5, 0), pady=10)
+        self.search_entry.bind("<KeyRelease>", self.on_search_changed)
+
         self.btn_change_dir = ctk.CTkButton(self.toolbar, text="Browse", width=80, height=26, 
                                             fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER,
                                             hover_color=WIN_HOVER, text_color=WIN_TEXT, command=self.change_directory,
@@ -84,7 +364,13 @@ class PhonographGUI:
         self.btn_pause = ctk.CTkButton(self.toolbar, text="Pause", width=80, height=28, 
                                        command=self.toggle_pause_resume, fg_color=WIN_ACCENT, 
                                        hover_color="#1E90FF", text_color=WIN_TEXT, font=FONT_BOLD, corner_radius=0)
-        self.btn_pause.pack(side=tk.LEFT, padx=(15, 20), pady=12)
+        self.btn_pause.pack(side=tk.LEFT, padx=(15, 10), pady=12)
+
+        self.btn_stats = ctk.CTkButton(self.toolbar, text="Stats", width=60, height=26,
+                                       fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER,
+                                       hover_color=WIN_HOVER, text_color=WIN_TEXT, command=self.toggle_stats,
+                                       font=FONT_MAIN, corner_radius=0)
+        self.btn_stats.pack(side=tk.LEFT, padx=(0, 20), pady=12)
         
         # Progress Bar Section (Status Bar Style)
         self.progress_frame = ctk.CTkFrame(root, height=30, fg_color=WIN_BG, corner_radius=0)
@@ -93,170 +379,525 @@ class PhonographGUI:
         self.time_label = ctk.CTkLabel(self.progress_frame, text="00:00 / 00:00", font=FONT_MAIN, text_color=WIN_MUTED)
         self.time_label.pack(side=tk.LEFT, padx=15)
         
-        self.progress_scale = ctk.CTkSlider(self.progress_frame, from_=0, to=100, command=self.on_slider_move, 
+        # Waveform overview (shown once the playing track has one) stacked on the slider's time axis
+        self.scrub_frame = ctk.CTkFrame(self.progress_frame, fg_color="transparent", corner_radius=0)
+        self.scrub_frame.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(15, 25))
+        self.waveform_view = WaveformView(self.scrub_frame, on_seek=self.seek_to)
+        self.waveform_track = None  # Track the overview was loaded for
+
+        self.progress_scale = ctk.CTkSlider(self.scrub_frame, from_=0, to=100, command=self.on_slider_move, 
                                             height=16, progress_color=WIN_ACCENT, button_color=WIN_ACCENT, 
                                             button_hover_color=WIN_ACCENT, fg_color=WIN_TOOLBAR, corner_radius=0)
-        self.progress_scale.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(15, 25))
+        self.progress_scale.pack(side=tk.BOTTOM, fill=tk.X)
         self.progress_scale.set(0)
         self.progress_scale.bind("<ButtonPress-1>", self.on_slider_press)
         self.progress_scale.bind("<ButtonRelease-1>", self.on_slider_release)
 
-        # Track List (File List Style)
-        self.scroll_frame = ctk.CTkScrollableFrame(root, fg_color=WIN_BG, corner_radius=0, 
-                                                   scrollbar_button_color=WIN_TOOLBAR, 
-                                                   scrollbar_button_hover_color=WIN_SELECT)
-        self.scroll_frame.pack(pady=0, padx=0, fill=tk.BOTH, expand=True)
+        self.content_frame = ctk.CTkFrame(root, fg_color=WIN_BG, corner_radius=0)
+        self.content_frame.pack(pady=0, padx=0, fill=tk.BOTH, expand=True)
+
+        # Stats Panel (hidden until the Stats button is pressed)
+        self.stats_frame = ctk.CTkFrame(root, fg_color=WIN_TOOLBAR, corner_radius=0, border_width=1, border_color=WIN_BORDER)
+        self.stats_label = ctk.CTkLabel(self.stats_frame, text="", font=("Consolas", 10), text_color=WIN_MUTED,
+                                        justify="left", anchor="w")
+        self.stats_label.pack(fill=tk.X, padx=12, pady=6)
+        self.cache_row = ctk.CTkFrame(self.stats_frame, fg_color="transparent", corner_radius=0)
+        self.cache_row.pack(fill=tk.X, padx=12, pady=(0, 6))
+        self.cache_label = ctk.CTkLabel(self.cache_row, text="", font=("Consolas", 10), text_color=WIN_MUTED,
+                                        justify="left", anchor="w")
+        self.cache_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.btn_clean_cache = ctk.CTkButton(self.cache_row, text="Clean Cache", width=90, height=24,
+                                             fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER,
+                                             hover_color=WIN_HOVER, text_color=WIN_TEXT, command=self.clean_cache,
+                                             font=FONT_MAIN, corner_radius=0)
+        self.btn_clean_cache.pack(side=tk.RIGHT)
+
+        # Queue Panel (Explorer "Details Pane" Style)
+        self.queue_frame = ctk.CTkFrame(self.content_frame, width=260, fg_color=WIN_TOOLBAR, corner_radius=0,
+                                        border_width=1, border_color=WIN_BORDER)
+        self.queue_frame.pack(side=tk.RIGHT, fill=tk.Y)
+        self.queue_frame.pack_propagate(False)
+
+        self.queue_title = ctk.CTkLabel(self.queue_frame, text="Up Next", font=FONT_BOLD, text_color=WIN_TEXT)
+        self.queue_title.pack(anchor="w", padx=12, pady=(8, 4))
+
+        self.queue_listbox = tk.Listbox(self.queue_frame, bg=WIN_BG, fg=WIN_TEXT, selectbackground=WIN_SELECT,
+                                        selectforeground=WIN_TEXT, highlightthickness=0, borderwidth=0,
+                                        activestyle="none", font=FONT_MAIN)
+        self.queue_listbox.pack(fill=tk.BOTH, expand=True, padx=8, pady=4)
+        self.queue_snapshot = []
+
+        self.queue_buttons = ctk.CTkFrame(self.queue_frame, fg_color="transparent")
+        self.queue_buttons.pack(fill=tk.X, padx=8, pady=4)
+        for text, command in (("▲", lambda: self.move_queued(-1)), ("▼", lambda: self.move_queued(1)),
+                              ("✕", self.remove_queued), ("Shuffle", self.shuffle_queue), ("Skip", self.skip_track)):
+            ctk.CTkButton(self.queue_buttons, text=text, width=36 if len(text) == 1 else 60, height=26,
+                          fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER, hover_color=WIN_HOVER,
+                          text_color=WIN_TEXT, font=FONT_MAIN, corner_radius=0,
+                          command=command).pack(side=tk.LEFT, padx=2)
+
+        self.queue_options = ctk.CTkFrame(self.queue_frame, fg_color="transparent")
+        self.queue_options.pack(fill=tk.X, padx=8, pady=(0, 8))
+        self.repeat_var = tk.BooleanVar(value=False)
+        self.repeat_check = ctk.CTkCheckBox(self.queue_options, text="Repeat all", width=20, variable=self.repeat_var,
+                                            command=self.toggle_repeat_all, font=FONT_MAIN,
+                                            text_color=WIN_TEXT, hover_color=WIN_ACCENT, border_color=WIN_MUTED,
+                                            fg_color=WIN_ACCENT, checkmark_color=WIN_TEXT, corner_radius=0)
+        self.repeat_check.pack(side=tk.LEFT, padx=(4, 10))
+        self.crossfade_var = tk.StringVar(value="No fade")
+        self.crossfade_menu = ctk.CTkOptionMenu(self.queue_options, variable=self.crossfade_var,
+                                                values=["No fade", "2s fade", "4s fade", "8s fade"],
+                                                command=self.set_crossfade, width=90, height=26, font=FONT_MAIN,
+                                                corner_radius=0, fg_color=WIN_BG, button_color=WIN_BG,
+                                                button_hover_color=WIN_HOVER, text_color=WIN_TEXT,
+                                                dropdown_fg_color=WIN_TOOLBAR, dropdown_hover_color=WIN_HOVER,
+                                                dropdown_text_color=WIN_TEXT)
+        self.crossfade_menu.pack(side=tk.LEFT)
+
+        # Sound Layers (ambience and effects mixed over the music)
+        self.layers_title = ctk.CTkLabel(self.queue_frame, text="Layers", font=FONT_BOLD, text_color=WIN_TEXT)
+        self.layers_title.pack(anchor="w", padx=12, pady=(4, 2))
+        self.layers_list = ctk.CTkFrame(self.queue_frame, fg_color="transparent")
+        self.layers_list.pack(fill=tk.X, padx=8)
+        self.layer_rows = {}  # layer name -> (volume slider, loop variable)
+        self.layer_names = []
+        self.layer_buttons = ctk.CTkFrame(self.queue_frame, fg_color="transparent")
+        self.layer_buttons.pack(fill=tk.X, padx=8, pady=(2, 8))
+        for text, command in (("+ Ambience", lambda: self.add_layer(loop=True)),
+                              ("+ SFX", lambda: self.add_layer(loop=False))):
+            ctk.CTkButton(self.layer_buttons, text=text, width=90, height=26,
+                          fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER, hover_color=WIN_HOVER,
+                          text_color=WIN_TEXT, font=FONT_MAIN, corner_radius=0,
+                          command=command).pack(side=tk.LEFT, padx=2)
+
+        # Track List (File List Style, virtualized)
+        self.track_list = VirtualTrackList(self.content_frame, on_play=self.play_track, on_enqueue=self.enqueue_track,
+                                           on_hover=self.on_track_hover)
+        self.track_list.pack(side=tk.LEFT, pady=0, padx=0, fill=tk.BOTH, expand=True)
         
         self.status_label = ctk.CTkLabel(root, text=" 🟢 Ready", text_color=WIN_MUTED, font=FONT_STATUS)
         self.status_label.pack(side=tk.BOTTOM, anchor="w", padx=15, pady=2)
         
+        # Engine events arrive on whichever thread caused them; handle them on the Tk thread
+        bus.subscribe(ALL_EVENTS, lambda event, payload: self.root.after(0, self.on_engine_event, event, payload))
+        self.refresh_sessions()
+        self.on_session_selected()
+
+        # Scan the folder (and start initial optimization as files are found)
         self.refresh_list()
-        
-        # Start initial optimization
-        start_optimization_worker(self.current_dir, self.on_audio_optimized)
-        
-        # Periodic Tasks
-        self.sync_loop_state()
+
+    @property
+    def session(self):
+        """The guild session the GUI currently controls, or None if the bot is not in any voice channel."""
+        guild_id = self.session_labels.get(self.session_var.get())
+        for session in list_sessions():
+            if session.guild_id == guild_id:
+                return session
+        return None
+
+    def refresh_sessions(self):
+        """Keeps the session picker in step with the guilds the bot is connected to."""
+        labels = {(s.guild_name or str(s.guild_id)): s.guild_id for s in list_sessions()}
+        if labels != self.session_labels:
+            self.session_labels = labels
+            self.session_menu.configure(values=list(labels) or ["No session"])
+            if self.session_var.get() not in labels:
+                self.session_var.set(next(iter(labels), "No session"))
+
+    def on_engine_event(self, event, payload):
+        """Applies a playback engine event to the widgets it affects."""
+        if event == SESSIONS_CHANGED:
+            self.refresh_sessions()
+            self.on_session_selected()
+            return
+        if event == CACHE_STATUS_CHANGED:
+            self.on_audio_optimized(payload['filepath'], payload['optimized'])
+            return
+        if event == WAVEFORM_READY:
+            if self.waveform_track and os.path.abspath(payload['filepath']) == os.path.abspath(self.waveform_track):
+                self.load_waveform(self.waveform_track, force=True)
+            return
+        if payload.get('session') is not self.session:
+            return  # Another guild
+        if event == QUEUE_CHANGED:
+            self.sync_controls()
+            self.refresh_queue()
+        elif event == SETTINGS_CHANGED:
+            self.sync_controls()
+        elif event == LAYERS_CHANGED:
+            self.refresh_layers()
+        else:
+            if event in (TRACK_STARTED, SEEKED):
+                self.is_seeking = False  # A pending slider seek has landed
+            if event == TRACK_STARTED:
+                self.load_waveform(payload.get('filepath'))
+            self.update_ui_progress()
+
+    def on_session_selected(self, choice=None):
+        """Redraws everything that depends on the selected session."""
+        self.sync_controls()
+        self.refresh_queue()
+        self.refresh_layers()
+        session = self.session
+        self.load_waveform(session.current_track_path if session else None)
         self.update_ui_progress()
 
-    def sync_loop_state(self):
-        if self.loop_var.get() != state.is_looping:
-            self.loop_var.set(state.is_looping)
-        if self.norm_var.get() != state.is_normalized:
-            self.norm_var.set(state.is_normalized)
-        self.root.after(500, self.sync_loop_state)
+    def sync_controls(self):
+        """Mirrors the selected session's settings into the toolbar and queue panel controls."""
+        session = self.session
+        if not session:
+            return
+        if self.loop_var.get() != session.is_looping:
+            self.loop_var.set(session.is_looping)
+        if self.norm_var.get() != session.is_normalized:
+            self.norm_var.set(session.is_normalized)
+        if self.repeat_var.get() != session.queue.repeat_all:
+            self.repeat_var.set(session.queue.repeat_all)
+        fade = f"{session.crossfade_seconds:g}s fade" if session.crossfade_seconds else "No fade"
+        if self.crossfade_var.get() != fade:
+            self.crossfade_var.set(fade)
+
+    def refresh_queue(self):
+        """Redraws the queue panel when the selected session's queue changed."""
+        session = self.session
+        tracks = session.queue.snapshot() if session else []
+        if tracks == self.queue_snapshot:
+            return
+        selection = self.queue_listbox.curselection()
+        self.queue_snapshot = tracks
+        self.queue_listbox.delete(0, tk.END)
+        for i, path in enumerate(tracks, start=1):
+            self.queue_listbox.insert(tk.END, f" {i}. {os.path.basename(path)}")
+        if selection and selection[0] < len(tracks):
+            self.queue_listbox.selection_set(selection[0])
+
+    def refresh_layers(self):
+        """Mirrors the selected session's sound layers; rows are only rebuilt when layers come or go."""
+        session = self.session
+        layers = session.mixer.snapshot() if session else []
+        names = [name for name, _, _, _, _ in layers]
+        if names != self.layer_names:
+            self.layer_names = names
+            for row in self.layers_list.winfo_children():
+                row.destroy()
+            self.layer_rows = {}
+            for name, filepath, volume, loop, duck in layers:
+                self.make_layer_row(name)
+        for name, filepath, volume, loop, duck in layers:
+            slider, loop_var = self.layer_rows[name]
+            if abs(slider.get() - volume) > 0.01:
+                slider.set(volume)
+            if loop_var.get() != loop:
+                loop_var.set(loop)
+
+    def make_layer_row(self, name):
+        row = ctk.CTkFrame(self.layers_list, fg_color="transparent")
+        row.pack(fill=tk.X, pady=1)
+        ctk.CTkLabel(row, text=name, width=70, anchor="w", font=FONT_MAIN, text_color=WIN_TEXT).pack(side=tk.LEFT, padx=(4, 2))
+        slider = ctk.CTkSlider(row, from_=0, to=MAX_VOLUME, width=80, height=14, progress_color=WIN_ACCENT,
+                               button_color=WIN_ACCENT, button_hover_color=WIN_ACCENT, fg_color=WIN_BG,
+                               command=lambda value: self.session and self.session.mixer.set_volume(name, value))
+        slider.pack(side=tk.LEFT, padx=2)
+        loop_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(row, text="Loop", width=20, variable=loop_var, font=FONT_MAIN,
+                        command=lambda: self.session and self.session.mixer.set_loop(name, loop_var.get()),
+                        text_color=WIN_TEXT, hover_color=WIN_ACCENT, border_color=WIN_MUTED,
+                        fg_color=WIN_ACCENT, checkmark_color=WIN_TEXT, corner_radius=0).pack(side=tk.LEFT, padx=2)
+        ctk.CTkButton(row, text="✕", width=26, height=22, fg_color=WIN_BG, border_width=1, border_color=WIN_BORDER,
+                      hover_color=WIN_HOVER, text_color=WIN_TEXT, font=FONT_MAIN, corner_radius=0,
+                      command=lambda: self.session and self.session.mixer.remove(name, fade_out=0.5)).pack(side=tk.RIGHT, padx=2)
+        self.layer_rows[name] = (slider, loop_var)
+
+    def add_layer(self, loop):
+        """Picks a file and starts it as a looping ambience layer, or as a one-shot ducking sound effect."""
+        session = self.session
+        if not session:
+            self.show_status(" ⚠️  Use !join in a voice channel first", WIN_WARNING)
+            return
+        if not LayerMixer.available():
+            self.show_status(" ⚠️  Sound layers need NumPy (pip install numpy)", WIN_WARNING)
+            return
+        filepath = filedialog.askopenfilename(initialdir=self.current_dir, title="Select Ambience" if loop else "Select Sound Effect")
+        if filepath:
+            coro = add_layer_logic(session, filepath, loop=loop, duck=not loop, fade_in=1.0 if loop else 0.0)
+            asyncio.run_coroutine_threadsafe(coro, self.bot.loop)
+
+    def enqueue_track(self, filename):
+        """Called when a track is right-clicked: adds it to the selected session's queue."""
+        session = self.session
+        if not session:
+            self.show_status(" ⚠️  Use !join in a voice channel first", WIN_WARNING)
+            return
+        session.queue.add(os.path.join(self.current_dir, filename))
+        self.show_status(f" ➕  Queued {filename}", WIN_MUTED)
+        vc = session.current_voice_client
+        if vc and get_playing_source(session) is None:
+            asyncio.run_coroutine_threadsafe(play_next_logic(self.bot, session), self.bot.loop)
+        self.refresh_queue()
+
+    def move_queued(self, offset):
+        session = self.session
+        selection = self.queue_listbox.curselection()
+        if not session or not selection:
+            return
+        index = selection[0]
+        new_index = index + offset
+        if 0 <= new_index < len(self.queue_snapshot):
+            session.queue.move(index, new_index)
+            self.refresh_queue()
+            self.queue_listbox.selection_clear(0, tk.END)
+            self.queue_listbox.selection_set(new_index)
+
+    def remove_queued(self):
+        session = self.session
+        selection = self.queue_listbox.curselection()
+        if session and selection:
+            try:
+                session.queue.remove(selection[0])
+            except IndexError:
+                pass
+            self.refresh_queue()
+
+    def shuffle_queue(self):
+        if self.session:
+            self.session.queue.shuffle()
+            self.refresh_queue()
+
+    def skip_track(self):
+        if self.session:
+            asyncio.run_coroutine_threadsafe(skip_logic(self.bot, self.session), self.bot.loop)
+
+    def toggle_repeat_all(self):
+        if self.session:
+            self.session.queue.set_repeat_all(self.repeat_var.get())
+
+    def set_crossfade(self, choice):
+        if self.session:
+            self.session.configure(crossfade_seconds=0.0 if choice == "No fade" else float(choice.split("s")[0]))
 
     def update_ui_progress(self):
-        """Updates the slider and time label based on playback state."""
-        vc = state.current_voice_client
-        if vc and (vc.is_playing() or vc.is_paused()):
-            # Update button text based on state
-            if vc.is_paused():
-                self.btn_pause.configure(text="Play")
-            else:
-                self.btn_pause.configure(text="Pause")
-
-            if vc.is_playing() and not state.is_seeking:
-                current_time = time.time()
-                played_seconds = (current_time - state.start_playback_time) + state.elapsed_offset
-                
-                # Update slider range only if total duration changed
-                if state.total_duration > 0:
-                    try:
-                        if self.progress_scale.cget("to") != state.total_duration:
-                            self.progress_scale.configure(to=state.total_duration)
-                        self.progress_scale.set(played_seconds)
-                        self.time_label.configure(text=f"{format_time(played_seconds)} / {format_time(state.total_duration)}")
-                    except Exception:
-                        pass
-        elif not vc or not vc.is_playing():
-             if not state.is_looping:
-                self.time_label.configure(text=f"00:00 / {format_time(state.total_duration)}")
-                self.progress_scale.set(0)
-                self.btn_pause.configure(text="Pause")
-
-        self.root.after(500, self.update_ui_progress)
+        """
+        Redraws the slider and time label from the session's monotonic clock.
+        Called on playback events; keeps ticking by itself only while audio is actually playing.
+        """
+        if self.progress_job:
+            self.root.after_cancel(self.progress_job)
+            self.progress_job = None
+        session = self.session
+        position, duration, playing, paused = session.progress() if session else (0.0, 0.0, False, False)
+
+        pause_text = "Play" if paused else "Pause"
+        if self.btn_pause.cget("text") != pause_text:
+            self.btn_pause.configure(text=pause_text)
+
+        if not self.is_seeking:
+            if duration > 0 and self.progress_scale.cget("to") != duration:
+                self.progress_scale.configure(to=duration)
+            self.progress_scale.set(position)
+            self.waveform_view.set_position(position)
+            self.time_label.configure(text=f"{format_time(position)} / {format_time(duration)}")
+
+        if playing and not paused:
+            self.progress_job = self.root.after(PROGRESS_TICK_MS, self.update_ui_progress)
 
     def toggle_pause_resume(self):
         """Toggles pause/resume state."""
-        vc = state.current_voice_client
+        session = self.session
+        vc = session.current_voice_client if session else None
         if vc:
             if vc.is_playing():
-                asyncio.run_coroutine_threadsafe(pause_logic(), self.bot.loop)
+                asyncio.run_coroutine_threadsafe(pause_logic(session), self.bot.loop)
             elif vc.is_paused():
-                asyncio.run_coroutine_threadsafe(resume_logic(), self.bot.loop)
+                asyncio.run_coroutine_threadsafe(resume_logic(session), self.bot.loop)
 
     def on_slider_move(self, value):
         # We handle seeking on release to prevent stutter
         pass
 
     def on_slider_press(self, event):
-        state.is_seeking = True
+        self.is_seeking = True
 
     def on_slider_release(self, event):
-        new_seconds = self.progress_scale.get()
-        # Update logic immediately before allowing UI updates to resume
-        if state.current_track_path:
-            # First trigger the audio change
-            asyncio.run_coroutine_threadsafe(play_audio_logic(self.bot, state.current_track_path, seek_to=new_seconds), self.bot.loop)
-        
-        # Short delay to let audio start before resuming UI bar updates
-        self.root.after(100, lambda: self.reset_seeking_flag())
+        self.seek_to(self.progress_scale.get())
+
+    def seek_to(self, new_seconds):
+        """Seeks the selected session, from the slider or a click on the waveform."""
+        self.is_seeking = True
+        session = self.session
+        if session and session.current_track_path:
+            # The slider stays where it was dropped until the seeked/started event arrives
+            asyncio.run_coroutine_threadsafe(seek_logic(self.bot, session, new_seconds), self.bot.loop)
+            self.root.after(1000, self.reset_seeking_flag)  # In case the seek failed
+        else:
+            self.reset_seeking_flag()
 
     def reset_seeking_flag(self):
-        state.is_seeking = False
+        if self.is_seeking:
+            self.is_seeking = False
+            self.update_ui_progress()
+
+    def load_waveform(self, filepath, force=False):
+        """Shows the stored overview of a track above the slider, reading it off the Tk thread."""
+        if filepath == self.waveform_track and not force:
+            return
+        self.waveform_track = filepath
+        if not filepath:
+            self.show_waveform(None, None)
+            return
+
+        def load():
+            waveform = load_waveform(get_waveform_path(get_cache_path(filepath)))
+            if waveform is None:
+                # Cached before overviews existed: WAVEFORM_READY brings it here once built
+                start_waveform_build(filepath)
+            self.root.after(0, self.show_waveform, filepath, waveform)
+        threading.Thread(target=load, daemon=True).start()
+
+    def show_waveform(self, filepath, waveform):
+        if filepath != self.waveform_track:
+            return  # Another track started meanwhile
+        if waveform is None:
+            self.waveform_view.pack_forget()
+            self.waveform_view.set_waveform(None, 0.0)
+            return
+        if not self.waveform_view.winfo_ismapped():
+            self.waveform_view.pack(side=tk.TOP, fill=tk.X, before=self.progress_scale)
+        session = self.session
+        self.waveform_view.set_waveform(waveform, session.progress()[1] if session else 0.0)
+        self.waveform_view.set_position(session.position() if session else 0.0)
+
+    def toggle_stats(self):
+        """Shows or hides the stats panel above the file list."""
+        if self.stats_job:
+            self.root.after_cancel(self.stats_job)
+            self.stats_job = None
+        if self.stats_frame.winfo_ismapped():
+            self.stats_frame.pack_forget()
+        else:
+            self.stats_frame.pack(fill=tk.X, padx=10, pady=(0, 5), before=self.content_frame)
+            self.refresh_stats()
+            self.refresh_cache_stats()
+
+    def refresh_stats(self):
+        self.stats_label.configure(text="\n".join(metrics.summary_lines()))
+        self.stats_job = self.root.after(STATS_REFRESH_MS, self.refresh_stats)
+
+    def refresh_cache_stats(self, clean=False):
+        """Fills in the cache line of the stats panel; the cache folder is scanned off the Tk thread."""
+        def work():
+            if clean:
+                collect_garbage()
+            text = "\n".join(cache_summary_lines())
+            self.root.after(0, lambda: self.cache_label.configure(text=text))
+        threading.Thread(target=work, daemon=True).start()
+
+    def clean_cache(self):
+        self.cache_label.configure(text="Cleaning cache...")
+        self.refresh_cache_stats(clean=True)
 
     def toggle_loop(self):
-        state.is_looping = self.loop_var.get()
+        if self.session:
+            self.session.configure(is_looping=self.loop_var.get())
 
     def toggle_normalization(self):
-        state.is_normalized = self.norm_var.get()
+        if self.session:
+            self.session.configure(is_normalized=self.norm_var.get())
 
     def refresh_list(self):
-        # Clear frame
-        for widget in self.scroll_frame.winfo_children():
-            widget.destroy()
-        
-        self.track_buttons = {}
-        self.file_list = get_audio_files(self.current_dir)
-        
-        for f in self.file_list:
-            status = state.optimized_files.get(f, "Pending")
-            status_text = "[Optimised]" if status is True else "[Pending]"
-            status_color = WIN_GREEN if status is True else WIN_MUTED
-            
-            btn = ctk.CTkButton(self.scroll_frame, 
-                                text=f"   📄  {f}   ({status_text})", 
-                                anchor="w",
-                                fg_color="transparent",
-                                text_color=WIN_TEXT,
-                                hover_color=WIN_HOVER,
-                                height=30,
-                                font=FONT_MAIN,
-                                corner_radius=0,
-                                command=lambda fname=f: self.play_track(fname))
-            btn.pack(fill=tk.X, pady=0, padx=0) # Flush list
-            self.track_buttons[f] = btn
+        """Starts a recursive scan of the current folder; the list fills in from its change deltas."""
+        if self.scanner:
+            self.scanner.stop()
+            # Transcodes queued for the previous folder are superseded
+            get_scheduler().cancel_owner(self.scanner)
+        self.track_list.set_items([], {})
+
+        scanner = LibraryScanner(self.current_dir, lambda *changes: self.on_library_changes(scanner, *changes))
+        self.scanner = scanner.start()
             
         # Update address bar
         self.address_entry.delete(0, tk.END)
         self.address_entry.insert(0, self.current_dir)
 
+    def on_library_changes(self, scanner, added, modified, removed):
+        """Called from the scanner thread with the files that appeared, changed or vanished."""
+        if scanner is not self.scanner:
+            return  # Folder changed since this scanner started
+        root = scanner.root
+
+        def apply():
+            if scanner is not self.scanner:
+                return
+            # Statuses reported before a file was listed are not reported again
+            self.track_list.add_items([os.path.relpath(path, root) for path in added],
+                                      {os.path.relpath(path, root): shared.optimized_files.get(path) for path in added})
+            self.track_list.remove_items([os.path.relpath(path, root) for path in removed])
+            for path in modified:
+                self.track_list.update_item(os.path.relpath(path, root), False)
+        self.root.after(0, apply)
+
+        for path in removed:
+            shared.optimized_files.pop(path, None)
+        if removed:
+            get_scheduler().cancel(removed)
+        # New and replaced files go straight to the optimization worker, ahead of background work
+        if added or modified:
+            start_optimization_worker(added + modified, PRIORITY_VISIBLE, owner=scanner)
+
+    def on_search_changed(self, event=None):
+        """Debounces typing in the search box so long lists are only filtered once per pause."""
+        if self.filter_job:
+            self.root.after_cancel(self.filter_job)
+        self.filter_job = self.root.after(120, self.apply_search)
+
+    def apply_search(self):
+        self.filter_job = None
+        self.track_list.set_filter(self.search_entry.get())
+
     def play_track(self, filename):
         """Called when a track button is clicked."""
+        session = self.session
+        if not session:
+            self.show_status(" ⚠️  Use !join in a voice channel first", WIN_WARNING)
+            return
         filepath = os.path.join(self.current_dir, filename)
-        asyncio.run_coroutine_threadsafe(play_audio_logic(self.bot, filepath), self.bot.loop)
+        asyncio.run_coroutine_threadsafe(play_audio_logic(self.bot, session, filepath), self.bot.loop)
 
-    def on_audio_optimized(self, filename, is_optimized):
-        """Callback from the optimization worker."""
-        if filename in self.track_buttons:
-            status_text = "[Optimised]" if is_optimized else "[Pending]"
-            # schedule this on the main thread
-            self.root.after(0, lambda: self.track_buttons[filename].configure(
-                text=f"   📄  {filename}   ({status_text})"
-            ))
+    def on_track_hover(self, filename):
+        """Hovering a pending track moves its transcode to the front of the queue."""
+        if self.track_list.status.get(filename) is not True:
+            get_scheduler().promote(os.path.join(self.scanner.root if self.scanner else self.current_dir, filename), "hover")
+
+    def on_audio_optimized(self, filepath, is_optimized):
+        """Updates a track's status marker once the optimization worker reports it."""
+        root = os.path.abspath(self.current_dir)
+        filepath = os.path.abspath(filepath)
+        try:
+            if os.path.commonpath([filepath, root]) != root:
+                return  # Not in the folder on screen
+        except ValueError:
+            return  # On another drive (Windows)
+        self.track_list.update_item(os.path.relpath(filepath, root), is_optimized)
 
     def change_directory(self):
         new_dir = filedialog.askdirectory(initialdir=self.current_dir, title="Select Music Folder")
         if new_dir:
             self.current_dir = new_dir
-            # Reset state for new folder
-            state.optimized_files = {}
             self.refresh_list()
-            start_optimization_worker(self.current_dir, self.on_audio_optimized)
 
     def on_address_enter(self, event=None):
         """Called when Enter is pressed in the address bar."""
         new_path = self.address_entry.get().strip()
         if os.path.isdir(new_path):
             self.current_dir = new_path
-            state.optimized_files = {}
             self.refresh_list()
-            start_optimization_worker(self.current_dir, self.on_audio_optimized)
         else:
             # Revert to current valid path
             self.address_entry.delete(0, tk.END)
             self.address_entry.insert(0, self.current_dir)
             # Subtle status update
-            self.status_label.configure(text=" ⚠️  Invalid Path", text_color=WIN_WARNING)
-            self.root.after(2000, lambda: self.status_label.configure(text=" 🟢 Ready", text_color=WIN_MUTED))
+            self.show_status(" ⚠️  Invalid Path", WIN_WARNING)
+
+    def show_status(self, text, color):
+        """Shows a short-lived message in the status bar."""
+        self.status_label.configure(text=text, text_color=color)
+        self.root.after(2000, lambda: self.status_label.configure(text=" 🟢 Ready", text_color=WIN_MUTED))
@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from .audio_engine import AUDIO_EXTENSIONS
+
+POLL_INTERVAL = 2.0  # Seconds between directory mtime checks when inotify is unavailable
+FULL_RESCAN_INTERVAL = 60.0  # Polling also re-stats everything this often to catch in-place edits
+DEBOUNCE_SECONDS = 0.3  # Let bursts of events (copies, extractions) settle before rescanning
+
+# inotify event masks (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+def get_library_dir():
+    """The music folder used for headless browsing and relative track paths (PHONOGRAPH_LIBRARY_DIR, default: working directory)."""
+    return os.path.abspath(os.getenv('PHONOGRAPH_LIBRARY_DIR') or os.getcwd())
+
+def resolve_library_path(path, root=None):
+    """Resolves a user-supplied path against the library folder. Returns None if it points outside of it."""
+    root = os.path.realpath(root or get_library_dir())
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([full, root]) != root:
+        return None
+    return full
+
+class InotifyWatcher:
+    """Thin ctypes wrapper over Linux inotify that reports which watched directories changed."""
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+    @classmethod
+    def create(cls):
+        """Returns a watcher, or None where inotify is not available."""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return cls(libc, fd)
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.wds = {}    # watch descriptor -> directory
+        self.paths = {}  # directory -> watch descriptor
+
+    def add(self, directory):
+        """Watches a directory. Returns False if the kernel refused (e.g. the watch limit was hit)."""
+        if directory in self.paths:
+            return True
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            return False
+        self.wds[wd] = directory
+        self.paths[directory] = wd
+        return True
+
+    def remove(self, directory):
+        wd = self.paths.pop(directory, None)
+        if wd is not None:
+            self.wds.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """
+        Blocks up to `timeout` seconds and returns the set of directories with events.
+        The set contains None if the kernel queue overflowed and a full rescan is needed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size + name_len
+            if mask & IN_Q_OVERFLOW:
+                changed.add(None)
+            elif wd in self.wds:
+                changed.add(self.wds[wd])
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class LibraryScanner:
+    """
+    Recursive in-memory index of the audio files under a root folder, keyed by path with size and mtime.
+    The first pass walks everything with os.scandir; afterwards only directories that changed are re-listed,
+    driven by inotify where available and by polling directory mtimes elsewhere.
+    Changes are delivered as deltas: on_changes(added, modified, removed), lists of absolute paths.
+    """
+    def __init__(self, root, on_changes, poll_interval=POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.on_changes = on_changes
+        self.poll_interval = poll_interval
+        self.files = {}      # path -> (size, mtime)
+        self.dir_files = {}  # directory -> paths of the audio files directly inside it
+        self.dir_subdirs = {}  # directory -> its known subdirectories
+        self.dir_mtimes = {}   # directory -> mtime at its last listing
+        self.watcher = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def snapshot(self):
+        """Returns every known audio file path, sorted."""
+        with self.lock:
+            return sorted(self.files)
+
+    def start(self):
+        """Runs the initial scan and then watches for changes on a background thread."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        self.watcher = InotifyWatcher.create()
+        try:
+            self.emit(self.scan())
+            if self.watcher:
+                self.watch_loop()
+            else:
+                self.poll_loop()
+        except Exception as e:
+            print(f"[Library] Scanner stopped: {e}")
+        finally:
+            if self.watcher:
+                self.watcher.close()
+
+    def emit(self, changes):
+        added, modified, removed = changes
+        if (added or modified or removed) and not self.stop_event.is_set():
+            self.on_changes(added, modified, removed)
+
+    def scan(self):
+        """Walks the whole tree and returns (added, modified, removed) relative to the last scan."""
+        changes = ([], [], [])
+        with self.lock:
+            self.scan_dir(self.root, changes, recursive=True)
+        return changes
+
+    def refresh(self, directories):
+        """Re-lists only the given directories (plus any new subdirectories found in them)."""
+        changes = ([], [], [])
+        with self.lock:
+            for directory in directories:
+                if directory in self.dir_mtimes or directory == self.root:
+                    self.scan_dir(directory, changes, recursive=False)
+        return changes
+
+    def scan_dir(self, directory, changes, recursive):
+        added, modified, removed = changes
+        try:
+            mtime = os.stat(directory).st_mtime
+            entries = list(os.scandir(directory))
+        except OSError:
+            self.drop_dir(directory, changes)
+            return
+
+        self.dir_mtimes[directory] = mtime
+        if self.watcher and not self.watcher.add(directory):
+            print("[Library] inotify watch limit reached, falling back to polling")
+            self.watcher.close()
+            self.watcher = None
+
+        files = set()
+        subdirs = set()
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    # Skip hidden folders such as .phonograph_cache
+                    if not entry.name.startswith('.'):
+                        subdirs.add(entry.path)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                    st = entry.stat()
+                    signature = (st.st_size, st.st_mtime)
+                    previous = self.files.get(entry.path)
+                    if previous is None:
+                        added.append(entry.path)
+                    elif previous != signature:
+                        modified.append(entry.path)
+                    self.files[entry.path] = signature
+                    files.add(entry.path)
+            except OSError:
+                continue
+
+        for path in self.dir_files.get(directory, set()) - files:
+            self.files.pop(path, None)
+            removed.append(path)
+        self.dir_files[directory] = files
+
+        for gone in self.dir_subdirs.get(directory, set()) - subdirs:
+            self.drop_dir(gone, changes)
+        self.dir_subdirs[directory] = subdirs
+
+        for subdir in subdirs:
+            if recursive or subdir not in self.dir_mtimes:
+                self.scan_dir(subdir, changes, recursive)
+
+    def drop_dir(self, directory, changes):
+        """Forgets a directory that disappeared, reporting all its files as removed."""
+        for path in self.dir_files.pop(directory, set()):
+            self.files.pop(path, None)
+            changes[2].append(path)
+        for subdir in self.dir_subdirs.pop(directory, set()):
+            self.drop_dir(subdir, changes)
+        self.dir_mtimes.pop(directory, None)
+        if self.watcher:
+            self.watcher.remove(directory)
+
+    def watch_loop(self):
+        while not self.stop_event.is_set() and self.watcher:
+            changed = self.watcher.wait(1.0)
+            if not changed:
+                continue
+            # Collect the rest of the burst before touching the disk
+            time.sleep(DEBOUNCE_SECONDS)
+            if self.watcher:
+                changed |= self.watcher.wait(0)
+            if None in changed:
+                self.emit(self.scan())
+            else:
+                self.emit(self.refresh(changed))
+        if not self.stop_event.is_set():
+            self.poll_loop()
+
+    def poll_loop(self):
+        last_full_scan = time.monotonic()
+        while not self.stop_event.wait(self.poll_interval):
+            if time.monotonic() - last_full_scan >= FULL_RESCAN_INTERVAL:
+                last_full_scan = time.monotonic()
+                self.emit(self.scan())
+                continue
+
+            # Adding, removing or renaming a file bumps its directory's mtime
+            with self.lock:
+                known = list(self.dir_mtimes.items())
+            changed = []
+            for directory, mtime in known:
+                try:
+                    if os.stat(directory).st_mtime != mtime:
+                        changed.append(directory)
+                except OSError:
+                    changed.append(directory)
+            if changed:
+                self.emit(self.refresh(changed))
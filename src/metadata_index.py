@@ -0,0 +1,190 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Column name -> SQLite type for every per-track field kept in the index.
+# New columns are added to existing databases automatically on open.
+COLUMNS = {
+    'size': 'INTEGER',
+    'mtime': 'REAL',
+    'duration': 'REAL',
+    'codec': 'TEXT',
+    'channels': 'INTEGER',  # Audio channels of the source file
+    'cache_path': 'TEXT',
+    'optimized': 'INTEGER',  # NULL = unknown, 0 = pending, 1 = cached
+    'loudness_i': 'REAL',  # Measured EBU R128 integrated loudness (LUFS)
+    'loudness_tp': 'REAL',
+    'loudness_lra': 'REAL',
+    'loudness_thresh': 'REAL',
+    'loudness_offset': 'REAL',
+    'normalized_path': 'TEXT',  # Pre-baked normalized Opus variant
+    'normalizable': 'INTEGER',  # 0 = loudness cannot be measured (silent, very short): no normalized variant
+    'loop_start': 'INTEGER',  # Loop points in 48 kHz samples, NULL = audible start / end (see audio_engine)
+    'loop_end': 'INTEGER',
+    'audio_start': 'INTEGER',  # First and last audible sample (48 kHz) of the cached audio, NULL = not analysed
+    'audio_end': 'INTEGER',  # NULL after analysis = audible to the end
+    'content_key': 'TEXT',  # Content-based cache key (see audio_engine.get_content_key)
+    'play_count': 'INTEGER',  # Playback history, for cache eviction and hit rates
+    'cached_plays': 'INTEGER',
+    'last_played': 'REAL',
+    'missing_since': 'REAL',  # When cache cleanup found the file gone; NULL while it exists
+    'updated_at': 'REAL',
+}
+
+# User data and history that describe the track rather than the file's current bytes: they survive
+# changes to the file (e.g. retagging) and follow it to a new path when it is moved
+TRACK_COLUMNS = ('loop_start', 'loop_end', 'play_count', 'cached_plays', 'last_played')
+
+class MetadataIndex:
+    """
+    Persistent SQLite index of per-track metadata (size, mtime, duration, codec, cache status).
+    Rows are keyed by absolute path and are only trusted while the source file's size and mtime
+    still match, so a single os.stat replaces ffprobe and the cache stat calls on the hot path.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+        """Opens the database on first use and brings its schema up to date."""
+        if self.conn is not None:
+            return self.conn
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS tracks (path TEXT PRIMARY KEY)")
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(tracks)")}
+        for name, col_type in COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE tracks ADD COLUMN {name} {col_type}")
+        conn.commit()
+        self.conn = conn
+        return conn
+
+    def get(self, filepath):
+        """Returns the stored row for a file as a dict, without checking it is still fresh."""
+        abs_path = os.path.abspath(filepath)
+        with self.lock:
+            row = self.connect().execute("SELECT * FROM tracks WHERE path = ?", (abs_path,)).fetchone()
+        return dict(row) if row else None
+
+    def lookup(self, filepath):
+        """Returns the stored row for a file if its size and mtime still match, otherwise None."""
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        entry = self.get(filepath)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            return entry
+        return None
+
+    def update(self, filepath, **fields):
+        """
+        Records fields for a file. If the file changed since its row was written, every field derived
+        from its contents is discarded before the new ones are stored; TRACK_COLUMNS are kept.
+        """
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown index fields: {', '.join(sorted(unknown))}")
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return
+        abs_path = os.path.abspath(filepath)
+        fields['updated_at'] = time.time()
+        fields['missing_since'] = None
+
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute("SELECT size, mtime FROM tracks WHERE path = ?", (abs_path,)).fetchone()
+            if row is None:
+                fields.update(size=st.st_size, mtime=st.st_mtime)
+                names = list(fields)
+                conn.execute(
+                    f"INSERT INTO tracks (path, {', '.join(names)}) VALUES (?, {', '.join('?' for _ in names)})",
+                    [abs_path] + [fields[n] for n in names])
+            else:
+                if row['size'] != st.st_size or row['mtime'] != st.st_mtime:
+                    derived = dict.fromkeys(name for name in COLUMNS if name not in TRACK_COLUMNS)
+                    derived.update(fields, size=st.st_size, mtime=st.st_mtime)
+                    fields = derived
+                names = list(fields)
+                conn.execute(
+                    f"UPDATE tracks SET {', '.join(f'{n} = ?' for n in names)} WHERE path = ?",
+                    [fields[n] for n in names] + [abs_path])
+            conn.commit()
+
+    def set_cache_status(self, filepath, optimized, cache_path=None):
+        """Records whether a file currently has a valid entry in the central cache."""
+        self.update(filepath, optimized=1 if optimized else 0, cache_path=cache_path)
+
+    def record_play(self, filepath, cache_hit):
+        """Counts a playback of a file, and whether the cache served it."""
+        self.update(filepath)  # Makes sure a fresh row exists
+        with self.lock:
+            conn = self.connect()
+            conn.execute("UPDATE tracks SET play_count = COALESCE(play_count, 0) + 1, "
+                         "cached_plays = COALESCE(cached_plays, 0) + ?, last_played = ? WHERE path = ?",
+                         (1 if cache_hit else 0, time.time(), os.path.abspath(filepath)))
+            conn.commit()
+
+    def mark_missing(self, filepath, since):
+        """Records that a file was found missing (keeping the earliest time), so its row can be forgotten later."""
+        with self.lock:
+            conn = self.connect()
+            conn.execute("UPDATE tracks SET missing_since = COALESCE(missing_since, ?) WHERE path = ?",
+                         (since, os.path.abspath(filepath)))
+            conn.commit()
+
+    def adopt_moved(self, filepath, content_key):
+        """
+        Moves the loop points and play history of rows whose file is gone but had the same content
+        (a moved or renamed file) to this file's row, and forgets those rows. Returns how many were adopted.
+        """
+        abs_path = os.path.abspath(filepath)
+        with self.lock:
+            conn = self.connect()
+            rows = conn.execute("SELECT * FROM tracks WHERE content_key = ? AND path != ?",
+                                (content_key, abs_path)).fetchall()
+            moved = [dict(row) for row in rows if not os.path.exists(row['path'])]
+            if not moved:
+                return 0
+            row = dict(conn.execute("SELECT * FROM tracks WHERE path = ?", (abs_path,)).fetchone())
+            for old in moved:
+                for name in ('loop_start', 'loop_end'):
+                    if row[name] is None:
+                        row[name] = old[name]
+                for name in ('play_count', 'cached_plays'):
+                    row[name] = (row[name] or 0) + (old[name] or 0) or None
+                row['last_played'] = max(row['last_played'] or 0.0, old['last_played'] or 0.0) or None
+                conn.execute("DELETE FROM tracks WHERE path = ?", (old['path'],))
+            conn.execute(f"UPDATE tracks SET {', '.join(f'{n} = ?' for n in TRACK_COLUMNS)} WHERE path = ?",
+                         [row[n] for n in TRACK_COLUMNS] + [abs_path])
+            conn.commit()
+        return len(moved)
+
+    def rows(self):
+        """Returns every stored row as a dict, fresh or not."""
+        with self.lock:
+            return [dict(row) for row in self.connect().execute("SELECT * FROM tracks")]
+
+    def invalidate_cache_key(self, content_key):
+        """Marks every file sharing an evicted cache entry as no longer optimized."""
+        with self.lock:
+            conn = self.connect()
+            conn.execute("UPDATE tracks SET optimized = 0, cache_path = NULL, normalized_path = NULL "
+                         "WHERE content_key = ?", (content_key,))
+            conn.commit()
+
+    def forget(self, filepath):
+        """Removes a file's row entirely."""
+        abs_path = os.path.abspath(filepath)
+        with self.lock:
+            conn = self.connect()
+            conn.execute("DELETE FROM tracks WHERE path = ?", (abs_path,))
+            conn.commit()
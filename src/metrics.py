@@ -0,0 +1,336 @@
+import os
+import asyncio
+import bisect
+import threading
+import time
+from collections import deque
+
+try:
+    import psutil  # Optional: per-process stats on every platform
+except ImportError:
+    psutil = None
+
+# Metric name -> (Prometheus type, help text). Every metric the app records is declared here.
+METRICS = {
+    'phonograph_play_probe_seconds': ('histogram', "Time spent looking up the track duration when playback starts"),
+    'phonograph_play_open_seconds': ('histogram', "Time spent opening the audio source (including ffmpeg spawn)"),
+    'phonograph_play_first_frame_seconds': ('histogram', "Time from handing the source to the voice client until its first frame"),
+    'phonograph_last_play_seconds': ('gauge', "Latency breakdown of the most recent play, by stage"),
+    'phonograph_frames_total': ('counter', "Audio frames delivered to the voice client"),
+    'phonograph_frame_jitter_seconds': ('histogram', "Deviation of the interval between read() calls from the 20 ms frame period"),
+    'phonograph_underruns_total': ('counter', "read() calls that took longer than one frame period"),
+    'phonograph_clock_drift_seconds': ('gauge', "Wall-clock time minus audio delivered in the current run of frames (latest sample)"),
+    'phonograph_clock_drift_abs_seconds': ('histogram', "Absolute drift between delivered audio and the wall clock, sampled every second"),
+    'phonograph_lead_in_skipped_seconds': ('histogram', "Leading silence skipped when a cached track starts"),
+    'phonograph_play_requests_total': ('counter', "Play and seek-restart requests, by result (started, superseded, failed)"),
+    'phonograph_event_loop_lag_seconds': ('histogram', "How late the event loop ran a scheduled tick: time something else blocked it"),
+    'phonograph_cache_lookups_total': ('counter', "Playback source lookups in the central cache, by result"),
+    'phonograph_cache_status_checks_total': ('counter', "Cache status checks of library files, by result"),
+    'phonograph_transcode_queue_depth': ('gauge', "Transcodes submitted to the pool and not yet finished"),
+    'phonograph_transcodes_total': ('counter', "Finished background transcodes, by result"),
+    'phonograph_cache_tees_total': ('counter', "Tracks cached during their first playback, by result"),
+    'phonograph_bitrate_variants_total': ('counter', "Lower-bitrate cache variants built for voice channels, by result"),
+    'phonograph_cache_bytes': ('gauge', "Size of the central cache on disk"),
+    'phonograph_cache_evictions_total': ('counter', "Cache entries evicted to stay within the size budget"),
+    'phonograph_packet_cache_lookups_total': ('counter', "Cached track opens served from the in-memory packet cache, by result"),
+    'phonograph_packet_cache_bytes': ('gauge', "Resident size of the in-memory packet cache"),
+    'phonograph_packet_cache_budget_bytes': ('gauge', "Byte budget of the in-memory packet cache"),
+    'phonograph_packet_cache_tracks': ('gauge', "Tracks held in the in-memory packet cache"),
+    'phonograph_packet_cache_evictions_total': ('counter', "Tracks dropped from the in-memory packet cache"),
+    'phonograph_ffmpeg_running': ('gauge', "Running ffmpeg processes, by role"),
+    'phonograph_ffmpeg_cpu_seconds_total': ('counter', "CPU time used by ffmpeg processes, by role"),
+    'phonograph_ffmpeg_cpu_percent': ('gauge', "Current CPU use of ffmpeg processes, by role"),
+    'phonograph_ffmpeg_rss_bytes': ('gauge', "Resident memory of running ffmpeg processes, by role"),
+    'phonograph_ffmpeg_peak_rss_bytes': ('gauge', "Largest resident memory seen for a single ffmpeg process, by role"),
+}
+
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT_SAMPLES = 512  # Observations kept per histogram for the percentiles shown in !stats and the GUI
+PROCESS_ROLES = ("playback", "tee", "loudness", "transcode", "waveform", "silence")
+PROCESS_SAMPLE_INTERVAL = 1.0
+LOOP_LAG_INTERVAL = 0.25  # Period of the event loop lag probe
+DEFAULT_EXPORT_INTERVAL = 15.0
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        i = bisect.bisect_left(HISTOGRAM_BUCKETS, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Metrics:
+    """
+    Thread-safe in-process metrics registry: counters, gauges and histograms keyed by name and labels.
+    Rendered as Prometheus text for the exporter file and as a short summary for !stats and the GUI.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # (name, label key) -> number, for counters and gauges
+        self.histograms = {}  # (name, label key) -> Histogram
+
+    def check(self, name):
+        if name not in METRICS:
+            raise ValueError(f"Unknown metric: {name}")
+
+    def inc(self, name, amount=1, **labels):
+        self.check(name)
+        key = (name, label_key(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        self.check(name)
+        with self.lock:
+            self.values[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        self.check(name)
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def value(self, name, default=0, **labels):
+        with self.lock:
+            return self.values.get((name, label_key(labels)), default)
+
+    def percentile(self, name, fraction, **labels):
+        with self.lock:
+            histogram = self.histograms.get((name, label_key(labels)))
+            return histogram.percentile(fraction) if histogram else None
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in METRICS.items():
+                if kind == 'histogram':
+                    series = sorted((key, h) for (n, key), h in self.histograms.items() if n == name)
+                else:
+                    series = sorted((key, v) for (n, key), v in self.values.items() if n == name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, item in series:
+                    if kind != 'histogram':
+                        lines.append(f"{name}{format_labels(key)} {item:g}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(HISTOGRAM_BUCKETS, item.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(key, [('le', f'{bound:g}')])} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(key, [('le', '+Inf')])} {item.count}")
+                    lines.append(f"{name}_sum{format_labels(key)} {item.total:g}")
+                    lines.append(f"{name}_count{format_labels(key)} {item.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """Human-readable overview used by !stats and the GUI stats panel."""
+        def ms(seconds):
+            return f"{seconds * 1000:.0f} ms" if seconds is not None else "-"
+
+        plays = 0
+        with self.lock:
+            histogram = self.histograms.get(('phonograph_play_first_frame_seconds', ()))
+            if histogram:
+                plays = histogram.count
+        lines = [
+            f"Plays: {plays} | first audio p50 {ms(self.percentile('phonograph_play_first_frame_seconds', 0.5))}"
+            f", p95 {ms(self.percentile('phonograph_play_first_frame_seconds', 0.95))}",
+            f"Last play: probe {ms(self.value('phonograph_last_play_seconds', None, stage='probe'))}"
+            f", open {ms(self.value('phonograph_last_play_seconds', None, stage='open'))}"
+            f", first frame {ms(self.value('phonograph_last_play_seconds', None, stage='first_frame'))}",
+            f"Frames: {self.value('phonograph_frames_total'):.0f} | jitter p95 "
+            f"{ms(self.percentile('phonograph_frame_jitter_seconds', 0.95))} | underruns {self.value('phonograph_underruns_total'):.0f}"
+            f" | clock drift {ms(self.value('phonograph_clock_drift_seconds', None))}"
+            f" (p95 {ms(self.percentile('phonograph_clock_drift_abs_seconds', 0.95))})",
+            f"Event loop: lag p95 {ms(self.percentile('phonograph_event_loop_lag_seconds', 0.95))}"
+            f", max {ms(self.percentile('phonograph_event_loop_lag_seconds', 1.0))} | requests "
+            f"{self.value('phonograph_play_requests_total', result='started'):.0f} started, "
+            f"{self.value('phonograph_play_requests_total', result='superseded'):.0f} superseded, "
+            f"{self.value('phonograph_play_requests_total', result='failed'):.0f} failed",
+        ]
+
+        hits = self.value('phonograph_cache_lookups_total', result='hit')
+        misses = self.value('phonograph_cache_lookups_total', result='miss')
+        rate = f" ({hits / (hits + misses):.0%} hit)" if hits + misses else ""
+        lines.append(f"Cache: {hits:.0f} hits / {misses:.0f} misses on play{rate} | "
+                     f"status checks {self.value('phonograph_cache_status_checks_total', result='optimized'):.0f} optimized"
+                     f" / {self.value('phonograph_cache_status_checks_total', result='pending'):.0f} pending")
+        ram_hits = self.value('phonograph_packet_cache_lookups_total', result='hit')
+        ram_misses = self.value('phonograph_packet_cache_lookups_total', result='miss')
+        ram_rate = f" ({ram_hits / (ram_hits + ram_misses):.0%} hit)" if ram_hits + ram_misses else ""
+        lines.append(f"RAM cache: {self.value('phonograph_packet_cache_tracks'):.0f} tracks, "
+                     f"{self.value('phonograph_packet_cache_bytes') / 1048576:.1f} / "
+                     f"{self.value('phonograph_packet_cache_budget_bytes') / 1048576:.0f} MB | "
+                     f"{ram_hits:.0f} hits / {ram_misses:.0f} misses{ram_rate}")
+        lines.append(f"Transcodes: {self.value('phonograph_transcode_queue_depth'):.0f} queued | "
+                     f"{self.value('phonograph_transcodes_total', result='ok'):.0f} done, "
+                     f"{self.value('phonograph_transcodes_total', result='failed'):.0f} failed | "
+                     f"{self.value('phonograph_cache_tees_total', result='committed'):.0f} cached while playing | "
+                     f"{self.value('phonograph_bitrate_variants_total', result='built'):.0f} bitrate variants")
+
+        for role in PROCESS_ROLES:
+            cpu = self.value('phonograph_ffmpeg_cpu_seconds_total', role=role)
+            running = self.value('phonograph_ffmpeg_running', role=role)
+            if not cpu and not running:
+                continue
+            lines.append(f"ffmpeg {role}: {running:.0f} running, "
+                         f"{self.value('phonograph_ffmpeg_cpu_percent', role=role):.0f}% CPU, "
+                         f"{self.value('phonograph_ffmpeg_rss_bytes', role=role) / 1e6:.0f} MB "
+                         f"(peak {self.value('phonograph_ffmpeg_peak_rss_bytes', role=role) / 1e6:.0f} MB), "
+                         f"{cpu:.1f}s CPU total")
+        return lines
+
+metrics = Metrics()
+
+def read_process_stats(pid):
+    """Returns (cpu seconds, rss bytes) of a running process, or None if it cannot be read."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may itself contain spaces or parentheses
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        return cpu, int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class ProcessMonitor:
+    """Samples CPU time and memory of watched ffmpeg children once a second; sleeps while none are running."""
+    def __init__(self):
+        self.processes = {}  # pid -> [Popen, role, last cpu seconds]
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def watch(self, process, role):
+        with self.lock:
+            self.processes[process.pid] = [process, role, 0.0]
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                watched = list(self.processes.values())
+                if not watched:
+                    self.wakeup.clear()
+            self.sample(watched)
+            if watched:
+                time.sleep(PROCESS_SAMPLE_INTERVAL)
+
+    def sample(self, watched):
+        running = dict.fromkeys(PROCESS_ROLES, 0)
+        rss = dict.fromkeys(PROCESS_ROLES, 0)
+        cpu_delta = dict.fromkeys(PROCESS_ROLES, 0.0)
+        for entry in watched:
+            process, role, last_cpu = entry
+            stats = read_process_stats(process.pid) if process.poll() is None else None
+            if stats is None:
+                if process.poll() is not None:
+                    with self.lock:
+                        self.processes.pop(process.pid, None)
+                continue
+            cpu, resident = stats
+            running[role] = running.get(role, 0) + 1
+            rss[role] = rss.get(role, 0) + resident
+            cpu_delta[role] = cpu_delta.get(role, 0.0) + max(cpu - last_cpu, 0.0)
+            entry[2] = cpu
+            if resident > metrics.value('phonograph_ffmpeg_peak_rss_bytes', role=role):
+                metrics.set_gauge('phonograph_ffmpeg_peak_rss_bytes', resident, role=role)
+
+        for role in running:
+            metrics.set_gauge('phonograph_ffmpeg_running', running[role], role=role)
+            metrics.set_gauge('phonograph_ffmpeg_rss_bytes', rss[role], role=role)
+            metrics.set_gauge('phonograph_ffmpeg_cpu_percent', cpu_delta[role] / PROCESS_SAMPLE_INTERVAL * 100, role=role)
+            if cpu_delta[role]:
+                metrics.inc('phonograph_ffmpeg_cpu_seconds_total', cpu_delta[role], role=role)
+
+process_monitor = ProcessMonitor()
+
+def watch_process(process, role):
+    """Starts sampling an ffmpeg child's CPU time and memory under the given role."""
+    if process is not None and getattr(process, 'pid', None):
+        process_monitor.watch(process, role)
+
+async def monitor_event_loop(interval=LOOP_LAG_INTERVAL):
+    """
+    Runs on the event loop for the life of the bot, measuring how much later than scheduled each tick wakes up.
+    Anything that blocks the loop (a synchronous subprocess, file I/O, a slow handler) shows up as lag.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        metrics.observe('phonograph_event_loop_lag_seconds', max(loop.time() - scheduled, 0.0))
+
+def write_metrics_file(path):
+    """Writes the Prometheus text file atomically, so a scraper never reads half a file."""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        f.write(metrics.render_prometheus())
+    os.replace(temp_path, path)
+
+def start_exporter():
+    """
+    Periodically writes all metrics to a Prometheus text file for a local scraper (e.g. node_exporter's textfile collector).
+    PHONOGRAPH_METRICS_FILE sets the path, PHONOGRAPH_METRICS_INTERVAL the period in seconds (0 turns it off).
+    """
+    try:
+        interval = float(os.getenv('PHONOGRAPH_METRICS_INTERVAL', DEFAULT_EXPORT_INTERVAL))
+    except ValueError:
+        interval = DEFAULT_EXPORT_INTERVAL
+    if interval <= 0:
+        return None
+    bot_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.getenv('PHONOGRAPH_METRICS_FILE') or os.path.join(bot_root, ".phonograph_metrics.prom")
+
+    def exporter():
+        while True:
+            try:
+                write_metrics_file(path)
+            except OSError as e:
+                print(f"[Metrics] Could not write {path}: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=exporter, daemon=True)
+    thread.start()
+    print(f"[Metrics] Writing {path} every {interval:g}s")
+    return thread
@@ -0,0 +1,245 @@
+import wave
+import threading
+import discord
+
+try:
+    import numpy as np  # Optional: needed for sound layers
+except ImportError:
+    np = None
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME_SAMPLES = 960  # Per channel in one 20 ms frame
+FRAME_VALUES = FRAME_SAMPLES * CHANNELS
+FRAMES_PER_SECOND = 50
+MAX_VOLUME = 2.0
+DUCK_GAIN = 0.35  # Level of everything else while a ducking layer (e.g. a sound effect) plays
+DUCK_FADE_SECONDS = 0.15
+VOLUME_FADE_SECONDS = 0.1  # Volume changes are ramped so they never click
+
+class MixerUnavailable(Exception):
+    """Raised when sound layers are used without NumPy installed."""
+
+class WavePCMSource(discord.AudioSource):
+    """Reads a 48 kHz 16-bit stereo WAV file in-process, 20 ms at a time, so it needs no ffmpeg."""
+    def __init__(self, path):
+        self.wave = wave.open(path, 'rb')
+        if (self.wave.getframerate(), self.wave.getnchannels(), self.wave.getsampwidth()) != (SAMPLE_RATE, CHANNELS, 2):
+            self.wave.close()
+            raise ValueError(f"{path} is not 48 kHz 16-bit stereo")
+
+    def is_opus(self):
+        return False
+
+    def read(self):
+        return self.wave.readframes(FRAME_SAMPLES)
+
+    def cleanup(self):
+        self.wave.close()
+
+class Layer:
+    """
+    One sound playing on top of the music. open_source(layer) returns a fresh discord.py source for it;
+    sources that cannot loop in-process are reopened at their end while the layer loops.
+    """
+    def __init__(self, name, filepath, open_source, volume=1.0, loop=False, duck=False, fade_in=0.0):
+        self.name = name
+        self.filepath = filepath
+        self.open_source = open_source
+        self.volume = volume  # Level set by the user, 0.0 - MAX_VOLUME
+        self.loop = loop
+        self.duck = duck  # Lowers the music and the other layers while it plays
+        self.gain = 0.0 if fade_in > 0 else volume  # Level at the end of the last mixed frame
+        self.target = volume
+        self.fade_step = 0.0
+        self.removing = False  # Fading out, then removed
+        self.decoder = None
+        self.source = open_source(self)
+        if fade_in > 0:
+            self.fade_to(volume, fade_in)
+
+    def fade_to(self, target, seconds):
+        self.target = target
+        self.fade_step = abs(target - self.gain) / max(int(seconds * FRAMES_PER_SECOND), 1)
+
+    def next_gain(self):
+        """Moves the fade on by one frame and returns the gain at the end of it."""
+        if self.gain < self.target:
+            self.gain = min(self.gain + self.fade_step, self.target)
+        elif self.gain > self.target:
+            self.gain = max(self.gain - self.fade_step, self.target)
+        return self.gain
+
+    def read_pcm(self):
+        """Returns the next 20 ms as int16 samples, or None once the layer has ended."""
+        data = self.source.read()
+        if not data and self.loop:
+            # Native Opus sources loop by themselves; anything else starts over
+            self.source.cleanup()
+            self.source = self.open_source(self)
+            self.decoder = None
+            data = self.source.read()
+        if not data:
+            return None
+        if self.source.is_opus():
+            if self.decoder is None:
+                self.decoder = discord.opus.Decoder()
+            data = self.decoder.decode(data)
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) < FRAME_VALUES:
+            samples = np.pad(samples, (0, FRAME_VALUES - len(samples)))
+        return samples[:FRAME_VALUES]
+
+    def cleanup(self):
+        self.source.cleanup()
+
+class LayerMixer:
+    """
+    The sound layers of one session (ambience, sound effects...), summed with the music into one
+    48 kHz stereo PCM stream. All the per-sample work is vectorized with NumPy: gains change as ramps
+    across each 20 ms frame, so fades, volume changes and ducking never click.
+    mix() runs on the audio player thread; everything else may be called from any thread.
+    """
+    def __init__(self, on_change=None):
+        self.layers = {}  # name -> Layer, in the order they were added
+        self.lock = threading.Lock()
+        self.on_change = on_change or (lambda: None)
+        self.duck_gain = 1.0  # Current level of the music and the non-ducking layers
+        self.ramp = None
+        if np is not None:
+            # 0 -> 1 across a frame, repeated for both channels of the interleaved samples
+            self.ramp = np.repeat(np.arange(FRAME_SAMPLES, dtype=np.float32) / FRAME_SAMPLES, CHANNELS)
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    def active(self):
+        # Stays active after the last layer ended until the music is back from ducking
+        return bool(self.layers) or self.duck_gain < 1.0
+
+    def snapshot(self):
+        """Returns (name, filepath, volume, loop, duck) for every layer."""
+        with self.lock:
+            return [(l.name, l.filepath, l.volume, l.loop, l.duck) for l in self.layers.values() if not l.removing]
+
+    def add(self, name, filepath, open_source, volume=1.0, loop=False, duck=False, fade_in=0.0):
+        """Starts a layer, replacing any layer with the same name."""
+        if np is None:
+            raise MixerUnavailable("Sound layers need NumPy (pip install numpy)")
+        layer = Layer(name, filepath, open_source, min(max(volume, 0.0), MAX_VOLUME), loop, duck, fade_in)
+        with self.lock:
+            previous = self.layers.pop(name, None)
+            self.layers[name] = layer
+        if previous:
+            previous.cleanup()
+        self.on_change()
+        return layer
+
+    def remove(self, name, fade_out=0.0):
+        """Stops a layer, optionally fading it out first. Returns False if there is no such layer."""
+        with self.lock:
+            layer = self.layers.get(name)
+            if layer is None:
+                return False
+            if fade_out > 0:
+                layer.removing = True
+                layer.fade_to(0.0, fade_out)
+            else:
+                del self.layers[name]
+        if fade_out <= 0:
+            layer.cleanup()
+        self.on_change()
+        return True
+
+    def clear(self, fade_out=0.0):
+        for name in list(self.layers):
+            self.remove(name, fade_out)
+
+    def set_volume(self, name, volume):
+        layer = self.layers.get(name)
+        if layer is None or layer.removing:
+            return False
+        layer.volume = min(max(volume, 0.0), MAX_VOLUME)
+        layer.fade_to(layer.volume, VOLUME_FADE_SECONDS)
+        self.on_change()
+        return True
+
+    def set_loop(self, name, loop=None):
+        """Turns looping of a layer on or off (None toggles it). Returns the new setting, or None if there is no such layer."""
+        layer = self.layers.get(name)
+        if layer is None:
+            return None
+        layer.loop = not layer.loop if loop is None else loop
+        self.on_change()
+        return layer.loop
+
+    def gains(self, start, end):
+        """Per-sample gains ramping from start to end across one frame (a scalar when constant)."""
+        if start == end:
+            return start
+        return start + (end - start) * self.ramp
+
+    def mix(self, music=None):
+        """
+        Mixes one frame of every layer over `music` (a PCM frame, or None when only layers play).
+        Returns the mixed 20 ms PCM frame.
+        """
+        with self.lock:
+            layers = list(self.layers.values())
+        if not layers and self.duck_gain >= 1.0:
+            return music
+
+        ducked = any(layer.duck and not layer.removing for layer in layers)
+        duck_start = self.duck_gain
+        step = (1.0 - DUCK_GAIN) / (DUCK_FADE_SECONDS * FRAMES_PER_SECOND)
+        if ducked:
+            duck_end = max(duck_start - step, DUCK_GAIN)
+        else:
+            duck_end = min(duck_start + step, 1.0)
+        self.duck_gain = duck_end
+        duck = self.gains(duck_start, duck_end)
+
+        out = np.zeros(FRAME_VALUES, dtype=np.float32)
+        if music:
+            samples = np.frombuffer(music, dtype=np.int16)[:FRAME_VALUES]
+            out[:len(samples)] += samples * duck
+
+        ended = []
+        for layer in layers:
+            samples = layer.read_pcm()
+            if samples is None:
+                ended.append(layer)
+                continue
+            gain = self.gains(layer.gain, layer.next_gain())
+            out += samples * (gain if layer.duck else gain * duck)
+            if layer.removing and layer.gain <= 0.0:
+                ended.append(layer)
+
+        if ended:
+            with self.lock:
+                for layer in ended:
+                    if self.layers.get(layer.name) is layer:
+                        del self.layers[layer.name]
+            for layer in ended:
+                layer.cleanup()
+            self.on_change()
+
+        np.clip(out, -32768, 32767, out=out)
+        return out.astype(np.int16).tobytes()
+
+class MixerSource(discord.AudioSource):
+    """Plays a session's layers on their own while no music is playing; ends when the last layer does."""
+    def __init__(self, mixer):
+        self.mixer = mixer
+
+    def is_opus(self):
+        return False
+
+    def read(self):
+        if not self.mixer.active():
+            return b''
+        return self.mixer.mix(None) or b''
+
+    def cleanup(self):
+        pass  # The layers belong to the session and keep going with the next source
@@ -0,0 +1,520 @@
+import os
+import struct
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+import discord
+from .metrics import metrics
+from .cache_store import get_cache_file_mtime, open_cache_file, read_cache_file, write_cache_file
+
+OPUS_SAMPLE_RATE = 48000
+
+# Ogg page header: capture pattern, version, header type, granule position,
+# serial number, page sequence, CRC checksum, number of segments
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+FLAG_CONTINUED = 0x01
+NO_GRANULE = -1
+
+def opus_packet_samples(packet):
+    """Returns the number of 48 kHz samples carried by an Opus packet, read from its TOC byte (RFC 6716)."""
+    if not packet:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame_size = (480, 960, 1920, 2880)[config % 4]  # SILK
+    elif config < 16:
+        frame_size = (480, 960)[config % 2]  # Hybrid
+    else:
+        frame_size = (120, 240, 480, 960)[config % 4]  # CELT
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frames * frame_size
+
+def get_index_path(path):
+    """Returns the path of the seek index stored alongside a cached Opus file."""
+    return path + ".idx"
+
+# Seek indexes are shared by every reader (and so every guild session) playing the same file
+INDEX_CACHE_SIZE = 64
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def load_page_index(path):
+    """
+    Returns the stored seek index of a cached Opus file as (granules, offsets) arrays,
+    or None if it is missing or older than the Opus file.
+    """
+    index_path = get_index_path(path)
+    mtime = get_cache_file_mtime(path)
+    index_mtime = get_cache_file_mtime(index_path)
+    if mtime is None or index_mtime is None or index_mtime < mtime:
+        return None
+    key = (path, mtime)
+
+    with _index_cache_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+
+    flat = array('q')
+    try:
+        flat.frombytes(read_cache_file(index_path))
+    except (OSError, ValueError):
+        return None
+    index = (flat[0::2], flat[1::2])
+
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+def write_page_index(path):
+    """Builds the page/granule seek index for a cached Opus file and stores it next to it."""
+    reader = OggOpusReader(path)
+    try:
+        entries = reader.scan_pages()
+    finally:
+        reader.close()
+    flat = array('q')
+    for granule, offset in entries:
+        flat.extend((granule, offset))
+    write_cache_file(get_index_path(path), flat.tobytes())
+    return entries
+
+def split_page(lacing, data):
+    """
+    Splits a page body into its completed packets and the unfinished tail that continues on the next page.
+    The body may be a memoryview of the pack; packets are copied out since they outlive the page.
+    """
+    packets = []
+    pos = 0
+    size = 0
+    for lace in lacing:
+        size += lace
+        if lace < 255:
+            packets.append(bytes(data[pos:pos + size]))
+            pos += size
+            size = 0
+    return packets, bytes(data[pos:pos + size])
+
+class OggOpusReader:
+    """
+    Minimal in-process demuxer for the single-stream Ogg/Opus files in the central cache.
+    Yields raw Opus packets with their sample positions so they can be handed to Discord untouched.
+    Positions are 48 kHz samples relative to the first audible sample (after the encoder pre-skip).
+    `file` may be any seekable file-like object standing in for the file at `path`, such as a GrowingFile;
+    by default the file is opened through the cache store, which may serve it from the pack.
+    """
+    def __init__(self, path, file=None):
+        self.path = path
+        self.file = file or open_cache_file(path)
+        self.channels = 2
+        self.pre_skip = 0
+        self.data_offset = 0
+        self.granules = None  # Seek index: page granule positions and byte offsets, loaded on first seek
+        self.offsets = None
+        try:
+            self.read_headers()
+        except Exception:
+            self.file.close()
+            raise
+
+    def close(self):
+        self.file.close()
+
+    def read_page(self, offset=None):
+        """Reads one page. Returns (offset, header type, granule, lacing, body) or None at end of file."""
+        if offset is not None:
+            self.file.seek(offset)
+        start = self.file.tell()
+        header = self.file.read(PAGE_HEADER.size)
+        if len(header) < PAGE_HEADER.size:
+            return None
+        capture, _, header_type, granule, _, _, _, segments = PAGE_HEADER.unpack(header)
+        if capture != b'OggS':
+            raise ValueError(f"Corrupt Ogg page at byte {start} in {self.path}")
+        lacing = self.file.read(segments)
+        body = self.file.read(sum(lacing))
+        return start, header_type, granule, lacing, body
+
+    def read_headers(self):
+        """Parses OpusHead/OpusTags and records where the audio pages begin."""
+        headers = []
+        carry = b''
+        offset = 0
+        while len(headers) < 2:
+            page = self.read_page(offset)
+            if page is None:
+                raise ValueError(f"Missing Opus headers in {self.path}")
+            _, _, _, lacing, body = page
+            packets, tail = split_page(lacing, body)
+            if packets:
+                packets[0] = carry + packets[0]
+                carry = tail
+            else:
+                carry += tail
+            headers.extend(packets)
+            offset = self.file.tell()
+
+        head = headers[0]
+        if not head.startswith(b'OpusHead'):
+            raise ValueError(f"{self.path} is not an Ogg/Opus file")
+        self.channels = head[9]
+        self.pre_skip = struct.unpack_from('<H', head, 10)[0]
+        # Audio always starts on a fresh page after the header packets
+        self.data_offset = offset
+
+    def scan_pages(self):
+        """Returns [(granule, offset)] for every audio page that completes a packet, reading page headers only."""
+        entries = []
+        offset = self.data_offset
+        while True:
+            self.file.seek(offset)
+            header = self.file.read(PAGE_HEADER.size)
+            if len(header) < PAGE_HEADER.size:
+                break
+            capture, _, _, granule, _, _, _, segments = PAGE_HEADER.unpack(header)
+            if capture != b'OggS':
+                break
+            lacing = self.file.read(segments)
+            if granule != NO_GRANULE:
+                entries.append((granule, offset))
+            offset += PAGE_HEADER.size + segments + sum(lacing)
+        return entries
+
+    def seek_offset(self, sample):
+        """Returns the page offset to start reading from so the packet holding `sample` is not missed."""
+        if sample <= 0:
+            return self.data_offset
+        self.duration()  # Loads the seek index
+        # Start one page early: the wanted packet may begin on the page before the one it completes on
+        i = bisect.bisect_left(self.granules, sample + self.pre_skip) - 1
+        return self.offsets[i] if i >= 0 else self.data_offset
+
+    def iter_packets(self, offset=None):
+        """Yields (start sample, packet) for every audio packet from the page at `offset` onwards."""
+        self.file.seek(self.data_offset if offset is None else offset)
+        carry = b''  # Start of a packet continuing onto the next page, None if its beginning was never seen
+        first = True
+        while True:
+            page = self.read_page()
+            if page is None:
+                return
+            _, header_type, granule, lacing, body = page
+            packets, tail = split_page(lacing, body)
+            if first and header_type & FLAG_CONTINUED:
+                carry = None
+            first = False
+
+            if not packets:
+                # Page only carries part of a long packet
+                if carry is not None:
+                    carry += tail
+                continue
+
+            if header_type & FLAG_CONTINUED:
+                if carry is None:
+                    packets.pop(0)
+                else:
+                    packets[0] = carry + packets[0]
+            carry = tail
+            if not packets:
+                continue
+
+            # The granule marks the end of the last packet completed on this page
+            sizes = [opus_packet_samples(p) for p in packets]
+            position = granule - sum(sizes) - self.pre_skip
+            for packet, size in zip(packets, sizes):
+                yield position, packet
+                position += size
+
+    def duration(self):
+        """Returns the playable length in seconds, taken from the last page's granule position."""
+        if self.granules is None:
+            index = load_page_index(self.path)
+            if index is None:
+                entries = self.scan_pages()
+                index = (array('q', [g for g, _ in entries]), array('q', [o for _, o in entries]))
+            self.granules, self.offsets = index
+        if not self.granules:
+            return 0.0
+        return max(self.granules[-1] - self.pre_skip, 0) / OPUS_SAMPLE_RATE
+
+    def packets_from(self, sample=0):
+        """Yields (start sample, packet) starting with the packet that contains `sample`."""
+        for position, packet in self.iter_packets(self.seek_offset(sample)):
+            if position + opus_packet_samples(packet) <= sample:
+                continue
+            yield position, packet
+
+DEFAULT_PACKET_CACHE_MB = 64  # About an hour of 128 kbps audio
+PACKET_CACHE_ADMIT_PLAYS = 2  # Tracks are kept in memory from their second play on
+PACKET_OVERHEAD = 64  # Approximate Python object overhead per cached packet, in bytes
+PLAY_HISTORY_SIZE = 1024
+
+class MemoryTrack:
+    """Every packet of a cached Opus file, demuxed once and held in memory."""
+    def __init__(self, path, positions, packets, duration):
+        self.path = path
+        self.positions = positions  # array('q') of packet start samples, ascending
+        self.packets = packets
+        self.duration = duration
+        self.size = sum(len(p) for p in packets) + len(packets) * PACKET_OVERHEAD
+
+    @classmethod
+    def load(cls, path):
+        reader = OggOpusReader(path)
+        try:
+            positions = array('q')
+            packets = []
+            for position, packet in reader.iter_packets():
+                positions.append(position)
+                packets.append(packet)
+            return cls(path, positions, packets, reader.duration())
+        finally:
+            reader.close()
+
+class MemoryOpusReader:
+    """Drop-in for OggOpusReader that serves a MemoryTrack: no file, no disk I/O."""
+    def __init__(self, track):
+        self.track = track
+        self.path = track.path
+
+    def packets_from(self, sample=0):
+        """Yields (start sample, packet) starting with the packet that contains `sample`."""
+        positions = self.track.positions
+        packets = self.track.packets
+        i = max(bisect.bisect_right(positions, sample) - 1, 0)
+        while i < len(packets):
+            if positions[i] + opus_packet_samples(packets[i]) > sample:
+                yield positions[i], packets[i]
+            i += 1
+
+    def duration(self):
+        return self.track.duration
+
+    def close(self):
+        pass
+
+class PacketCache:
+    """
+    Process-wide RAM cache of demuxed Opus packets for hot tracks, so replaying them needs no disk I/O.
+    A track is loaded in the background on its PACKET_CACHE_ADMIT_PLAYS-th play (that play still reads
+    from disk) and the least recently played tracks are dropped once the byte budget is exceeded.
+    Entries are keyed on path and mtime, so a rewritten cache file is never served stale.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.tracks = OrderedDict()  # (path, mtime) -> MemoryTrack, least recently used first
+        self.plays = OrderedDict()   # (path, mtime) -> plays while not resident
+        self.loading = set()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        """Returns a reader for a cached Opus file: from memory when resident, otherwise from disk."""
+        mtime = get_cache_file_mtime(path)
+        key = (path, mtime) if mtime is not None else None
+        admit = False
+        with self.lock:
+            track = self.tracks.get(key)
+            if track is not None:
+                self.tracks.move_to_end(key)
+            elif key is not None and self.budget > 0:
+                plays = self.plays.pop(key, 0) + 1
+                self.plays[key] = plays
+                while len(self.plays) > PLAY_HISTORY_SIZE:
+                    self.plays.popitem(last=False)
+                admit = plays >= PACKET_CACHE_ADMIT_PLAYS and key not in self.loading
+                if admit:
+                    self.loading.add(key)
+        metrics.inc('phonograph_packet_cache_lookups_total', result="hit" if track is not None else "miss")
+        if track is not None:
+            return MemoryOpusReader(track)
+        if admit:
+            threading.Thread(target=self.load, args=(key,), daemon=True).start()
+        return OggOpusReader(path)
+
+    def load(self, key):
+        try:
+            track = MemoryTrack.load(key[0])
+        except (OSError, ValueError) as e:
+            print(f"[OggOpus] Could not load {os.path.basename(key[0])} into memory: {e}")
+            track = None
+        with self.lock:
+            self.loading.discard(key)
+            if track is None or track.size > self.budget:
+                return
+            self.plays.pop(key, None)
+            self.tracks[key] = track
+            self.size += track.size
+            evicted = 0
+            while self.size > self.budget:
+                _, old = self.tracks.popitem(last=False)
+                self.size -= old.size
+                evicted += 1
+            self.update_gauges()
+        if evicted:
+            metrics.inc('phonograph_packet_cache_evictions_total', evicted)
+
+    def update_gauges(self):
+        metrics.set_gauge('phonograph_packet_cache_bytes', self.size)
+        metrics.set_gauge('phonograph_packet_cache_tracks', len(self.tracks))
+
+    def clear(self):
+        with self.lock:
+            self.tracks.clear()
+            self.size = 0
+            self.update_gauges()
+
+_packet_cache = None
+_packet_cache_lock = threading.Lock()
+
+def get_packet_cache():
+    """Returns the process-wide packet cache, sized by PHONOGRAPH_PACKET_CACHE_MB (0 turns it off)."""
+    global _packet_cache
+    with _packet_cache_lock:
+        if _packet_cache is None:
+            try:
+                budget_mb = float(os.getenv('PHONOGRAPH_PACKET_CACHE_MB', DEFAULT_PACKET_CACHE_MB))
+            except ValueError:
+                budget_mb = DEFAULT_PACKET_CACHE_MB
+            _packet_cache = PacketCache(int(max(budget_mb, 0) * 1024 * 1024))
+            metrics.set_gauge('phonograph_packet_cache_budget_bytes', _packet_cache.budget)
+        return _packet_cache
+
+class GrowingFile:
+    """
+    Read-only view of a cache file that a writer is still appending to (see CacheTee in audio_engine).
+    Reads wait until the requested bytes exist or the writer has finished. The file is reopened for every
+    read, so the writer can atomically rename it into place (even on Windows) while playback is reading it.
+    The writer provides: condition, written (bytes on disk), finished and read_path (None once discarded).
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.pos = 0
+
+    def read(self, size):
+        writer = self.writer
+        with writer.condition:
+            while writer.written < self.pos + size and not writer.finished:
+                writer.condition.wait()
+            if writer.read_path is None:
+                return b''
+            with open_cache_file(writer.read_path) as f:
+                f.seek(self.pos)
+                data = f.read(size)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset):
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
+
+class OggOpusSource(discord.AudioSource):
+    """
+    Plays a cached Ogg/Opus file by passing its packets straight to the voice client: no ffmpeg process.
+    Hot tracks are served from the packet cache in memory instead of the file.
+    While should_loop() is true the stream wraps from loop_end back to loop_start in-process,
+    so loops are gapless. Loop points are 48 kHz sample offsets, applied at packet (20 ms) granularity.
+    """
+    def __init__(self, path, start_seconds=0.0, should_loop=None, loop_start=0, loop_end=None, on_loop=None):
+        self.reader = get_packet_cache().open(path)
+        self.should_loop = should_loop or (lambda: False)
+        self.loop_start = loop_start or 0
+        self.loop_end = loop_end
+        self.on_loop = on_loop
+        self.lock = threading.Lock()
+        self.position = start_seconds  # Start of the last packet handed out, in seconds
+        self.packets = self.reader.packets_from(int(start_seconds * OPUS_SAMPLE_RATE))
+
+    def is_opus(self):
+        return True
+
+    def seek(self, seconds):
+        """Jumps to a new position in-place; the voice client keeps playing without a restart."""
+        with self.lock:
+            self.packets.close()
+            self.packets = self.reader.packets_from(int(seconds * OPUS_SAMPLE_RATE))
+            self.position = seconds
+
+    def read(self):
+        with self.lock:
+            return self.read_packet()
+
+    def read_packet(self):
+        item = next(self.packets, None)
+        if item is not None and (self.loop_end is None or item[0] < self.loop_end or not self.should_loop()):
+            self.position = max(item[0], 0) / OPUS_SAMPLE_RATE
+            return item[1]
+
+        if self.should_loop():
+            self.packets.close()
+            self.packets = self.reader.packets_from(self.loop_start)
+            if self.on_loop:
+                self.on_loop(self.loop_start / OPUS_SAMPLE_RATE)
+            item = next(self.packets, None)
+            if item is not None:
+                self.position = max(item[0], 0) / OPUS_SAMPLE_RATE
+                return item[1]
+        return b''
+
+    def cleanup(self):
+        with self.lock:
+            self.packets.close()
+            self.reader.close()
+
+class TeeOpusSource(OggOpusSource):
+    """
+    Plays a track from the cache file a writer (CacheTee) is still encoding, through a GrowingFile.
+    The demuxer is opened on the first read, on the audio player thread, so starting playback
+    never waits for ffmpeg to produce the stream headers.
+    """
+    def __init__(self, writer, should_loop=None, loop_start=0, loop_end=None, on_loop=None):
+        self.writer = writer
+        self.reader = None
+        self.should_loop = should_loop or (lambda: False)
+        self.loop_start = loop_start or 0
+        self.loop_end = loop_end
+        self.on_loop = on_loop
+        self.lock = threading.Lock()
+        self.position = 0.0
+        self.packets = iter(())
+
+    def open_reader(self):
+        if self.reader is None:
+            self.reader = OggOpusReader(self.writer.temp_path, file=GrowingFile(self.writer))
+            self.packets = self.reader.packets_from(0)
+
+    def seek(self, seconds):
+        with self.lock:
+            self.open_reader()
+        super().seek(seconds)
+
+    def read(self):
+        with self.lock:
+            try:
+                self.open_reader()
+            except (OSError, ValueError) as e:
+                print(f"[OggOpus] Could not read the stream being cached: {e}")
+                return b''
+            return self.read_packet()
+
+    def cleanup(self):
+        with self.lock:
+            if self.reader is not None:
+                self.packets.close()
+                self.reader.close()
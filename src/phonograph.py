@@ -1,22 +1,24 @@
-import os
-import ctypes
+import time
+STARTED = time.perf_counter()  # Start of the cold-start profile (see --profile-startup)
 
-# Fix for High DPI scaling on Windows
-try:
-    ctypes.windll.shcore.SetProcessDpiAwareness(2) # 2 = PER_MONITOR_DPI_AWARE
-except Exception:
-    pass # Non-Windows or older Windows versions
+import os
+import sys
+import argparse
+import threading
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-import asyncio
-import threading
-import customtkinter as ctk
 
-# Import modular components
-from .audio_engine import state
-from .gui_controller import PhonographGUI
+# Import modular components (the GUI stack is only imported when the GUI starts)
 from .bot_commands import register_commands
+from .control_api import start_control_api
+from .library import LibraryScanner, get_library_dir
+from .audio_engine import start_optimization_worker
+from .transcoder import get_scheduler
+from .cache_manager import start_cache_maintenance, collect_garbage, compact_cache, cache_summary_lines
+from .metrics import start_exporter, read_process_stats, monitor_event_loop
+
+IMPORTED = time.perf_counter()
 
 # Load environment variables
 load_dotenv()
@@ -27,27 +29,101 @@ intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
-# Register Discord Commands
-register_commands(bot)
+class LaunchState:
+    headless = False
+    profile_startup = False
+    started = False  # on_ready fires again after reconnects
+    scanner = None
+
+launch = LaunchState()
+
+def wants_headless(args):
+    """Headless when asked for (--headless / PHONOGRAPH_HEADLESS=1) or when there is no display to open a window on."""
+    if args.headless or os.getenv('PHONOGRAPH_HEADLESS', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    return sys.platform.startswith('linux') and not (os.getenv('DISPLAY') or os.getenv('WAYLAND_DISPLAY'))
 
 def run_gui(bot):
     """Launches the tkinter GUI."""
+    import ctypes
+    # Fix for High DPI scaling on Windows
+    try:
+        ctypes.windll.shcore.SetProcessDpiAwareness(2) # 2 = PER_MONITOR_DPI_AWARE
+    except Exception:
+        pass # Non-Windows or older Windows versions
+    import customtkinter as ctk
+    from .gui_controller import PhonographGUI
+
     root = ctk.CTk()
     # Pass both the root and the bot instance for cross-module communication
     gui = PhonographGUI(root, bot)
     root.mainloop()
 
+def watch_library():
+    """Headless replacement for the GUI's folder view: keeps the library folder optimized as files change."""
+    def on_changes(added, modified, removed):
+        if removed:
+            get_scheduler().cancel(removed)
+        if added or modified:
+            start_optimization_worker(added + modified)
+
+    launch.scanner = LibraryScanner(get_library_dir(), on_changes).start()
+    print(f"[Phonograph] Watching library: {launch.scanner.root}")
+
+def print_startup_profile():
+    ready = time.perf_counter()
+    gui_loaded = any(name in sys.modules for name in ('tkinter', 'customtkinter'))
+    stats = read_process_stats(os.getpid())
+    memory = f"{stats[1] / 1e6:.0f} MB" if stats else "unknown"
+    print(f"[Startup] imports {IMPORTED - STARTED:.2f}s | login to on_ready {ready - IMPORTED:.2f}s | "
+          f"total {ready - STARTED:.2f}s | {len(sys.modules)} modules, GUI stack loaded: {'yes' if gui_loaded else 'no'} | "
+          f"RSS {memory}")
+
 @bot.event
 async def on_ready():
     print(f'[Phonograph] Logged in as {bot.user.name} (ID: {bot.user.id})')
     print('[Phonograph] Controller is active.')
-    
-    # Start the GUI in a separate thread
-    gui_thread = threading.Thread(target=run_gui, args=(bot,), daemon=True)
-    gui_thread.start()
+    if launch.started:
+        return
+    launch.started = True
+
+    if launch.profile_startup:
+        print_startup_profile()
+    bot.loop.create_task(monitor_event_loop())
+    start_control_api(bot, launch.headless)
+    start_cache_maintenance()
+    if launch.headless:
+        print('[Phonograph] Running headless: use the bot commands or the control API.')
+        watch_library()
+    else:
+        # Start the GUI in a separate thread
+        gui_thread = threading.Thread(target=run_gui, args=(bot,), daemon=True)
+        gui_thread.start()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="The Phonograph Discord music bot.")
+    parser.add_argument('--headless', action='store_true', help="Run without the GUI (implied when there is no display)")
+    parser.add_argument('--profile-startup', action='store_true', help="Print where cold start time went once the bot is ready")
+    parser.add_argument('--cache-stats', action='store_true', help="Print the cache size and hit rate, then exit")
+    parser.add_argument('--cache-clean', action='store_true', help="Clean the cache and enforce its size budget, then exit")
+    parser.add_argument('--cache-compact', action='store_true',
+                        help="Reclaim the space of removed entries in the packed cache, then exit (bot must not be running)")
+    args = parser.parse_args()
+    if args.cache_stats or args.cache_clean or args.cache_compact:
+        if args.cache_clean:
+            collect_garbage()
+        if args.cache_compact:
+            compact_cache()
+        print("\n".join(cache_summary_lines()))
+        sys.exit(0)
+    launch.headless = wants_headless(args)
+    launch.profile_startup = args.profile_startup
+
+    # Register Discord Commands
+    register_commands(bot, headless=launch.headless)
+
     if not TOKEN:
         print("Error: DISCORD_TOKEN not found in .env file.")
     else:
+        start_exporter()
         bot.run(TOKEN)
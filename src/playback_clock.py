@@ -0,0 +1,121 @@
+import time
+import threading
+import discord
+from .metrics import metrics
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960  # One 20 ms frame
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+JITTER_MAX_GAP = 1.0  # Longer pauses between reads are the player being paused, not jitter
+DRIFT_SAMPLE_FRAMES = 50  # Drift against the monotonic clock is sampled once per second of audio
+
+class FrameClock:
+    """
+    Playback position of a session, counted in the 20 ms frames actually handed to the voice client since
+    the last reset. Event loop lag, ffmpeg start-up and wall-clock jumps cannot move it, and it stops by
+    itself while the player is paused. Only the source attached last advances it, so a player that is
+    still winding down after a restart cannot.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.base = 0  # Sample position at the last reset
+        self.frames = 0  # Frames delivered since then
+        self.source = None
+        self.run = 0  # Changes whenever delivery is interrupted on purpose (reset, pause, resume)
+
+    def attach(self, source):
+        with self.lock:
+            self.source = source
+
+    def reset(self, seconds):
+        with self.lock:
+            self.base = int(round(seconds * SAMPLE_RATE))
+            self.frames = 0
+            self.run += 1
+
+    def interrupt(self):
+        """Marks a pause or resume, so the gap is not taken for jitter or drift."""
+        with self.lock:
+            self.run += 1
+
+    def tick(self, source):
+        with self.lock:
+            if source is self.source:
+                self.frames += 1
+
+    def samples(self):
+        with self.lock:
+            return self.base + self.frames * FRAME_SAMPLES
+
+    def position(self):
+        return self.samples() / SAMPLE_RATE
+
+class ClockedSource(discord.AudioSource):
+    """
+    The source handed to the voice client: passes another source's frames through, advancing the session's
+    FrameClock with each one. Its timing also feeds the frame metrics: time to first frame, read() jitter,
+    underruns, and the drift between the audio delivered and the monotonic clock.
+    """
+    def __init__(self, source, clock):
+        self.source = source
+        self.clock = clock
+        self.created_at = time.perf_counter()
+        self.last_read_at = None
+        self.run_started = 0.0  # Start of the current uninterrupted run of frames
+        self.run_frames = 0
+        self.run = None  # FrameClock.run the current run belongs to
+        self.lock = threading.Lock()  # Held while a frame is read and counted
+        clock.attach(self)
+
+    def is_opus(self):
+        # Asked after every read(), and the wrapped source may switch between Opus and PCM per frame
+        return self.source.is_opus()
+
+    def read(self):
+        started = time.perf_counter()
+        with self.lock:
+            data = self.source.read()
+            if data:
+                self.clock.tick(self)
+        if data:
+            self.record_frame_timing(started, time.perf_counter())
+        return data
+
+    def between_frames(self, action):
+        """
+        Runs action() while no frame is being read, so a seek or skip and the clock reset that goes
+        with it cannot race a frame from the old position. Returns its result.
+        """
+        with self.lock:
+            return action()
+
+    def record_frame_timing(self, started, finished):
+        metrics.inc('phonograph_frames_total')
+        run = self.clock.run
+        if self.last_read_at is None:
+            metrics.observe('phonograph_play_first_frame_seconds', finished - self.created_at)
+            metrics.set_gauge('phonograph_last_play_seconds', finished - self.created_at, stage="first_frame")
+        elif run == self.run and started - self.last_read_at < JITTER_MAX_GAP:
+            metrics.observe('phonograph_frame_jitter_seconds', abs(started - self.last_read_at - FRAME_SECONDS))
+        else:
+            self.run_frames = 0  # Paused or moved: the wall clock ran on without audio being due
+        self.run = run
+        if finished - started > FRAME_SECONDS:
+            metrics.inc('phonograph_underruns_total')
+        self.last_read_at = started
+
+        if self.run_frames == 0:
+            self.run_started = started
+        self.run_frames += 1
+        if self.run_frames % DRIFT_SAMPLE_FRAMES == 0:
+            # How far a wall-clock position would be off: positive when audio falls behind real time
+            drift = (started - self.run_started) - (self.run_frames - 1) * FRAME_SECONDS
+            metrics.set_gauge('phonograph_clock_drift_seconds', drift)
+            metrics.observe('phonograph_clock_drift_abs_seconds', abs(drift))
+
+    def cleanup(self):
+        self.source.cleanup()
+
+def unwrap_source(source):
+    """Returns the source a ClockedSource wraps (anything else as it is)."""
+    return source.source if isinstance(source, ClockedSource) else source
@@ -0,0 +1,313 @@
+import random
+import threading
+from array import array
+from collections import deque
+import discord
+from .ogg_opus import OggOpusSource
+from .playback_clock import FRAME_SECONDS
+
+PREPARE_AHEAD_SECONDS = 5.0  # Open the next track this long before the current one ends
+PREBUFFER_FRAMES = 50  # Frames (1 s) read from the next track in advance
+
+class TrackQueue:
+    """Thread-safe play queue of one guild session. on_change() is called after every modification."""
+    def __init__(self, on_change=None):
+        self.tracks = []
+        self.repeat_all = False
+        self.lock = threading.Lock()
+        self.on_change = on_change or (lambda: None)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.tracks)
+
+    def add(self, filepath):
+        with self.lock:
+            self.tracks.append(filepath)
+            length = len(self.tracks)
+        self.on_change()
+        return length
+
+    def remove(self, index):
+        """Removes and returns the track at a 0-based position."""
+        with self.lock:
+            track = self.tracks.pop(index)
+        self.on_change()
+        return track
+
+    def move(self, old_index, new_index):
+        with self.lock:
+            track = self.tracks.pop(old_index)
+            self.tracks.insert(new_index, track)
+        self.on_change()
+
+    def shuffle(self):
+        with self.lock:
+            random.shuffle(self.tracks)
+        self.on_change()
+
+    def clear(self):
+        with self.lock:
+            self.tracks.clear()
+        self.on_change()
+
+    def set_repeat_all(self, enabled):
+        self.repeat_all = enabled
+        self.on_change()
+
+    def peek(self, current=None):
+        """Returns the track that would play after `current` without consuming it."""
+        with self.lock:
+            if self.tracks:
+                return self.tracks[0]
+            return current if self.repeat_all else None
+
+    def pop_next(self, current=None):
+        """Consumes the next track. With repeat-all, the finished track goes back to the end of the queue."""
+        with self.lock:
+            if self.repeat_all and current:
+                self.tracks.append(current)
+            track = self.tracks.pop(0) if self.tracks else None
+        if track:
+            self.on_change()
+        return track
+
+def mix_pcm(a, gain_a, b, gain_b):
+    """Mixes two 16-bit stereo PCM frames with the given gains, clipping to the int16 range."""
+    left = array('h', a)
+    right = array('h', b)
+    if len(left) < len(right):
+        left.extend([0] * (len(right) - len(left)))
+    elif len(right) < len(left):
+        right.extend([0] * (len(left) - len(right)))
+    return array('h', (max(-32768, min(32767, int(x * gain_a + y * gain_b)))
+                       for x, y in zip(left, right))).tobytes()
+
+class PreparedTrack:
+    """An opened audio source plus frames already read from it, so it can start without delay."""
+    def __init__(self, filepath, source, duration, position=0.0):
+        self.filepath = filepath
+        self.source = source
+        self.duration = duration
+        self.position = position  # Seconds of audio consumed from this track
+        self.frames = deque()  # (frame, is_opus, native position of the frame) read ahead, not yet played
+        self.decoder = None
+
+    def prebuffer(self, count):
+        for _ in range(count):
+            data = self.source.read()
+            if not data:
+                break
+            self.frames.append((data, self.source.is_opus(), getattr(self.source, 'position', None)))
+
+    def read(self):
+        """Returns (frame, is_opus) for the next 20 ms, or (b'', True) at the end."""
+        if self.frames:
+            data, opus, _ = self.frames.popleft()
+        else:
+            data = self.source.read()
+            opus = self.source.is_opus()
+        if data:
+            self.position += FRAME_SECONDS
+        return data, opus
+
+    def read_pcm(self):
+        """Returns the next frame decoded to PCM, for mixing."""
+        return self.to_pcm(*self.read())
+
+    def to_pcm(self, data, opus):
+        if data and opus:
+            if self.decoder is None:
+                self.decoder = discord.opus.Decoder()
+            data = self.decoder.decode(data)
+        return data
+
+    def track_position(self):
+        # Native Opus sources know their exact position, including in-process loops and seeks
+        if isinstance(self.source, OggOpusSource):
+            # The source has already moved past the frames read ahead: the first of them plays next
+            return self.frames[0][2] if self.frames else self.source.position
+        return self.position
+
+    def cleanup(self):
+        self.source.cleanup()
+
+class QueueSource(discord.AudioSource):
+    """
+    Plays a session's current track and chains into the queued ones inside a single voice client play().
+    The next track is opened and prebuffered on a helper thread shortly before the current one ends,
+    so the switch happens between two 20 ms frames. With a crossfade set, the tail of the current track
+    and the head of the next are decoded and mixed; while the session has sound layers, every frame is
+    decoded and mixed with them. All other frames pass through untouched.
+    """
+    def __init__(self, session, filepath, source, duration, open_track, on_track_change, start_seconds=0.0):
+        self.session = session
+        self.open_track = open_track  # filepath -> (source, duration)
+        self.on_track_change = on_track_change  # (filepath, duration, position) after switching tracks
+        self.current = PreparedTrack(filepath, source, duration, start_seconds)
+        self.next = None
+        self.preparing = False
+        self.prepared_for = None  # Track the last preparation was started for, so failures are not retried every frame
+        self.closed = False
+        self.opus = source.is_opus()
+        self.lock = threading.Lock()
+
+    def is_opus(self):
+        # Reported per frame: crossfaded and layered frames are PCM, everything else keeps the source format
+        return self.opus
+
+    def upcoming_track(self):
+        """The track that follows the current one, or None when playback should end."""
+        if self.session.is_looping:
+            # Native sources loop in-process; others are reopened from the start
+            if isinstance(self.current.source, OggOpusSource):
+                return None
+            return self.current.filepath
+        return self.session.queue.peek(self.current.filepath)
+
+    def read(self):
+        with self.lock:
+            if self.closed:
+                return b''
+            self.maybe_prepare()
+            gain = self.crossfade_gain()
+            if gain is not None:
+                return self.mix_layers(self.read_crossfade(gain), False)
+
+            data, opus = self.current.read()
+            if not data:
+                if not self.advance():
+                    return b''
+                data, opus = self.current.read()
+            return self.mix_layers(data, opus)
+
+    def mix_layers(self, data, opus):
+        """Mixes the session's sound layers into a frame, if it has any."""
+        mixer = self.session.mixer
+        if data and mixer.active():
+            self.ensure_encoder()
+            data, opus = mixer.mix(self.current.to_pcm(data, opus)), False
+        self.opus = opus
+        return data
+
+    def maybe_prepare(self):
+        upcoming = self.upcoming_track()
+        if self.next is not None and self.next.filepath != upcoming:
+            # The queue changed after the next track was prepared
+            self.next.cleanup()
+            self.next = None
+            self.prepared_for = None
+        if self.next or self.preparing or not upcoming or upcoming == self.prepared_for:
+            return
+        if not self.current.duration:
+            return
+        remaining = self.current.duration - self.current.track_position()
+        if remaining > max(PREPARE_AHEAD_SECONDS, self.session.crossfade_seconds + 1):
+            return
+        self.preparing = True
+        self.prepared_for = upcoming
+        threading.Thread(target=self.prepare, args=(upcoming,), daemon=True).start()
+
+    def prepare(self, filepath):
+        """Opens and prebuffers the next track off the audio thread."""
+        try:
+            source, duration = self.open_track(filepath)
+            prepared = PreparedTrack(filepath, source, duration)
+            prepared.prebuffer(PREBUFFER_FRAMES)
+        except Exception as e:
+            print(f"[Queue] Could not prepare next track: {e}")
+            prepared = None
+
+        with self.lock:
+            self.preparing = False
+            if self.closed or self.next is not None:
+                if prepared:
+                    prepared.cleanup()
+                return
+            self.next = prepared
+
+    def crossfade_gain(self):
+        """Gain of the outgoing track while inside the crossfade window, otherwise None."""
+        fade = self.session.crossfade_seconds
+        if fade <= 0 or self.session.is_looping or not self.next or not self.current.duration:
+            return None
+        if self.next.filepath != self.upcoming_track():
+            return None
+        remaining = self.current.duration - self.current.track_position()
+        if remaining > fade:
+            return None
+        return max(remaining, 0.0) / fade
+
+    def read_crossfade(self, gain):
+        self.ensure_encoder()
+        self.opus = False
+        outgoing = self.current.read_pcm()
+        incoming = self.next.read_pcm()
+        if not outgoing:
+            # Outgoing track finished: the next one takes over, already mid-fade
+            self.advance()
+            return incoming or b''
+        return mix_pcm(outgoing, gain, incoming, 1.0 - gain) if incoming else outgoing
+
+    def ensure_encoder(self):
+        # The voice client only creates its encoder for sources that start out as PCM
+        vc = self.session.current_voice_client
+        if vc is not None and not getattr(vc, 'encoder', None):
+            vc.encoder = discord.opus.Encoder()
+            self.session.tune_encoder()
+
+    def advance(self, skip=False):
+        """Switches to the next track. Returns False if there is nothing left to play."""
+        upcoming = self.session.queue.peek(self.current.filepath) if skip else self.upcoming_track()
+        if not upcoming:
+            return False
+        repeating = self.session.is_looping and not skip
+
+        if self.next is not None and self.next.filepath == upcoming:
+            following = self.next
+        else:
+            # Not prepared in time (e.g. a skip): open it here
+            if self.next is not None:
+                self.next.cleanup()
+            try:
+                source, duration = self.open_track(upcoming)
+            except Exception as e:
+                print(f"[Queue] Could not open next track: {e}")
+                self.next = None
+                return False
+            following = PreparedTrack(upcoming, source, duration)
+        self.next = None
+
+        if not repeating:
+            self.session.queue.pop_next(self.current.filepath)
+        self.current.cleanup()
+        self.current = following
+        self.prepared_for = None
+        self.on_track_change(following.filepath, following.duration, following.track_position())
+        return True
+
+    def skip(self):
+        """Jumps straight to the next queued track. Returns False if the queue is empty."""
+        with self.lock:
+            return self.advance(skip=True)
+
+    def seek(self, seconds):
+        """Seeks the current track in-place. Returns False if its source cannot seek."""
+        with self.lock:
+            if not isinstance(self.current.source, OggOpusSource):
+                return False
+            self.current.source.seek(seconds)
+            self.current.frames.clear()
+            # A crossfade that already started no longer lines up
+            if self.next is not None and self.next.position > 0:
+                self.next.cleanup()
+                self.next = None
+            return True
+
+    def cleanup(self):
+        with self.lock:
+            self.closed = True
+            self.current.cleanup()
+            if self.next is not None:
+                self.next.cleanup()
+                self.next = None
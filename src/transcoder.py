@@ -0,0 +1,337 @@
+import os
+import time
+import heapq
+import weakref
+import itertools
+import threading
+from .audio_engine import (transcode_to_opus, get_audio_duration, is_file_optimized, report_cache_status,
+                           wait_for_cache_write)
+from .cache_manager import enforce_budget
+from .metrics import metrics
+from .events import bus, TRACK_STARTED
+
+# Job priorities, most urgent first
+PRIORITY_NOW = 0         # The track being played or hovered in the GUI
+PRIORITY_VISIBLE = 1     # Files in the folder on screen
+PRIORITY_BACKGROUND = 2  # Everything else, e.g. the headless library watcher
+
+# Fraction of the machine's cores the background transcodes may use (0.0 - 1.0)
+DEFAULT_CPU_BUDGET = 0.5
+CLAIM_POLL_SECONDS = 0.5  # A job waiting for another writer of its cache entry checks for cancellation this often
+
+def read_transcode_settings():
+    """
+    Reads the transcode pool settings from the environment (.env).
+    PHONOGRAPH_TRANSCODE_WORKERS overrides the worker count derived from PHONOGRAPH_CPU_BUDGET.
+    """
+    cores = os.cpu_count() or 1
+    try:
+        budget = float(os.getenv('PHONOGRAPH_CPU_BUDGET', DEFAULT_CPU_BUDGET))
+    except ValueError:
+        budget = DEFAULT_CPU_BUDGET
+    budget = min(max(budget, 0.0), 1.0)
+
+    try:
+        workers = int(os.getenv('PHONOGRAPH_TRANSCODE_WORKERS', '0'))
+    except ValueError:
+        workers = 0
+    if workers <= 0:
+        workers = int(cores * budget)
+    workers = max(1, min(workers, cores))
+
+    low_priority = os.getenv('PHONOGRAPH_LOW_PRIORITY', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+    return workers, low_priority
+
+class BatchStats:
+    """Aggregate throughput of one busy period of the scheduler (from the first job until the queue drains)."""
+    def __init__(self):
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_cancelled = 0
+        self.audio_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    @property
+    def files_per_second(self):
+        return self.files_done / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    @property
+    def audio_seconds_per_second(self):
+        return self.audio_seconds / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.files_done} files ({self.files_failed} failed, "
+                f"{self.files_cancelled} cancelled) in {self.wall_seconds:.1f}s - "
+                f"{self.files_per_second:.2f} files/s, {self.audio_seconds_per_second:.1f} audio-s/s")
+
+class TranscodeJob:
+    """One file waiting for or going through a transcode."""
+    def __init__(self, filepath, priority, owner):
+        self.filepath = filepath
+        self.base_priority = priority  # As submitted; promotions are undone back to it
+        self.priority = priority
+        self.owner = owner
+        self.seq = 0  # Identifies the job's live heap entry; older entries are skipped
+        self.running = False
+        self.rerun = False  # Submitted again while running: queued once more when it finishes
+        self.cancelled = False
+        self.process = None
+        self.lock = threading.Lock()
+
+    def attach(self, process):
+        """on_process hook of the audio engine: remembers the ffmpeg child so cancel() can kill it."""
+        with self.lock:
+            self.process = process
+            cancelled = self.cancelled
+        if cancelled:
+            process.kill()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+class TranscodeScheduler:
+    """
+    The process-wide queue of transcodes into the central cache, served by a fixed set of worker threads.
+    Every worker drives one single-threaded ffmpeg child, so the worker count is the CPU budget.
+
+    Jobs run most urgent first (PRIORITY_NOW, PRIORITY_VISIBLE, PRIORITY_BACKGROUND), each file at most once.
+    A job's owner (e.g. the GUI's folder scanner) can withdraw everything it queued with cancel_owner();
+    running jobs are stopped by killing their ffmpeg child and leave no cache files behind.
+    """
+    def __init__(self, workers=None, low_priority=None):
+        env_workers, env_low_priority = read_transcode_settings()
+        self.workers = workers or env_workers
+        self.low_priority = env_low_priority if low_priority is None else low_priority
+        self.condition = threading.Condition()
+        self.heap = []  # (priority, seq, job)
+        self.jobs = {}  # absolute path -> queued or running job
+        self.counter = itertools.count(1)
+        self.promoted = {}  # slot (e.g. "hover") -> path promoted to PRIORITY_NOW through it
+        self.retired_owners = weakref.WeakSet()
+        self.stats = None  # BatchStats of the current busy period
+        self.last_stats = None
+        self.busy_since = 0.0
+        self.closed = False
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f"phonograph-transcode-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def push(self, job):
+        job.seq = next(self.counter)
+        heapq.heappush(self.heap, (job.priority, job.seq, job))
+
+    def update_depth(self):
+        metrics.set_gauge('phonograph_transcode_queue_depth', len(self.jobs))
+
+    def submit(self, filepaths, priority=PRIORITY_BACKGROUND, owner=None):
+        """
+        Queues files for transcoding. Files already queued keep their job, moved up if this priority is more
+        urgent; a file whose transcode is running is queued once more after it, as its result may be stale.
+        """
+        with self.condition:
+            if self.closed or (owner is not None and self.is_retired(owner)):
+                return
+            for filepath in filepaths:
+                path = os.path.abspath(filepath)
+                job = self.jobs.get(path)
+                if job is None:
+                    job = self.jobs[path] = TranscodeJob(path, priority, owner)
+                    self.push(job)
+                elif job.running:
+                    # The running transcode may have started before the caller's change (e.g. a tee's commit)
+                    job.rerun = True
+                    job.base_priority = min(priority, job.base_priority)
+                elif priority < job.base_priority:
+                    # Queued: a more urgent copy replaces its heap entry (the old one is skipped when popped)
+                    job.base_priority = priority
+                    job.owner = owner if owner is not None else job.owner
+                    if priority < job.priority:
+                        job.priority = priority
+                        self.push(job)
+            if self.jobs and self.stats is None:
+                self.stats = BatchStats()
+                self.busy_since = time.monotonic()
+            self.update_depth()
+            self.condition.notify_all()
+
+    def is_retired(self, owner):
+        try:
+            return owner in self.retired_owners
+        except TypeError:
+            return False  # Owners that cannot be weakly referenced are never retired
+
+    def promote(self, filepath, slot):
+        """
+        Moves a queued file to the front. Each slot holds one promotion at a time ("hover", the playing
+        track of a guild...), so promoting another file through it demotes the previous one again.
+        """
+        path = os.path.abspath(filepath) if filepath else None
+        with self.condition:
+            previous = self.promoted.get(slot)
+            if previous == path:
+                return
+            if path is None:
+                self.promoted.pop(slot, None)
+            else:
+                self.promoted[slot] = path
+            if previous is not None and previous not in self.promoted.values():
+                job = self.jobs.get(previous)
+                if job and not job.running and job.priority != job.base_priority:
+                    job.priority = job.base_priority
+                    self.push(job)
+            job = self.jobs.get(path)
+            if job and not job.running and job.priority != PRIORITY_NOW:
+                job.priority = PRIORITY_NOW
+                self.push(job)
+                self.condition.notify_all()
+
+    def cancel(self, filepaths):
+        """Drops the given files from the queue, killing their transcode if it is running."""
+        with self.condition:
+            jobs = [self.jobs.pop(os.path.abspath(f)) for f in filepaths if os.path.abspath(f) in self.jobs]
+            self.update_depth()
+        for job in jobs:
+            job.cancel()
+
+    def cancel_owner(self, owner):
+        """
+        Withdraws every job an owner queued, except files promoted to the front, and ignores
+        its later submissions (owners that can be weakly referenced only).
+        """
+        with self.condition:
+            try:
+                self.retired_owners.add(owner)
+            except TypeError:
+                pass
+            jobs = [job for job in self.jobs.values() if job.owner is owner and job.priority != PRIORITY_NOW]
+            for job in jobs:
+                del self.jobs[job.filepath]
+            self.update_depth()
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            print(f"[Transcoder] Cancelled {len(jobs)} superseded jobs")
+
+    def next_job(self):
+        """Blocks until a job is due and marks it running; returns None once the scheduler is closed."""
+        with self.condition:
+            while True:
+                if self.closed:
+                    return None
+                while self.heap:
+                    priority, seq, job = heapq.heappop(self.heap)
+                    if seq == job.seq and not job.running and self.jobs.get(job.filepath) is job:
+                        job.running = True
+                        return job
+                self.condition.wait()
+
+    def work(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            try:
+                result, duration = self.run_job(job)
+            except Exception as e:
+                print(f"Transcoding error for {os.path.basename(job.filepath)}: {e}")
+                result, duration = "failed", 0.0
+            self.finish_job(job, result, duration)
+
+    def run_job(self, job):
+        """Transcodes one file unless it got cached meanwhile. Returns (result, audio seconds processed)."""
+        if is_file_optimized(job.filepath):
+            report_cache_status(job.filepath, True)
+            return "cached", 0.0
+        print(f"Optimizing: {os.path.basename(job.filepath)}")
+        success = transcode_to_opus(job.filepath, threads=1, low_priority=self.low_priority, on_process=job.attach)
+        while success is None and not job.cancelled:
+            # Another writer holds the file's cache entry (a first-play tee, or a cancelled job's ffmpeg still
+            # winding down): wait for it, then do whatever it left undone
+            if not wait_for_cache_write(job.filepath, CLAIM_POLL_SECONDS):
+                if self.closed:
+                    return "cancelled", 0.0
+                continue
+            if is_file_optimized(job.filepath):
+                report_cache_status(job.filepath, True)
+                return "cached", 0.0
+            success = transcode_to_opus(job.filepath, threads=1, low_priority=self.low_priority,
+                                        on_process=job.attach)
+        if job.cancelled:
+            return "cancelled", 0.0
+        if not success:
+            return "failed", 0.0
+        report_cache_status(job.filepath, is_file_optimized(job.filepath))
+        enforce_budget()
+        return "ok", get_audio_duration(job.filepath)
+
+    def finish_job(self, job, result, duration):
+        if result != "cached":
+            metrics.inc('phonograph_transcodes_total', result=result)
+        with self.condition:
+            if self.jobs.get(job.filepath) is job:
+                if job.rerun and result != "cancelled" and not self.closed:
+                    job.rerun = False
+                    job.running = False
+                    job.priority = job.base_priority
+                    self.push(job)
+                else:
+                    del self.jobs[job.filepath]
+            self.update_depth()
+            stats = self.stats
+            if stats is not None:
+                if result == "ok":
+                    stats.files_done += 1
+                    stats.audio_seconds += duration
+                elif result == "failed":
+                    stats.files_failed += 1
+                elif result == "cancelled":
+                    stats.files_cancelled += 1
+            drained = not self.jobs and stats is not None
+            if drained:
+                stats.wall_seconds = time.monotonic() - self.busy_since
+                self.stats = None
+                self.last_stats = stats
+            self.condition.notify_all()
+        if drained and (stats.files_done or stats.files_failed):
+            print(f"Optimization complete. {stats}")
+
+    def run_batch(self, filepaths, priority=PRIORITY_BACKGROUND):
+        """Queues the files and blocks until the queue has drained; returns the stats of that busy period."""
+        self.submit(filepaths, priority)
+        with self.condition:
+            while self.jobs and not self.closed:
+                self.condition.wait()
+            return self.last_stats or BatchStats()
+
+    def shutdown(self):
+        """Cancels everything and stops the worker threads."""
+        with self.condition:
+            self.closed = True
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+            self.update_depth()
+            self.condition.notify_all()
+        for job in jobs:
+            job.cancel()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Returns the process-wide transcode scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TranscodeScheduler()
+            # Whatever a guild starts playing jumps the queue
+            bus.subscribe(TRACK_STARTED, lambda event, payload: _scheduler.promote(
+                payload['filepath'], ("playing", payload['session'].guild_id)))
+            mode = "low priority" if _scheduler.low_priority else "normal priority"
+            print(f"[Transcoder] Scheduler ready: {_scheduler.workers} workers ({mode})")
+        return _scheduler
@@ -0,0 +1,152 @@
+import os
+import struct
+from .cache_store import cache_file_exists, map_cache_file, store_cache_file
+
+try:
+    import numpy as np  # Optional: needed for waveform overviews
+except ImportError:
+    np = None
+
+# ffmpeg decodes a mono copy of the track at this rate for the overview; plenty for drawing
+WAVEFORM_SAMPLE_RATE = 12000
+WAVEFORM_ARGS = ['-ac', '1', '-ar', str(WAVEFORM_SAMPLE_RATE), '-f', 's16le']
+BLOCK_SAMPLES = 256  # Samples per bin of the finest level (~21 ms)
+HEADER = struct.Struct('<4sHHIII12x')  # magic, version, levels, sample rate, block samples, bins in level 0
+MAGIC = b'PHWF'
+VERSION = 1
+
+def waveform_supported():
+    return np is not None
+
+def get_waveform_path(cache_file):
+    """Returns the path of the waveform overview stored alongside a cached Opus file."""
+    return cache_file + ".peaks"
+
+def level_sizes(bins, levels):
+    """Bins in each level: every level halves the one before."""
+    sizes = []
+    for _ in range(levels):
+        sizes.append(bins)
+        bins = (bins + 1) // 2
+    return sizes
+
+class WaveformBuilder:
+    """
+    Reduces a stream of mono 16-bit PCM (fed in arbitrary chunks, as ffmpeg writes it) to per-bin peak
+    and RMS levels, a whole block of bins at a time with NumPy.
+    """
+    def __init__(self):
+        self.pending = b''
+        self.peaks = []
+        self.squares = []  # Mean square of every bin
+
+    def feed(self, chunk):
+        data = self.pending + chunk
+        usable = len(data) - len(data) % (BLOCK_SAMPLES * 2)
+        self.pending = data[usable:]
+        if usable:
+            self.reduce(np.frombuffer(data[:usable], dtype=np.int16).reshape(-1, BLOCK_SAMPLES))
+
+    def reduce(self, blocks):
+        samples = blocks.astype(np.float32) / 32768.0
+        self.peaks.append(np.abs(samples).max(axis=1))
+        self.squares.append(np.square(samples).mean(axis=1))
+
+    def finish(self):
+        """Returns the levels, finest first, each an (n, 2) uint8 array of (peak, rms)."""
+        if len(self.pending) >= 2:
+            tail = np.frombuffer(self.pending[:len(self.pending) - len(self.pending) % 2], dtype=np.int16)
+            self.reduce(tail.reshape(1, -1))
+            self.pending = b''
+        peaks = np.concatenate(self.peaks) if self.peaks else np.zeros(0, np.float32)
+        squares = np.concatenate(self.squares) if self.squares else np.zeros(0, np.float32)
+
+        levels = [quantize(peaks, squares)]
+        while len(peaks) > 1:
+            if len(peaks) % 2:
+                peaks = np.append(peaks, 0.0)
+                squares = np.append(squares, squares[-1])
+            peaks = peaks.reshape(-1, 2).max(axis=1)
+            squares = squares.reshape(-1, 2).mean(axis=1)
+            levels.append(quantize(peaks, squares))
+        return levels
+
+def quantize(peaks, squares):
+    # Stored on a square-root scale so quiet passages keep some resolution in a byte
+    values = np.stack([np.sqrt(peaks), np.sqrt(np.sqrt(squares))], axis=1)
+    return np.round(np.clip(values, 0.0, 1.0) * 255).astype(np.uint8)
+
+def write_waveform(path, levels):
+    """
+    Stores the levels of a WaveformBuilder in the cache; it only appears once it is complete.
+    Returns False for a track without audio, which gets no overview.
+    """
+    if not len(levels[0]):
+        return False
+    temp_path = path + ".part"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(levels), WAVEFORM_SAMPLE_RATE, BLOCK_SAMPLES, len(levels[0])))
+        for level in levels:
+            f.write(level.tobytes())
+    store_cache_file(temp_path, path)
+    return True
+
+class Waveform:
+    """A stored overview, memory-mapped: drawing any range at any width touches only the bins it needs."""
+    def __init__(self, path):
+        view = map_cache_file(path)
+        raw = np.frombuffer(view, dtype=np.uint8) if view is not None else np.memmap(path, dtype=np.uint8, mode='r')
+        if len(raw) < HEADER.size:
+            raise ValueError(f"{path} is not a waveform overview")
+        magic, version, levels, rate, block, bins = HEADER.unpack(raw[:HEADER.size].tobytes())
+        if magic != MAGIC or version != VERSION or not levels:
+            raise ValueError(f"{path} is not a waveform overview")
+        data = raw[HEADER.size:]
+        self.levels = []
+        offset = 0
+        for size in level_sizes(bins, levels):
+            self.levels.append(data[offset:offset + size * 2].reshape(-1, 2))
+            offset += size * 2
+        self.bin_seconds = block / rate
+        self.duration = bins * self.bin_seconds
+
+    def columns(self, start, end, width):
+        """
+        Returns (peak, rms) arrays of `width` values from 0.0 to 1.0 (square-root scale) covering
+        start - end seconds, read from the coarsest level that still has a bin per column.
+        """
+        width = max(int(width), 1)
+        span = max(end - start, self.bin_seconds)
+        level = 0
+        while level + 1 < len(self.levels) and span / (self.bin_seconds * 2 ** (level + 1)) >= width:
+            level += 1
+        bins = self.levels[level]
+        scale = self.bin_seconds * 2 ** level
+        edges = np.linspace(start / scale, (start + span) / scale, width + 1)
+        first = np.clip(np.floor(edges[:-1]).astype(np.int64), 0, None)
+        peak = np.zeros(width, np.float32)
+        rms = np.zeros(width, np.float32)
+        inside = np.flatnonzero(first < len(bins))  # Columns past the end of the track stay empty
+        if len(inside):
+            first = first[inside]
+            stop = min(max(int(np.ceil(edges[inside[-1] + 1])), first[-1] + 1), len(bins))
+            values = bins[first[0]:stop].astype(np.float32) / 255.0
+            starts = first - first[0]
+            # Each column covers its bins up to the next column's first; zoomed in, columns share one bin
+            ends = np.append(starts[1:], len(values))
+            counts = np.where(ends > starts, ends - starts, 1)
+            peak[inside] = np.maximum.reduceat(values[:, 0], starts)
+            # Averaged as power (the stored scale is the square root of the RMS), then back
+            power = np.add.reduceat(values[:, 1] ** 4, starts)
+            rms[inside] = (power / counts) ** 0.25
+        return peak, rms
+
+def load_waveform(path):
+    """Returns the stored overview at a path, or None if there is none (or NumPy is missing)."""
+    if np is None or not cache_file_exists(path):
+        return None
+    try:
+        return Waveform(path)
+    except (OSError, ValueError) as e:
+        print(f"[Waveform] Could not read {os.path.basename(path)}: {e}")
+        return None
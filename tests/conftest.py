@@ -0,0 +1,65 @@
+import os
+import sys
+import struct
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FRAME_SAMPLES = 960
+PRE_SKIP = 312
+
+def ogg_page(header_type, granule, sequence, lacing, body):
+    # The demuxer does not verify page checksums, so they are left at 0
+    return (struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule, 1, sequence, 0, len(lacing))
+            + bytes(lacing) + body)
+
+def lace(size):
+    return [255] * (size // 255) + [size % 255]
+
+def opus_packets(count):
+    """20 ms CELT packets (TOC 0xF8) whose second byte is their index, with varying sizes."""
+    return [bytes([0xF8, i % 256]) + bytes(i % 7 * 100) for i in range(count)]
+
+def write_ogg_opus(path, packets, pre_skip=PRE_SKIP, packets_per_page=10):
+    """Writes packets as a minimal Ogg Opus stream, packets_per_page packets to each page."""
+    head = b'OpusHead' + bytes([1, 2]) + struct.pack('<HIhB', pre_skip, 48000, 0, 0)
+    tags = b'OpusTags' + struct.pack('<I', 0) + struct.pack('<I', 0)
+    data = ogg_page(2, 0, 0, lace(len(head)), head) + ogg_page(0, 0, 1, lace(len(tags)), tags)
+    sequence = 2
+    for start in range(0, len(packets), packets_per_page):
+        chunk = packets[start:start + packets_per_page]
+        lacing = [value for packet in chunk for value in lace(len(packet))]
+        granule = (start + len(chunk)) * FRAME_SAMPLES
+        last = start + packets_per_page >= len(packets)
+        data += ogg_page(4 if last else 0, granule, sequence, lacing, b''.join(chunk))
+        sequence += 1
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+@pytest.fixture
+def opus_file(tmp_path):
+    """A 10 second Ogg Opus file (500 packets) and its packets."""
+    packets = opus_packets(500)
+    return write_ogg_opus(str(tmp_path / "track.opus"), packets), packets
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """audio_engine with its cache and metadata index moved into a temporary directory."""
+    pytest.importorskip("discord")
+    from src import audio_engine
+    from src.metadata_index import MetadataIndex
+    from src.cache_store import close_packs
+    monkeypatch.setattr(audio_engine.shared, 'cache_dir', str(tmp_path / "cache"))
+    monkeypatch.setattr(audio_engine.shared, 'index', MetadataIndex(str(tmp_path / "index.db")))
+    yield audio_engine
+    close_packs()
+
+@pytest.fixture
+def track(tmp_path, engine):
+    """A source file (not real audio) in the temporary library, older than any cache file a test writes."""
+    path = tmp_path / "track.flac"
+    path.write_bytes(b"not really audio")
+    os.utime(path, (1000, 1000))
+    return str(path)
@@ -0,0 +1,135 @@
+import os
+import time
+import types
+
+import pytest
+
+from src import cache_manager
+from src.playlist import QueueSource, PreparedTrack
+
+ENTRY_BYTES = 1000
+
+class FakeSource:
+    def read(self):
+        return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        pass
+
+@pytest.fixture
+def library(tmp_path, engine):
+    """Creates source files and gives each a cache entry of ENTRY_BYTES, last touched `age` days ago."""
+    engine.ensure_cache_dir()
+
+    def make(name, age=0.0, cached=True):
+        path = str(tmp_path / name)
+        with open(path, 'wb') as f:
+            f.write(name.encode())
+        os.utime(path, (1000, 1000))
+        if cached:
+            cache_file = engine.get_cache_path(path)
+            with open(cache_file, 'wb') as f:
+                f.write(bytes(ENTRY_BYTES))
+            stamp = time.time() - age * 86400
+            os.utime(cache_file, (stamp, stamp))
+        return path
+    return make
+
+@pytest.fixture
+def session(engine):
+    session = engine.get_session("guild", "Guild")
+    yield session
+    engine.remove_session("guild")
+
+def budget(monkeypatch, entries):
+    monkeypatch.setenv('PHONOGRAPH_CACHE_MAX_MB', str(entries * ENTRY_BYTES / (1024 * 1024)))
+
+def cached(engine, path):
+    return os.path.exists(engine.get_cache_path(path))
+
+def test_eviction_removes_least_recently_used_entries(engine, library, monkeypatch):
+    old, older, recent = library("old", age=2), library("older", age=3), library("recent", age=1)
+    budget(monkeypatch, 1.2)
+    assert cache_manager.enforce_budget() == 2 * ENTRY_BYTES  # Down to 90% of the budget
+    assert [cached(engine, p) for p in (old, older, recent)] == [False, False, True]
+
+def test_lfu_eviction_keeps_the_most_played_entry(engine, library, monkeypatch):
+    popular, rare = library("popular", age=5), library("rare", age=1)
+    for _ in range(3):
+        engine.shared.index.record_play(popular, True)
+    budget(monkeypatch, 1.5)
+    monkeypatch.setenv('PHONOGRAPH_CACHE_POLICY', 'lfu')
+    cache_manager.enforce_budget()
+    assert cached(engine, popular) and not cached(engine, rare)
+
+def test_entries_in_use_are_never_evicted(engine, library, session, monkeypatch):
+    current, following, layer, idle = (library("current", age=4), library("next", age=4),
+                                       library("layer", age=4), library("idle", age=4))
+    session.current_track_path = current
+    queue_source = QueueSource(session, current, FakeSource(), 10.0, None, lambda *change: None)
+    queue_source.next = PreparedTrack(following, FakeSource(), 10.0)
+    session.current_voice_client = types.SimpleNamespace(is_playing=lambda: True, is_paused=lambda: False,
+                                                         source=queue_source)
+    session.mixer.add("rain", layer, lambda l: FakeSource())
+
+    budget(monkeypatch, 0.5)
+    cache_manager.enforce_budget()
+    assert [cached(engine, p) for p in (current, following, layer, idle)] == [True, True, True, False]
+
+def test_cleanup_removes_orphans_after_the_grace_period(engine, library, tmp_path):
+    kept = library("kept", age=30)
+    engine.get_content_key(kept)  # Indexed: its entry is referenced
+    orphan = library("orphan", age=cache_manager.ORPHAN_GRACE_DAYS + 1)
+    fresh_orphan = library("fresh", age=1)
+    orphan_file, fresh_file = engine.get_cache_path(orphan), engine.get_cache_path(fresh_orphan)
+    engine.shared.index.forget(orphan)
+    engine.shared.index.forget(fresh_orphan)
+    os.remove(orphan)
+    os.remove(fresh_orphan)
+    partial = os.path.join(engine.shared.cache_dir, "abandoned.opus.part")
+    with open(partial, 'wb') as f:
+        f.write(b"x")
+    os.utime(partial, (1000, 1000))
+
+    cache_manager.collect_garbage()
+    assert cached(engine, kept)
+    assert not os.path.exists(orphan_file)
+    assert os.path.exists(fresh_file)
+    assert not os.path.exists(partial)
+
+def test_cleanup_keeps_the_entry_and_history_of_a_moved_folder(engine, library, tmp_path):
+    track = library("track", age=30)
+    key = engine.get_content_key(track)
+    engine.shared.index.record_play(track, True)
+    engine.shared.index.update(track, loop_start=48000)
+    moved_dir = tmp_path / "moved"
+    moved_dir.mkdir()
+    moved = str(moved_dir / "track")
+    os.rename(track, moved)
+
+    cache_manager.collect_garbage()
+    assert os.path.exists(os.path.join(engine.shared.cache_dir, key + ".opus"))
+    assert engine.shared.index.get(track)['missing_since'] is not None
+
+    # A rescan of the new location finds the entry, the loop points and the play history again
+    assert engine.get_content_key(moved) == key and cached(engine, moved)
+    entry = engine.shared.index.lookup(moved)
+    assert (entry['loop_start'], entry['play_count']) == (48000, 1)
+    assert engine.shared.index.get(track) is None
+
+def test_rows_of_missing_files_are_forgotten_after_the_grace_period(engine, library):
+    track = library("track", age=30)
+    key = engine.get_content_key(track)
+    os.remove(track)
+    cache_manager.collect_garbage()
+    long_ago = time.time() - (cache_manager.ORPHAN_GRACE_DAYS + 1) * 86400
+    conn = engine.shared.index.connect()
+    conn.execute("UPDATE tracks SET missing_since = ?", (long_ago,))
+    conn.commit()
+
+    cache_manager.collect_garbage()
+    assert engine.shared.index.get(track) is None
+    assert not os.path.exists(os.path.join(engine.shared.cache_dir, key + ".opus"))
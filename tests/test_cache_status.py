@@ -0,0 +1,28 @@
+def cache(engine, track, variant=None):
+    engine.ensure_cache_dir()
+    with open(engine.get_cache_path(track, variant), 'wb') as f:
+        f.write(b"OggS")
+
+def test_track_without_normalized_variant_is_pending(engine, track):
+    cache(engine, track)
+    assert not engine.is_file_optimized(track)
+
+def test_track_with_both_variants_is_optimized(engine, track):
+    cache(engine, track)
+    cache(engine, track, "norm")
+    assert engine.is_file_optimized(track)
+
+def test_unmeasurable_loudness_accepts_the_plain_entry(engine, track):
+    cache(engine, track)
+    engine.shared.index.update(track, normalizable=0)
+    assert engine.is_file_optimized(track)
+    assert engine.is_normalization_skipped(track)
+
+def test_status_is_rechecked_when_the_source_changes(engine, track):
+    cache(engine, track)
+    cache(engine, track, "norm")
+    assert engine.is_file_optimized(track)
+    with open(track, 'ab') as f:
+        f.write(b"edited")
+    # A new content key: the old entry no longer belongs to this file
+    assert not engine.is_file_optimized(track)
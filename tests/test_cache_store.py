@@ -0,0 +1,164 @@
+import os
+import threading
+
+import pytest
+
+from src import cache_store
+from src.cache_store import CachePack, PackedFile, RECORD, INDEX_HEADER
+from conftest import opus_packets, write_ogg_opus
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('PHONOGRAPH_CACHE_BACKEND', 'packed')
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    yield str(directory)
+    cache_store.close_packs()
+
+def reopen(pack):
+    pack.close()
+    return CachePack(pack.directory)
+
+def test_members_are_read_without_copying(cache_dir):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a.opus", b"0123456789")
+    f = PackedFile(pack.view("a.opus"))
+    chunk = f.read(4)
+    assert isinstance(chunk, memoryview) and chunk == b"0123"
+    f.seek(-2, 2)
+    assert f.read() == b"89" and f.read(10) == b""
+    pack.close()
+
+def test_ogg_reader_gives_the_same_packets_from_the_pack(cache_dir, tmp_path):
+    pytest.importorskip("discord")
+    from src.ogg_opus import OggOpusReader
+    packets = opus_packets(100)
+    loose = write_ogg_opus(str(tmp_path / "track.opus"), packets)
+    path = os.path.join(cache_dir, "track.opus")
+    cache_store.store_cache_file(loose, path)
+    assert not os.path.exists(loose) and cache_store.cache_file_exists(path)
+
+    reader = OggOpusReader(path)
+    read = [packet for _, packet in reader.packets_from(0)]
+    reader.close()
+    assert read == packets
+    assert all(type(packet) is bytes for packet in read)
+
+def test_reads_do_not_wait_for_a_commit_to_sync(cache_dir, monkeypatch):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a", b"playing")
+    syncing, release = threading.Event(), threading.Event()
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        syncing.set()
+        release.wait(5)
+        real_fsync(fd)
+    monkeypatch.setattr(cache_store.os, 'fsync', slow_fsync)
+    writer = threading.Thread(target=pack.put_bytes, args=("b", b"x" * 1000))
+    writer.start()
+    assert syncing.wait(5)
+
+    try:
+        assert bytes(pack.view("a")) == b"playing"
+        assert pack.lookup("b") is None  # Not visible before its record is on disk
+    finally:
+        release.set()
+        writer.join()
+    assert bytes(pack.view("b")) == b"x" * 1000
+    pack.close()
+
+def test_replaced_and_removed_members_survive_a_reload(cache_dir):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a", b"old")
+    pack.put_bytes("a", b"new!")
+    pack.put_bytes("b", b"gone")
+    assert pack.remove("b") and not pack.remove("b")
+
+    pack = reopen(pack)
+    assert bytes(pack.view("a")) == b"new!"
+    assert pack.lookup("b") is None
+    assert pack.garbage == len(b"old") + len(b"gone")
+    pack.close()
+
+def test_torn_journal_record_is_dropped(cache_dir):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a", b"kept")
+    pack.put_bytes("b", b"torn")
+    pack.close()
+    index_path = pack.index_path
+    with open(index_path, 'rb') as f:
+        journal = f.read()
+    # A crash while the second record was being written leaves only its first half
+    with open(index_path, 'wb') as f:
+        f.write(journal[:-(RECORD.size + 1) // 2])
+
+    pack = CachePack(cache_dir)
+    assert bytes(pack.view("a")) == b"kept"
+    assert pack.lookup("b") is None
+    assert os.path.getsize(index_path) == INDEX_HEADER.size + RECORD.size + 1
+
+    # New records go after the last intact one
+    pack.put_bytes("c", b"next")
+    pack = reopen(pack)
+    assert bytes(pack.view("c")) == b"next" and bytes(pack.view("a")) == b"kept"
+    pack.close()
+
+def test_corrupt_journal_record_ends_the_journal(cache_dir):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a", b"kept")
+    pack.put_bytes("b", b"lost")
+    pack.close()
+    with open(pack.index_path, 'r+b') as f:
+        f.seek(-1, 2)
+        f.write(b"x")  # Last byte of the member name
+
+    pack = CachePack(cache_dir)
+    assert pack.lookup("a") is not None and pack.lookup("b") is None
+    pack.close()
+
+def test_record_pointing_past_the_data_is_ignored(cache_dir):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a", b"kept")
+    pack.put_bytes("b", b"lost")
+    pack.close()
+    # The data file lost its tail (e.g. restored from an older backup)
+    with open(pack.data_path, 'r+b') as f:
+        f.truncate(6)
+
+    pack = CachePack(cache_dir)
+    assert pack.lookup("a") is not None and pack.lookup("b") is None
+    pack.close()
+
+def test_compaction_frees_garbage_and_absorbs_loose_files(cache_dir):
+    pack = CachePack(cache_dir)
+    pack.put_bytes("a", b"x" * 100)
+    pack.put_bytes("a", b"y" * 50)
+    pack.put_bytes("b", b"z" * 30)
+    pack.remove("b")
+    with open(os.path.join(cache_dir, "loose.opus"), 'wb') as f:
+        f.write(b"l" * 20)
+    old_data = pack.data_path
+
+    members, freed = pack.compact()
+    assert (members, freed) == (2, 130)
+    assert pack.garbage == 0 and pack.data_size() == 70
+    assert not os.path.exists(old_data)
+    assert not os.path.exists(os.path.join(cache_dir, "loose.opus"))
+
+    pack = reopen(pack)
+    assert bytes(pack.view("a")) == b"y" * 50
+    assert bytes(pack.view("loose.opus")) == b"l" * 20
+    assert pack.lookup("b") is None
+    pack.close()
+
+def test_files_backend_replaces_a_packed_copy(cache_dir, tmp_path, monkeypatch):
+    path = os.path.join(cache_dir, "a.opus")
+    cache_store.write_cache_file(path, b"packed")
+    assert bytes(cache_store.read_cache_file(path)) == b"packed"
+
+    monkeypatch.setenv('PHONOGRAPH_CACHE_BACKEND', 'files')
+    source = tmp_path / "a.part"
+    source.write_bytes(b"loose")
+    cache_store.store_cache_file(str(source), path)
+    assert cache_store.read_cache_file(path) == b"loose"
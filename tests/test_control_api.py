@@ -0,0 +1,60 @@
+import json
+import types
+import http.client
+
+import pytest
+
+pytest.importorskip("discord")
+
+from src import control_api
+
+TOKEN = "secret"
+
+@pytest.fixture
+def api():
+    api = control_api.ControlAPI(types.SimpleNamespace(loop=None), 0, TOKEN).start()
+    yield api
+    api.server.shutdown()
+    api.server.server_close()
+
+def request(api, method, path, body=None, host=None, token=TOKEN, content_type='application/json'):
+    port = api.server.server_address[1]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    headers = {'Host': host or f"127.0.0.1:{port}"}
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    if body is not None:
+        headers['Content-Type'] = content_type
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    result = response.status, json.loads(response.read())
+    conn.close()
+    return result
+
+def test_requests_need_the_token(api):
+    assert request(api, "GET", "/status", token=None)[0] == 401
+    assert request(api, "GET", "/status", token="guess")[0] == 401
+    status, payload = request(api, "GET", "/status")
+    assert status == 200 and payload['sessions'] == []
+
+def test_requests_for_other_hosts_are_rejected(api):
+    port = api.server.server_address[1]
+    assert request(api, "GET", "/status", host=f"attacker.example:{port}")[0] == 403
+    assert request(api, "GET", "/status", host=f"localhost:{port}")[0] == 200
+
+def test_post_bodies_must_be_json(api):
+    # What a web page can send without a CORS preflight
+    assert request(api, "POST", "/stop", body="{}", content_type="text/plain")[0] == 415
+    status, payload = request(api, "POST", "/stop", body="{}", content_type="application/json; charset=utf-8")
+    assert status == 409 and "voice channel" in payload['error']
+
+def test_a_token_is_generated_when_none_is_configured(engine, tmp_path, monkeypatch):
+    monkeypatch.delenv('PHONOGRAPH_CONTROL_TOKEN', raising=False)
+    monkeypatch.setattr(engine.shared, 'bot_root', str(tmp_path))
+    token = control_api.get_control_token()
+    assert len(token) >= 32
+    assert (tmp_path / control_api.TOKEN_FILE_NAME).read_text().strip() == token
+    assert control_api.get_control_token() == token  # Kept across restarts
+
+    monkeypatch.setenv('PHONOGRAPH_CONTROL_TOKEN', "configured")
+    assert control_api.get_control_token() == "configured"
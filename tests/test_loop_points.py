@@ -0,0 +1,44 @@
+import pytest
+
+SAMPLE_RATE = 48000
+
+def test_parse_silence_finds_leading_and_trailing_silence(engine):
+    stderr = ("[silencedetect @ 0x1] silence_start: 0\n"
+              "[silencedetect @ 0x1] silence_end: 2.013 | silence_duration: 2.013\n"
+              "[silencedetect @ 0x1] silence_start: 11.5\n")
+    assert engine.parse_silence(stderr, 12.5) == (2.013, 11.5)
+
+def test_parse_silence_accepts_silence_reported_as_ended_at_the_end(engine):
+    stderr = ("silence_start: -0.01\nsilence_end: 1.5 | silence_duration: 1.51\n"
+              "silence_start: 8\nsilence_end: 10 | silence_duration: 2\n")
+    assert engine.parse_silence(stderr, 10.0) == (1.5, 8.0)
+
+def test_parse_silence_leaves_gaps_in_the_middle_and_silent_tracks_alone(engine):
+    assert engine.parse_silence("", 10.0) == (0.0, None)
+    assert engine.parse_silence("silence_start: 3\nsilence_end: 4 | silence_duration: 1\n", 10.0) == (0.0, None)
+    assert engine.parse_silence("silence_start: 0\n", 10.0) == (0.0, None)
+    assert engine.parse_silence("silence_start: 0\nsilence_end: 10 | silence_duration: 10\n", 10.0) == (0.0, None)
+
+def test_audible_range_is_padded_and_drives_the_default_loop_points(engine, track):
+    assert engine.get_loop_points(track) == (0, None)
+    engine.store_audible_range(track, (2.0, 9.0))
+    pad = int(engine.SILENCE_PAD_SECONDS * SAMPLE_RATE)
+    start, end = 2 * SAMPLE_RATE - pad, 9 * SAMPLE_RATE + pad
+    assert engine.get_audible_range(track) == (start, end)
+    assert engine.get_loop_points(track) == (start, end)
+    assert engine.get_play_start(track) == pytest.approx(start / SAMPLE_RATE)
+
+def test_explicit_zero_loop_start_is_kept(engine, track):
+    engine.store_audible_range(track, (2.0, None))
+    engine.set_loop_points(track, 0, 5.0)
+    assert engine.get_loop_points(track) == (0, 5 * SAMPLE_RATE)
+
+    # Clearing the points returns to the audible part
+    engine.set_loop_points(track, None, None)
+    assert engine.get_loop_points(track)[0] == engine.get_audible_range(track)[0] > 0
+
+def test_skip_silence_can_be_turned_off(engine, track, monkeypatch):
+    engine.store_audible_range(track, (2.0, 9.0))
+    monkeypatch.setenv('PHONOGRAPH_SKIP_SILENCE', '0')
+    assert engine.get_loop_points(track) == (0, None)
+    assert engine.get_play_start(track) == 0
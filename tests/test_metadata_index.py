@@ -0,0 +1,101 @@
+import os
+import sqlite3
+
+import pytest
+
+from src.metadata_index import MetadataIndex, COLUMNS
+
+@pytest.fixture
+def index(tmp_path):
+    index = MetadataIndex(str(tmp_path / "db" / "index.db"))
+    yield index
+    if index.conn is not None:
+        index.conn.close()
+
+@pytest.fixture
+def track(tmp_path):
+    path = tmp_path / "track.flac"
+    path.write_bytes(b"audio")
+    return str(path)
+
+def test_rows_are_trusted_while_the_file_is_unchanged(index, track):
+    assert index.lookup(track) is None
+    index.update(track, duration=12.5, codec='flac')
+    entry = index.lookup(track)
+    assert entry['duration'] == 12.5 and entry['codec'] == 'flac'
+    assert entry['size'] == 5 and entry['path'] == os.path.abspath(track)
+
+    st = os.stat(track)
+    os.utime(track, (st.st_atime, st.st_mtime + 10))
+    assert index.lookup(track) is None
+    assert index.get(track)['duration'] == 12.5  # Still stored, just not trusted
+
+def test_changed_file_drops_every_derived_field(index, track):
+    index.update(track, duration=12.5, loudness_i=-14.0, audio_start=100, content_key='abc')
+    index.set_cache_status(track, True, "cache/abc.opus")
+    with open(track, 'ab') as f:
+        f.write(b" but longer")
+
+    index.update(track, codec='mp3')
+    entry = index.lookup(track)
+    assert entry['codec'] == 'mp3' and entry['size'] == 16
+    for field in ('duration', 'loudness_i', 'audio_start', 'content_key', 'optimized', 'cache_path'):
+        assert entry[field] is None
+
+def test_retagged_file_keeps_its_loop_points_and_history(index, track):
+    index.update(track, duration=12.5, loop_start=48000, loop_end=96000)
+    index.record_play(track, cache_hit=True)
+    with open(track, 'ab') as f:
+        f.write(b"new tags")
+
+    index.update(track, codec='flac')
+    entry = index.lookup(track)
+    assert entry['duration'] is None
+    assert (entry['loop_start'], entry['loop_end']) == (48000, 96000)
+    assert (entry['play_count'], entry['cached_plays']) == (1, 1) and entry['last_played']
+
+def test_unchanged_file_keeps_fields_not_updated(index, track):
+    index.update(track, duration=12.5)
+    index.update(track, codec='flac')
+    assert index.lookup(track)['duration'] == 12.5
+
+def test_unknown_fields_and_missing_files(index, track, tmp_path):
+    with pytest.raises(ValueError):
+        index.update(track, colour='blue')
+    index.update(str(tmp_path / "missing.flac"), duration=1.0)
+    assert index.rows() == []
+
+def test_missing_columns_are_added_to_old_databases(tmp_path, track):
+    db_path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE tracks (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, duration REAL)")
+    conn.execute("INSERT INTO tracks VALUES (?, 1, 2.0, 3.0)", (os.path.abspath(track),))
+    conn.commit()
+    conn.close()
+
+    index = MetadataIndex(db_path)
+    assert set(index.get(track)) == {'path'} | set(COLUMNS)
+    assert index.get(track)['duration'] == 3.0
+    index.conn.close()
+
+def test_record_play_counts_plays_and_cache_hits(index, track):
+    index.record_play(track, cache_hit=False)
+    index.record_play(track, cache_hit=True)
+    index.record_play(track, cache_hit=True)
+    entry = index.lookup(track)
+    assert (entry['play_count'], entry['cached_plays']) == (3, 2)
+    assert entry['last_played'] is not None
+
+def test_evicted_cache_key_is_invalidated_for_every_copy(index, track, tmp_path):
+    copy = tmp_path / "copy.flac"
+    copy.write_bytes(b"audio")
+    for path in (track, str(copy)):
+        index.update(path, content_key='abc', optimized=1, cache_path="cache/abc.opus",
+                     normalized_path="cache/abc.norm.opus")
+    index.invalidate_cache_key('abc')
+    for path in (track, str(copy)):
+        entry = index.lookup(path)
+        assert (entry['optimized'], entry['cache_path'], entry['normalized_path']) == (0, None, None)
+
+    index.forget(track)
+    assert index.get(track) is None
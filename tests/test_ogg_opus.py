@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+pytest.importorskip("discord")
+
+from src.cache_store import close_packs
+from src.ogg_opus import (OggOpusReader, OggOpusSource, opus_packet_samples, get_packet_cache,
+                          write_page_index, load_page_index, get_index_path, FLAG_CONTINUED)
+from conftest import FRAME_SAMPLES, PRE_SKIP, ogg_page, lace, write_ogg_opus
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    yield
+    get_packet_cache().clear()
+    close_packs()
+
+def read_all(path, sample=0):
+    reader = OggOpusReader(path)
+    try:
+        return list(reader.packets_from(sample))
+    finally:
+        reader.close()
+
+def test_packet_durations_come_from_the_toc_byte():
+    assert opus_packet_samples(b'') == 0
+    assert opus_packet_samples(bytes([0xF8])) == 960  # CELT 20 ms, one frame
+    assert opus_packet_samples(bytes([0xF9])) == 1920  # Two frames
+    assert opus_packet_samples(bytes([0xFB, 0x03])) == 2880  # Code 3: frame count in the second byte
+    assert opus_packet_samples(bytes([0x08])) == 960  # SILK 20 ms
+
+def test_headers_and_packet_positions(opus_file):
+    path, packets = opus_file
+    reader = OggOpusReader(path)
+    assert (reader.channels, reader.pre_skip) == (2, PRE_SKIP)
+    assert reader.duration() == pytest.approx((500 * FRAME_SAMPLES - PRE_SKIP) / 48000)
+    reader.close()
+
+    read = read_all(path)
+    assert [packet for _, packet in read] == packets
+    assert [position for position, _ in read] == [i * FRAME_SAMPLES - PRE_SKIP for i in range(500)]
+
+def test_packets_continued_across_pages_are_joined(tmp_path):
+    path = write_ogg_opus(str(tmp_path / "track.opus"), [])
+    long_packet = bytes([0xF8]) + bytes(range(256)) * 2
+    short = bytes([0xF8, 1])
+    first, rest = long_packet[:510], long_packet[510:]
+    with open(path, 'ab') as f:
+        # Page 2 only holds the start of the long packet, page 3 completes it and adds one more
+        f.write(ogg_page(0, -1, 2, [255, 255], first))
+        f.write(ogg_page(FLAG_CONTINUED | 4, 2 * FRAME_SAMPLES, 3, lace(len(rest)) + lace(len(short)), rest + short))
+
+    read = read_all(path)
+    assert [packet for _, packet in read] == [long_packet, short]
+    assert read[0][0] == -PRE_SKIP
+
+    # Starting on the continuation page drops the packet whose beginning was never read
+    reader = OggOpusReader(path)
+    entries = reader.scan_pages()
+    assert [granule for granule, _ in entries] == [2 * FRAME_SAMPLES]
+    assert [packet for _, packet in reader.iter_packets(entries[0][1])] == [short]
+    reader.close()
+
+@pytest.mark.parametrize("seconds", [0.0, 0.01, 3.0, 3.019, 7.5, 9.98])
+def test_seeking_starts_at_the_packet_holding_the_sample(opus_file, seconds):
+    path, packets = opus_file
+    sample = int(seconds * 48000)
+    position, packet = read_all(path, sample)[0]
+    assert position <= sample < position + FRAME_SAMPLES
+    assert packet == packets[(position + PRE_SKIP) // FRAME_SAMPLES]
+
+def test_stored_seek_index_round_trip(opus_file):
+    path, _ = opus_file
+    entries = write_page_index(path)
+    assert os.path.exists(get_index_path(path))
+    granules, offsets = load_page_index(path)
+    assert list(zip(granules, offsets)) == entries
+    assert granules[-1] == 500 * FRAME_SAMPLES
+
+    reader = OggOpusReader(path)
+    assert reader.scan_pages() == entries
+    reader.close()
+    assert read_all(path, 5 * 48000)[0][0] <= 5 * 48000
+
+def test_seek_index_older_than_its_track_is_ignored(opus_file):
+    path, _ = opus_file
+    write_page_index(path)
+    mtime = os.path.getmtime(path)
+    os.utime(get_index_path(path), (mtime - 10, mtime - 10))
+    assert load_page_index(path) is None
+
+def test_source_loops_gaplessly_between_loop_points(opus_file):
+    path, packets = opus_file
+    loops = []
+    loop_start, loop_end = 100 * FRAME_SAMPLES, 110 * FRAME_SAMPLES
+    source = OggOpusSource(path, start_seconds=loop_start / 48000, should_loop=lambda: True,
+                           loop_start=loop_start, loop_end=loop_end, on_loop=loops.append)
+    read = [source.read() for _ in range(25)]
+    source.cleanup()
+
+    first = (loop_start + PRE_SKIP) // FRAME_SAMPLES
+    cycle = packets[first:(loop_end + PRE_SKIP) // FRAME_SAMPLES + 1]
+    assert read == (cycle * 3)[:25]
+    assert loops == [loop_start / 48000] * 2
+
+def test_source_seeks_in_place_and_stops_at_the_end(opus_file):
+    path, packets = opus_file
+    source = OggOpusSource(path)
+    source.seek(9.9)
+    assert source.position == 9.9
+    tail = iter(source.read, b'')
+    assert list(tail) == packets[-5:]
+    assert source.position == pytest.approx((499 * FRAME_SAMPLES - PRE_SKIP) / 48000)
+    source.cleanup()
@@ -0,0 +1,17 @@
+import asyncio
+
+def test_play_requests_report_their_outcome(engine, monkeypatch):
+    async def start_playback(session, filepath, seek_to, settle):
+        await asyncio.sleep(0.05)
+        return filepath != "broken.flac"
+    monkeypatch.setattr(engine, 'start_playback', start_playback)
+    session = engine.PlaybackState("guild", "Guild")
+
+    async def burst():
+        first = asyncio.ensure_future(engine.play_audio_logic(None, session, "a.flac"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(engine.play_audio_logic(None, session, "b.flac"))
+        return await first, await second, await engine.play_audio_logic(None, session, "broken.flac")
+
+    assert asyncio.run(burst()) == (engine.PLAY_SUPERSEDED, engine.PLAY_STARTED, engine.PLAY_FAILED)
+    assert session.pending_track() is None
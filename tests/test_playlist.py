@@ -0,0 +1,88 @@
+import types
+
+import pytest
+
+pytest.importorskip("discord")
+
+from src.ogg_opus import OggOpusSource, get_packet_cache
+from src.playlist import TrackQueue, QueueSource, PreparedTrack, PREBUFFER_FRAMES
+from src.playback_clock import FRAME_SECONDS
+from conftest import opus_packets, write_ogg_opus
+
+class FakeSession:
+    def __init__(self):
+        self.is_looping = False
+        self.queue = TrackQueue()
+        self.crossfade_seconds = 0.0
+        self.mixer = types.SimpleNamespace(active=lambda: False)
+        self.current_voice_client = None
+
+@pytest.fixture(autouse=True)
+def no_packet_cache():
+    yield
+    get_packet_cache().clear()
+
+@pytest.fixture
+def tracks(tmp_path):
+    return [write_ogg_opus(str(tmp_path / f"{name}.opus"), opus_packets(300)) for name in ("a", "b")]
+
+def open_track(path, start_seconds=0.0):
+    source = OggOpusSource(path, start_seconds=start_seconds)
+    return source, source.reader.duration()
+
+def test_track_queue_repeat_all_requeues_finished_track():
+    queue = TrackQueue()
+    queue.add("a")
+    queue.add("b")
+    queue.set_repeat_all(True)
+    assert queue.pop_next("current") == "a"
+    assert queue.snapshot() == ["b", "current"]
+    assert queue.peek() == "b"
+
+def test_prebuffered_frames_do_not_move_the_position(tracks):
+    source, duration = open_track(tracks[0], start_seconds=2.0)
+    prepared = PreparedTrack(tracks[0], source, duration)
+    prepared.prebuffer(PREBUFFER_FRAMES)
+    assert len(prepared.frames) == PREBUFFER_FRAMES
+    assert prepared.track_position() == pytest.approx(2.0, abs=FRAME_SECONDS)
+
+    for _ in range(10):
+        prepared.read()
+    assert prepared.track_position() == pytest.approx(2.0 + 10 * FRAME_SECONDS, abs=FRAME_SECONDS)
+    prepared.cleanup()
+
+def test_position_right_after_advance_is_the_start_of_the_next_track(tracks):
+    session = FakeSession()
+    session.queue.add(tracks[1])
+    changes = []
+    source, duration = open_track(tracks[0])
+    queue_source = QueueSource(session, tracks[0], source, duration, open_track,
+                               lambda *change: changes.append(change))
+    queue_source.prepare(tracks[1])
+    assert queue_source.next is not None and len(queue_source.next.frames) == PREBUFFER_FRAMES
+
+    assert queue_source.advance()
+    (filepath, _, position), = changes
+    assert filepath == tracks[1]
+    assert position == pytest.approx(0.0, abs=FRAME_SECONDS)
+    assert session.queue.snapshot() == []
+    queue_source.cleanup()
+
+def test_crossfade_waits_for_buffered_frames(tracks):
+    session = FakeSession()
+    session.crossfade_seconds = 2.0
+    session.queue.add(tracks[1])
+    source, duration = open_track(tracks[0], start_seconds=duration_of(tracks[0]) - 2.5)
+    current = PreparedTrack(tracks[0], source, duration, duration - 2.5)
+    current.prebuffer(PREBUFFER_FRAMES)  # Reads the source up to 1.5 s before its end
+    queue_source = QueueSource(session, tracks[0], source, duration, open_track, lambda *change: None)
+    queue_source.current = current
+    queue_source.prepare(tracks[1])
+    # 2.5 s remain to be played, so the 2 s crossfade has not started yet
+    assert queue_source.crossfade_gain() is None
+    queue_source.cleanup()
+
+def duration_of(path):
+    source, duration = open_track(path)
+    source.cleanup()
+    return duration
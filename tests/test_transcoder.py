@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("discord")
+
+from src import transcoder
+from src.transcoder import TranscodeScheduler, PRIORITY_NOW, PRIORITY_VISIBLE, PRIORITY_BACKGROUND
+
+class FakeEngine:
+    """Stands in for the audio engine's transcode functions; transcode() blocks while `gate` is closed."""
+    def __init__(self, monkeypatch):
+        self.runs = []
+        self.optimized = set()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+        self.result = True
+        self.claim_released = threading.Event()
+        self.claim_released.set()
+        monkeypatch.setattr(transcoder, 'wait_for_cache_write', lambda path, timeout: self.claim_released.wait(timeout))
+        monkeypatch.setattr(transcoder, 'CLAIM_POLL_SECONDS', 0.01)
+        monkeypatch.setattr(transcoder, 'transcode_to_opus', self.transcode)
+        monkeypatch.setattr(transcoder, 'is_file_optimized', lambda path: path in self.optimized)
+        monkeypatch.setattr(transcoder, 'report_cache_status', lambda path, optimized: None)
+        monkeypatch.setattr(transcoder, 'get_audio_duration', lambda path: 1.0)
+        monkeypatch.setattr(transcoder, 'enforce_budget', lambda: 0)
+
+    def transcode(self, filepath, threads=None, low_priority=False, on_process=None):
+        self.runs.append(filepath)
+        self.started.set()
+        self.gate.wait(5)
+        result = self.result(filepath) if callable(self.result) else self.result
+        if result:
+            self.optimized.add(filepath)
+        return result
+
+@pytest.fixture
+def fake(monkeypatch):
+    return FakeEngine(monkeypatch)
+
+@pytest.fixture
+def scheduler():
+    scheduler = TranscodeScheduler(workers=1, low_priority=False)
+    yield scheduler
+    scheduler.shutdown()
+
+def paths(tmp_path, *names):
+    return [str(tmp_path / name) for name in names]
+
+def test_jobs_run_most_urgent_first(fake, scheduler, tmp_path):
+    blocker, background, visible, now = paths(tmp_path, "blocker", "background", "visible", "now")
+    fake.gate.clear()
+    scheduler.submit([blocker])
+    assert fake.started.wait(5)
+    scheduler.submit([background], PRIORITY_BACKGROUND)
+    scheduler.submit([visible], PRIORITY_VISIBLE)
+    scheduler.submit([now], PRIORITY_NOW)
+    fake.gate.set()
+    stats = scheduler.run_batch([])
+    assert fake.runs == [blocker, now, visible, background]
+    assert stats.files_done == 4
+
+def test_promotion_is_undone_when_the_slot_moves_on(fake, scheduler, tmp_path):
+    blocker, first, second = paths(tmp_path, "blocker", "first", "second")
+    fake.gate.clear()
+    scheduler.submit([blocker])
+    assert fake.started.wait(5)
+    scheduler.submit([first, second], PRIORITY_BACKGROUND)
+    scheduler.promote(second, "hover")
+    scheduler.promote(first, "hover")
+    assert scheduler.jobs[second].priority == PRIORITY_BACKGROUND
+    assert scheduler.jobs[first].priority == PRIORITY_NOW
+    fake.gate.set()
+    scheduler.run_batch([])
+    assert fake.runs == [blocker, first, second]
+
+def test_cancel_owner_withdraws_its_queued_jobs(fake, scheduler, tmp_path):
+    blocker, mine = paths(tmp_path, "blocker", "mine")
+    owner = type("Owner", (), {})()
+    fake.gate.clear()
+    scheduler.submit([blocker])
+    assert fake.started.wait(5)
+    scheduler.submit([mine], owner=owner)
+    scheduler.cancel_owner(owner)
+    scheduler.submit([mine], owner=owner)  # Retired owners are ignored
+    fake.gate.set()
+    scheduler.run_batch([])
+    assert fake.runs == [blocker]
+
+def test_file_submitted_while_running_runs_again(fake, scheduler, tmp_path):
+    track, = paths(tmp_path, "track")
+    fake.gate.clear()
+    # The first run finds the entry claimed by a first-play tee
+    fake.result = lambda path: None if len(fake.runs) == 1 else True
+    scheduler.submit([track])
+    assert fake.started.wait(5)
+    scheduler.submit([track], PRIORITY_NOW)  # The tee committed and hands the file back
+    fake.gate.set()
+    stats = scheduler.run_batch([])
+    assert fake.runs == [track, track]
+    assert track in fake.optimized
+    assert stats.files_done == 1
+
+def test_job_waits_for_another_writer_of_its_entry(fake, scheduler, tmp_path):
+    track, = paths(tmp_path, "track")
+    fake.result = lambda path: None if len(fake.runs) == 1 else True
+    fake.claim_released.clear()
+    scheduler.submit([track])
+    assert fake.started.wait(5)
+    assert not scheduler.stats.files_done and track in scheduler.jobs  # Still waiting, not dropped
+    fake.claim_released.set()
+    stats = scheduler.run_batch([])
+    assert fake.runs == [track, track]
+    assert stats.files_done == 1
+
+def test_waiting_job_can_be_cancelled(fake, scheduler, tmp_path):
+    track, = paths(tmp_path, "track")
+    fake.result = None
+    fake.claim_released.clear()
+    scheduler.submit([track])
+    assert fake.started.wait(5)
+    scheduler.cancel([track])
+    deadline = time.monotonic() + 5
+    while scheduler.last_stats is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fake.runs == [track]
+    assert scheduler.last_stats.files_cancelled == 1
+
+@pytest.mark.skipif(not hasattr(os, 'setpriority'), reason="POSIX niceness")
+@pytest.mark.parametrize("low_priority", [False, True])
+def test_background_children_run_below_the_bot(engine, low_priority):
+    output = []
+    script = "import os, time; time.sleep(0.3); print(os.getpriority(os.PRIO_PROCESS, 0))"
+    engine.run_ffmpeg([sys.executable, "-c", script], "transcode", low_priority, on_output=output.append)
+    expected = os.getpriority(os.PRIO_PROCESS, 0) + (engine.BACKGROUND_NICENESS if low_priority else 0)
+    assert int(b"".join(output)) == min(expected, 19)